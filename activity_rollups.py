@@ -0,0 +1,414 @@
+#!/usr/bin/env python3
+"""
+Incremental Daily and Hourly Activity Rollups per Participant
+
+Keeps a small SQLite store of per-participant summaries that the wellbeing
+map/timeline views and compliance dashboards can read directly:
+
+- hourly: fixes, coverage (5-minute slots with a fix), distance travelled and
+  radius of gyration for every participant-hour
+- daily:  the same per participant-day, plus the first and last fix
+
+The store is updated incrementally. Only the participant-hours and
+participant-days that new points fall in are recomputed, so a new export
+costs time proportional to its new points, not to the whole trace archive.
+
+To merge points that arrive late, the store also keeps each participant's
+fixes of the last `merge_window_days` (31 by default, about two survey
+waves) before their newest fix, keyed by time and position, so it stays
+small however long the study runs. A point that is already in the store is
+skipped (and counted per participant), which makes re-applying a cumulative
+Qualtrics export, or the overlap the app resends between uploads, a no-op.
+Within the window, points may arrive in any order: an older wave processed
+after a newer one, or a late app export, is merged into the hours it falls
+in, and the hour of the next later fix is recomputed too, since the distance
+travelled into it changes. Points older than the window can't be told apart
+from ones already rolled up, so they are left out and counted.
+
+Usage:
+    python activity_rollups.py update rollups.sqlite decrypted_locations.csv
+    python activity_rollups.py update rollups.sqlite new_export.csv --utc-offset 2
+    python activity_rollups.py export rollups.sqlite -o daily_rollups.csv
+    python activity_rollups.py export rollups.sqlite --hourly --participant <uuid> -o hourly.csv
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from decrypt_location_data import ExternalSorter, parse_timestamp
+from join_responses_locations import EARTH_RADIUS_M, haversine_m
+
+SLOT_SECONDS = 300
+SLOTS_PER_HOUR = 3600 // SLOT_SECONDS
+# Stores from before fixes were kept can't merge late points
+STORE_VERSION = '2'
+# Days of fixes kept before each participant's newest one, for merging late points
+MERGE_WINDOW_DAYS = 31
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS participants (
+    participant_uuid TEXT PRIMARY KEY,
+    ref_latitude REAL, ref_longitude REAL,
+    last_epoch REAL, last_latitude REAL, last_longitude REAL,
+    points_skipped INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS fixes (
+    participant_uuid TEXT NOT NULL,
+    epoch REAL NOT NULL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    PRIMARY KEY (participant_uuid, epoch, latitude, longitude)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hourly (
+    participant_uuid TEXT NOT NULL,
+    hour_epoch INTEGER NOT NULL,
+    hour_start TEXT NOT NULL,
+    day TEXT NOT NULL,
+    fixes INTEGER NOT NULL,
+    coverage_mask INTEGER NOT NULL,
+    coverage_hours REAL NOT NULL,
+    distance_m REAL NOT NULL,
+    radius_of_gyration_m REAL,
+    sum_x REAL NOT NULL, sum_y REAL NOT NULL, sum_sq REAL NOT NULL,
+    first_epoch REAL NOT NULL, last_epoch REAL NOT NULL,
+    PRIMARY KEY (participant_uuid, hour_epoch)
+);
+CREATE INDEX IF NOT EXISTS idx_hourly_day ON hourly (participant_uuid, day);
+CREATE TABLE IF NOT EXISTS daily (
+    participant_uuid TEXT NOT NULL,
+    day TEXT NOT NULL,
+    fixes INTEGER NOT NULL,
+    coverage_hours REAL NOT NULL,
+    distance_m REAL NOT NULL,
+    radius_of_gyration_m REAL,
+    first_fix TEXT, last_fix TEXT,
+    PRIMARY KEY (participant_uuid, day)
+);
+CREATE INDEX IF NOT EXISTS idx_daily_day ON daily (day);
+"""
+
+DAILY_FIELDNAMES = ['participant_uuid', 'day', 'fixes', 'coverage_hours', 'distance_m',
+                    'radius_of_gyration_m', 'first_fix', 'last_fix']
+HOURLY_FIELDNAMES = ['participant_uuid', 'hour_start', 'day', 'fixes', 'coverage_hours', 'distance_m',
+                     'radius_of_gyration_m']
+
+def radius_of_gyration(count, sum_x, sum_y, sum_sq):
+    """Radius of gyration in metres from the sums of projected coordinates"""
+    if not count:
+        return None
+    mean_x, mean_y = sum_x / count, sum_y / count
+    return round(math.sqrt(max(0.0, sum_sq / count - mean_x * mean_x - mean_y * mean_y)), 1)
+
+def point_participant(point):
+    participant = point.get('participant_uuid')
+    if not participant or participant == 'Unknown':
+        participant = point.get('participant_code')
+    if participant and participant != 'Unknown':
+        return participant
+    # Points written with --compact-participants only have participant_id
+    participant_id = point.get('participant_id')
+    return str(participant_id) if participant_id not in (None, '') else None
+
+class RollupStore:
+    """SQLite store of hourly and daily rollups, updated incrementally"""
+    def __init__(self, path, utc_offset_hours=None, merge_window_days=MERGE_WINDOW_DAYS):
+        self.path = path
+        self.merge_window_seconds = merge_window_days * 86400
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        stored = self.connection.execute("SELECT value FROM meta WHERE key = 'utc_offset_hours'").fetchone()
+        if stored is None:
+            self.utc_offset_hours = utc_offset_hours or 0.0
+            self.connection.execute("INSERT INTO meta VALUES ('utc_offset_hours', ?)", (str(self.utc_offset_hours),))
+            self.connection.commit()
+        else:
+            self.utc_offset_hours = float(stored[0])
+            if utc_offset_hours is not None and utc_offset_hours != self.utc_offset_hours:
+                raise ValueError(f"{path} uses UTC offset {self.utc_offset_hours:g}h, not {utc_offset_hours:g}h")
+        self.offset_seconds = int(self.utc_offset_hours * 3600)
+        version = self.connection.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+        if version is None:
+            if self.connection.execute("SELECT 1 FROM hourly LIMIT 1").fetchone():
+                raise ValueError(f"{path} was made by an older version of this tool; "
+                                 "rebuild it from the decrypted CSVs")
+            self.connection.execute("INSERT INTO meta VALUES ('version', ?)", (STORE_VERSION,))
+            self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def _local(self, epoch):
+        return datetime.fromtimestamp(epoch, tz=timezone(timedelta(seconds=self.offset_seconds)))
+
+    def _hour_epoch(self, epoch):
+        local_epoch = int(epoch) + self.offset_seconds
+        return local_epoch - local_epoch % 3600 - self.offset_seconds
+
+    def _compute_hour(self, participant, hour_epoch, ref_lat, ref_lon):
+        """Rollup state of one participant-hour from its stored fixes"""
+        bucket = {'fixes': 0, 'coverage_mask': 0, 'distance_m': 0.0, 'sum_x': 0.0, 'sum_y': 0.0,
+                  'sum_sq': 0.0, 'first_epoch': None, 'last_epoch': None}
+        # The step from the previous fix counts towards the hour it ends in
+        previous = self.connection.execute(
+            "SELECT latitude, longitude FROM fixes WHERE participant_uuid = ? AND epoch < ? "
+            "ORDER BY epoch DESC, latitude DESC, longitude DESC LIMIT 1", (participant, hour_epoch)
+        ).fetchone()
+        scale_x = EARTH_RADIUS_M * math.cos(math.radians(ref_lat))
+        for epoch, lat, lon in self.connection.execute(
+                "SELECT epoch, latitude, longitude FROM fixes WHERE participant_uuid = ? AND epoch >= ? AND epoch < ? "
+                "ORDER BY epoch, latitude, longitude", (participant, hour_epoch, hour_epoch + 3600)):
+            # Local equirectangular projection around the participant's first fix
+            x = math.radians(lon - ref_lon) * scale_x
+            y = math.radians(lat - ref_lat) * EARTH_RADIUS_M
+            bucket['fixes'] += 1
+            bucket['coverage_mask'] |= 1 << (((int(epoch) + self.offset_seconds) % 3600) // SLOT_SECONDS)
+            bucket['sum_x'] += x
+            bucket['sum_y'] += y
+            bucket['sum_sq'] += x * x + y * y
+            if bucket['first_epoch'] is None:
+                bucket['first_epoch'] = epoch
+            bucket['last_epoch'] = epoch
+            if previous is not None:
+                bucket['distance_m'] += haversine_m(previous[0], previous[1], lat, lon)
+            previous = (lat, lon)
+        return bucket
+
+    def _save_hour(self, participant, hour_epoch, bucket):
+        local = self._local(hour_epoch)
+        self.connection.execute(
+            "INSERT OR REPLACE INTO hourly VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (participant, hour_epoch, local.strftime('%Y-%m-%dT%H:00'), local.strftime('%Y-%m-%d'),
+             bucket['fixes'], bucket['coverage_mask'],
+             round(bin(bucket['coverage_mask']).count('1') / SLOTS_PER_HOUR, 3),
+             bucket['distance_m'],
+             radius_of_gyration(bucket['fixes'], bucket['sum_x'], bucket['sum_y'], bucket['sum_sq']),
+             bucket['sum_x'], bucket['sum_y'], bucket['sum_sq'], bucket['first_epoch'], bucket['last_epoch'])
+        )
+
+    def _refresh_day(self, participant, day):
+        row = self.connection.execute(
+            "SELECT SUM(fixes), SUM(coverage_hours), SUM(distance_m), SUM(sum_x), SUM(sum_y), SUM(sum_sq), "
+            "MIN(first_epoch), MAX(last_epoch) FROM hourly WHERE participant_uuid = ? AND day = ?",
+            (participant, day)
+        ).fetchone()
+        fixes, coverage, distance, sum_x, sum_y, sum_sq, first, last = row
+        self.connection.execute(
+            "INSERT OR REPLACE INTO daily VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (participant, day, fixes, round(coverage, 3), round(distance, 1),
+             radius_of_gyration(fixes, sum_x, sum_y, sum_sq),
+             self._local(first).isoformat(timespec='seconds'), self._local(last).isoformat(timespec='seconds'))
+        )
+
+    def _merge_from(self, newest_epoch):
+        """Start of the hour from which a participant's fixes are kept"""
+        return self._hour_epoch(newest_epoch - self.merge_window_seconds)
+
+    def _prune_fixes(self, participant, newest_epoch):
+        """Forget the fixes before the merge window, except the last one (where the window's first step starts)"""
+        anchor = self.connection.execute(
+            "SELECT MAX(epoch) FROM fixes WHERE participant_uuid = ? AND epoch < ?",
+            (participant, self._merge_from(newest_epoch))
+        ).fetchone()[0]
+        if anchor is not None:
+            self.connection.execute("DELETE FROM fixes WHERE participant_uuid = ? AND epoch < ?", (participant, anchor))
+
+    def _apply_participant(self, participant, points):
+        """Roll up one participant's points (in time order); returns (applied, skipped, late, days_updated)"""
+        state = self.connection.execute(
+            "SELECT ref_latitude, ref_longitude, last_epoch FROM participants WHERE participant_uuid = ?",
+            (participant,)
+        ).fetchone()
+        ref_lat, ref_lon, newest = state if state is not None else (None, None, None)
+        merge_from = self._merge_from(newest) if newest is not None else None
+
+        hours = set()
+        applied = skipped = late = 0
+        insert = "INSERT OR IGNORE INTO fixes VALUES (?, ?, ?, ?)"
+        for epoch, lat, lon in points:
+            if merge_from is not None and epoch < merge_from:
+                # Its neighbours are no longer kept, nor whether it was rolled up already
+                late += 1
+                continue
+            if not self.connection.execute(insert, (participant, epoch, lat, lon)).rowcount:
+                skipped += 1
+                continue
+            if ref_lat is None:
+                ref_lat, ref_lon = lat, lon
+            hours.add(self._hour_epoch(epoch))
+            applied += 1
+        if applied:
+            # A new fix can be the previous fix of a later hour; that hour's distance changes too
+            for hour_epoch in list(hours):
+                following = self.connection.execute(
+                    "SELECT MIN(epoch) FROM fixes WHERE participant_uuid = ? AND epoch >= ?",
+                    (participant, hour_epoch + 3600)
+                ).fetchone()[0]
+                if following is not None:
+                    hours.add(self._hour_epoch(following))
+
+        days = set()
+        for hour_epoch in sorted(hours):
+            self._save_hour(participant, hour_epoch, self._compute_hour(participant, hour_epoch, ref_lat, ref_lon))
+            days.add(self._local(hour_epoch).strftime('%Y-%m-%d'))
+        for day in days:
+            self._refresh_day(participant, day)
+
+        last = self.connection.execute(
+            "SELECT epoch, latitude, longitude FROM fixes WHERE participant_uuid = ? "
+            "ORDER BY epoch DESC, latitude DESC, longitude DESC LIMIT 1", (participant,)
+        ).fetchone()
+        if last is not None:
+            self._prune_fixes(participant, last[0])
+        # Not an upsert (INSERT ... ON CONFLICT), which needs SQLite 3.24
+        self.connection.execute("INSERT OR IGNORE INTO participants (participant_uuid, ref_latitude, ref_longitude) "
+                                "VALUES (?, ?, ?)", (participant, ref_lat, ref_lon))
+        self.connection.execute(
+            "UPDATE participants SET last_epoch = ?, last_latitude = ?, last_longitude = ?, "
+            "points_skipped = points_skipped + ? WHERE participant_uuid = ?",
+            (*(last if last else (None, None, None)), skipped + late, participant)
+        )
+        return applied, skipped, late, len(days)
+
+    def update(self, points, run_size=500000):
+        """Apply new points (dicts with participant_uuid, timestamp, latitude, longitude)
+
+        Points may come in any order; they are sorted by participant and time
+        out of core first. Returns a dict of applied, skipped (already rolled
+        up), late (older than the merge window) and invalid points, and the
+        number of participant-days rewritten.
+        """
+        totals = {'applied': 0, 'skipped': 0, 'late': 0, 'invalid': 0, 'days_updated': 0}
+        sorter = ExternalSorter(run_size=run_size)
+        try:
+            for point in points:
+                participant = point_participant(point)
+                epoch = parse_timestamp(point.get('timestamp'))
+                try:
+                    lat, lon = float(point.get('latitude')), float(point.get('longitude'))
+                except (TypeError, ValueError):
+                    lat = lon = None
+                if participant is None or epoch is None or lat is None or lon is None:
+                    totals['invalid'] += 1
+                    continue
+                sorter.append((participant, epoch, lat, lon))
+
+            with self.connection:
+                for participant, group in itertools.groupby(sorter, key=lambda p: p[0]):
+                    applied, skipped, late, days = self._apply_participant(participant, (p[1:] for p in group))
+                    totals['applied'] += applied
+                    totals['skipped'] += skipped
+                    totals['late'] += late
+                    totals['days_updated'] += days
+        finally:
+            sorter.close()
+        return totals
+
+    def update_from_csv(self, points_csv, run_size=500000):
+        with open(points_csv, 'r', encoding='utf-8', newline='') as file:
+            return self.update(csv.DictReader(file), run_size)
+
+    def rows(self, hourly=False, participant=None, since=None):
+        """Yield rollup rows as dicts, ordered by participant and time"""
+        table, fieldnames, order = ('hourly', HOURLY_FIELDNAMES, 'hour_epoch') if hourly else ('daily', DAILY_FIELDNAMES, 'day')
+        conditions, parameters = [], []
+        if participant:
+            conditions.append('participant_uuid = ?')
+            parameters.append(participant)
+        if since:
+            conditions.append('day >= ?')
+            parameters.append(since)
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ''
+        # Hourly distances are stored unrounded so that they add up exactly
+        columns = ['ROUND(distance_m, 1)' if name == 'distance_m' else name for name in fieldnames]
+        cursor = self.connection.execute(
+            f"SELECT {', '.join(columns)} FROM {table}{where} ORDER BY participant_uuid, {order}", parameters
+        )
+        for row in cursor:
+            yield dict(zip(fieldnames, row))
+
+def update(args):
+    for path in args.points:
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+    try:
+        store = RollupStore(args.store, args.utc_offset, args.merge_window_days)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    try:
+        for path in args.points:
+            totals = store.update_from_csv(path, args.run_size)
+            print(f"✅ {path}: rolled up {totals['applied']} new points "
+                  f"into {totals['days_updated']} participant-days")
+            if totals['skipped']:
+                print(f"   {totals['skipped']} points already in the rollups were skipped")
+            if totals['late']:
+                print(f"   {totals['late']} points more than {args.merge_window_days} days older than a "
+                      f"participant's newest fix could not be merged and were left out")
+            if totals['invalid']:
+                print(f"   {totals['invalid']} points without a participant, timestamp or coordinates were ignored")
+    finally:
+        store.close()
+
+def export(args):
+    if not Path(args.store).exists():
+        print(f"❌ Rollup store not found: {args.store}")
+        sys.exit(1)
+    store = RollupStore(args.store)
+    try:
+        fieldnames = HOURLY_FIELDNAMES if args.hourly else DAILY_FIELDNAMES
+        output = args.output or f"{'hourly' if args.hourly else 'daily'}_rollups_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+        count = 0
+        with open(output, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.DictWriter(out, fieldnames=fieldnames)
+            writer.writeheader()
+            for row in store.rows(args.hourly, args.participant, args.since):
+                writer.writerow(row)
+                count += 1
+        print(f"✅ Wrote {count} rows to: {output}")
+    finally:
+        store.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain per-participant daily and hourly activity rollups")
+    # Not add_subparsers(required=True), which needs Python 3.7
+    commands = parser.add_subparsers(dest='command')
+
+    update_parser = commands.add_parser('update', help="Add new decrypted points to the rollups")
+    update_parser.add_argument('store', help="Rollup store (SQLite file, created if missing)")
+    update_parser.add_argument('points', nargs='+', help="Decrypted location CSV(s)")
+    update_parser.add_argument('--utc-offset', type=float, default=None,
+                               help="Hours ahead of UTC used for days and hours, e.g. 2 for South Africa "
+                                    "(set when the store is created; default: 0)")
+    update_parser.add_argument('--merge-window-days', type=int, default=MERGE_WINDOW_DAYS,
+                               help="Days before each participant's newest fix in which late points are merged "
+                                    f"(default: {MERGE_WINDOW_DAYS})")
+    update_parser.add_argument('--run-size', type=int, default=500000,
+                               help="Points sorted in memory per run (default: 500000)")
+    update_parser.set_defaults(func=update)
+
+    export_parser = commands.add_parser('export', help="Write the rollups to CSV")
+    export_parser.add_argument('store', help="Rollup store (SQLite file)")
+    export_parser.add_argument('--hourly', action='store_true', help="Export hourly instead of daily rollups")
+    export_parser.add_argument('--participant', help="Only this participant_uuid")
+    export_parser.add_argument('--since', metavar='YYYY-MM-DD', help="Only days on or after this date")
+    export_parser.add_argument('-o', '--output', help="Output CSV (default: daily_rollups_<timestamp>.csv)")
+    export_parser.set_defaults(func=export)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("choose a command: update or export")
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
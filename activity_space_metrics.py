@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Activity-Space Metrics per Participant and Survey Wave
+
+Computes the project's activity-space measures for every survey response,
+over the participant's location points in the window before the response
+(the 14 days up to its RecordedDate by default, as in
+join_responses_locations.py):
+
+- radius of gyration: root mean square distance of the points from their
+  centroid
+- convex hull area: area of the smallest convex polygon around the points
+- standard deviational ellipse (SDE): the axes (one standard deviation) and
+  orientation of the spread of the points, and the ellipse area
+- unique cells: number of distinct map cells visited (Web Mercator zoom 18
+  by default, about 140 m in Gauteng)
+
+Distances and areas use a local flat projection around each window's
+centroid, which is accurate to well under 1% at the scale of a city.
+
+Points are sorted by participant and time out of core; each participant's
+points are then held as NumPy arrays, and every window is a slice of them
+found with a binary search. Participants are processed in parallel worker
+processes, with only a few in flight at a time. Output is one row per
+response, as CSV or Parquet (needs pyarrow).
+
+Usage:
+    python activity_space_metrics.py --responses export.csv --points decrypted_locations.csv -o metrics.csv
+    python activity_space_metrics.py --responses export.csv --points decrypted_locations.csv \\
+        --lookback-days 14 --workers 4 -o metrics.parquet
+    python activity_space_metrics.py --responses export.csv --points compact_locations.csv \\
+        --participant-index index.sqlite -o metrics.csv
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import format_timestamp
+from density_tiles import lonlat_to_cells
+from join_responses_locations import EARTH_RADIUS_M, external_sort_points, load_responses
+
+METRIC_FIELDNAMES = [
+    'response_id',
+    'participant_uuid',
+    'recorded_date',
+    'window_start',
+    'window_end',
+    'point_count',
+    'centroid_latitude',
+    'centroid_longitude',
+    'radius_of_gyration_m',
+    'convex_hull_area_km2',
+    'sde_major_m',
+    'sde_minor_m',
+    'sde_angle_deg',
+    'sde_area_km2',
+    'unique_cells',
+]
+
+def project_local(latitudes, longitudes):
+    """Equirectangular x, y in metres around the centroid; returns (x, y, centroid_lat, centroid_lon)"""
+    lat0, lon0 = latitudes.mean(), longitudes.mean()
+    x = np.radians(longitudes - lon0) * (EARTH_RADIUS_M * math.cos(math.radians(lat0)))
+    y = np.radians(latitudes - lat0) * EARTH_RADIUS_M
+    return x, y, lat0, lon0
+
+def convex_hull_area(x, y):
+    """Area of the convex hull of points (in the units of x and y, squared)"""
+    if len(x) < 3:
+        return 0.0
+    # Akl-Toussaint: drop the points inside the quadrilateral of the extreme
+    # points, which is most of them, before the (sequential) hull walk
+    extremes = [np.argmin(x), np.argmin(y), np.argmax(x), np.argmax(y)]
+    qx, qy = x[extremes], y[extremes]
+    inside = np.ones(len(x), dtype=bool)
+    for i in range(4):
+        ax, ay, bx, by = qx[i], qy[i], qx[(i + 1) % 4], qy[(i + 1) % 4]
+        inside &= (bx - ax) * (y - ay) - (by - ay) * (x - ax) > 0
+    points = np.unique(np.column_stack([x[~inside], y[~inside]]), axis=0)
+    if len(points) < 3:
+        return 0.0
+
+    # Andrew's monotone chain over the remaining points, sorted by x then y
+    def half(ordered):
+        chain = []
+        for p in ordered:
+            while len(chain) >= 2 and (
+                (chain[-1][0] - chain[-2][0]) * (p[1] - chain[-2][1])
+                - (chain[-1][1] - chain[-2][1]) * (p[0] - chain[-2][0])
+            ) <= 0:
+                chain.pop()
+            chain.append(p)
+        return chain[:-1]
+
+    ordered = points.tolist()
+    hull = np.array(half(ordered) + half(ordered[::-1]))
+    if len(hull) < 3:
+        return 0.0
+    hx, hy = hull[:, 0], hull[:, 1]
+    return 0.5 * abs(np.dot(hx, np.roll(hy, -1)) - np.dot(hy, np.roll(hx, -1)))
+
+def deviational_ellipse(x, y):
+    """(major, minor, angle) of the standard deviational ellipse of points centred on their mean
+
+    The axes are one standard deviation along the directions of greatest and
+    least spread; the angle is that of the major axis, clockwise from north.
+    """
+    covariance = np.cov(np.vstack([x, y]), bias=True)
+    variances, vectors = np.linalg.eigh(covariance)
+    minor, major = np.sqrt(np.clip(variances, 0.0, None))
+    east, north = vectors[:, 1]
+    angle = math.degrees(math.atan2(east, north)) % 180.0
+    return major, minor, angle
+
+def window_metrics(latitudes, longitudes, zoom=18):
+    """Activity-space metrics of one window's points"""
+    count = len(latitudes)
+    if not count:
+        return {'point_count': 0}
+    x, y, lat0, lon0 = project_local(latitudes, longitudes)
+    x -= x.mean()
+    y -= y.mean()
+    major, minor, angle = deviational_ellipse(x, y)
+    cell_x, cell_y = lonlat_to_cells(longitudes, latitudes, zoom)
+    return {
+        'point_count': count,
+        'centroid_latitude': round(float(lat0), 6),
+        'centroid_longitude': round(float(lon0), 6),
+        'radius_of_gyration_m': round(math.sqrt(float(np.mean(x * x + y * y))), 1),
+        'convex_hull_area_km2': round(convex_hull_area(x, y) / 1e6, 4),
+        'sde_major_m': round(float(major), 1),
+        'sde_minor_m': round(float(minor), 1),
+        'sde_angle_deg': round(angle, 1),
+        'sde_area_km2': round(math.pi * major * minor / 1e6, 4),
+        'unique_cells': len(np.unique((cell_x << zoom) | cell_y)),
+    }
+
+def participant_metrics(participant, epochs, latitudes, longitudes, responses, lookback_seconds, zoom=18):
+    """Metric rows for one participant's responses; `epochs` (and the coordinates) sorted by time"""
+    ends = np.array([response[1] for response in responses], dtype=float)
+    # Windows are (recorded - lookback, recorded], as in join_responses_locations
+    first = np.searchsorted(epochs, ends - lookback_seconds, side='right')
+    last = np.searchsorted(epochs, ends, side='right')
+    rows = []
+    for (_, end, response_id, recorded_date), i, j in zip(responses, first.tolist(), last.tolist()):
+        row = {
+            'response_id': response_id,
+            'participant_uuid': participant,
+            'recorded_date': recorded_date,
+            'window_start': format_timestamp(end - lookback_seconds),
+            'window_end': format_timestamp(end),
+        }
+        row.update(window_metrics(latitudes[i:j], longitudes[i:j], zoom))
+        rows.append(row)
+    return rows
+
+def _participant_task(args):
+    return participant_metrics(*args)
+
+def iter_participant_tasks(responses, points, lookback_seconds, zoom=18):
+    """Yield participant_metrics arguments per participant with responses, merging sorted responses and points"""
+    points = iter(points)
+    pending = next(points, None)
+    for participant, group in itertools.groupby(responses, key=lambda response: response[0]):
+        group = list(group)
+        while pending is not None and pending[0] < participant:
+            pending = next(points, None)
+        # Points after the participant's last response are not in any window
+        last_end = group[-1][1]
+        fixes = []
+        while pending is not None and pending[0] == participant:
+            if pending[1] <= last_end:
+                fixes.append(pending[1:4])
+            pending = next(points, None)
+        fixes = np.array(fixes, dtype=float).reshape(-1, 3)
+        yield participant, fixes[:, 0], fixes[:, 1], fixes[:, 2], group, lookback_seconds, zoom
+
+def iter_metrics(tasks, workers=None):
+    """Yield metric rows in task order, computing up to `workers` participants at a time"""
+    workers = workers or os.cpu_count() or 1
+    if workers == 1:
+        for task in tasks:
+            yield from _participant_task(task)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for task in tasks:
+            pending.append(executor.submit(_participant_task, task))
+            if len(pending) >= workers * 2:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+def write_metrics(rows, output, batch_size=10000):
+    """Write metric rows to CSV, or Parquet when `output` ends in .parquet; returns the row count"""
+    if not str(output).lower().endswith('.parquet'):
+        count = 0
+        with open(output, 'w', newline='', encoding='utf-8') as file:
+            writer = csv.DictWriter(file, fieldnames=METRIC_FIELDNAMES)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        return count
+
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    text = {'response_id', 'participant_uuid', 'recorded_date', 'window_start', 'window_end'}
+    schema = pa.schema([
+        (name, pa.string() if name in text else pa.int64() if name in ('point_count', 'unique_cells') else pa.float64())
+        for name in METRIC_FIELDNAMES
+    ])
+    rows = iter(rows)
+    count = 0
+    with pq.ParquetWriter(output, schema) as writer:
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            columns = {name: [row.get(name) for row in batch] for name in METRIC_FIELDNAMES}
+            writer.write_table(pa.Table.from_pydict(columns, schema=schema))
+            count += len(batch)
+    return count
+
+def compute_metrics(responses_csv, points_csv, output, lookback_days=14, zoom=18, workers=None,
+                    run_size=500000, tmp_dir=None, participant_index=None):
+    """Write one row of activity-space metrics per response; returns the number of responses
+
+    With a ParticipantIndex, responses are matched to points by participant_id
+    (see join_responses_locations.load_responses).
+    """
+    responses = load_responses(responses_csv, participant_index)
+    points = external_sort_points(points_csv, run_size=run_size, tmp_dir=tmp_dir,
+                                  participant_column='participant_id' if participant_index is not None else None)
+    tasks = iter_participant_tasks(responses, points, lookback_days * 86400, zoom)
+    rows = iter_metrics(tasks, workers)
+    if participant_index is not None:
+        rows = (dict(row, participant_uuid=participant_index.lookup(row['participant_uuid'])[0] or row['participant_uuid'])
+                for row in rows)
+    return write_metrics(rows, output)
+
+def main():
+    parser = argparse.ArgumentParser(description="Activity-space metrics for the location window before each survey response")
+    parser.add_argument('--responses', required=True, help="Qualtrics CSV response export")
+    parser.add_argument('--points', required=True, help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--lookback-days', type=float, default=14, help="Window length before each response, in days (default: 14)")
+    parser.add_argument('--zoom', type=int, default=18, help="Cell zoom level for unique_cells (default: 18, about 140 m)")
+    parser.add_argument('--workers', type=int, help="Participants processed in parallel (default: one per CPU)")
+    parser.add_argument('--run-size', type=int, default=500000, help="Points sorted in memory per run (default: 500000)")
+    parser.add_argument('--tmp-dir', metavar='DIR', help="Directory for temporary sort runs (default: system temp)")
+    parser.add_argument('--participant-index', metavar='STORE',
+                        help="Participant index the points were decrypted with; match responses by participant_id")
+    parser.add_argument('-o', '--output', help="Output .csv or .parquet (default: activity_space_<timestamp>.csv)")
+    args = parser.parse_args()
+
+    for path in filter(None, (args.responses, args.points, args.participant_index)):
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+    participant_index = None
+    if args.participant_index:
+        from participant_index import ParticipantIndex
+        participant_index = ParticipantIndex(args.participant_index)
+
+    output = args.output or f"activity_space_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    print(f"📐 Computing activity-space metrics over the {args.lookback_days:g} days before each response...")
+    try:
+        count = compute_metrics(args.responses, args.points, output, args.lookback_days, args.zoom,
+                                args.workers, args.run_size, args.tmp_dir, participant_index)
+    except ImportError:
+        print("❌ Error: Required 'pyarrow' library not found.")
+        print("Please install it by running: pip install pyarrow")
+        sys.exit(1)
+    finally:
+        if participant_index is not None:
+            participant_index.close()
+    print(f"✅ Wrote metrics for {count} responses to: {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""
+Benchmarks for the Python research tooling
+
+Measures the parts of the survey and decryption tools that we run most often
+(pre-commit hooks, CI matrices, large exports) so changes can be compared
+before and after.
+
+Usage:
+    python benchmark_tooling.py                 # run every benchmark
+    python benchmark_tooling.py startup         # only the startup benchmark
+    python benchmark_tooling.py --repeat 20     # more repetitions
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import base64
+import contextlib
+import gzip
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import zipfile
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+SURVEY_DIR = ROOT_DIR / 'xlsform_surveys'
+
+def time_call(func, repeat):
+    """Run func `repeat` times and return the wall-clock durations in seconds"""
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+def format_durations(durations):
+    """Format a list of durations as 'min / median' milliseconds"""
+    return f"{min(durations) * 1000:8.1f} ms min / {statistics.median(durations) * 1000:8.1f} ms median"
+
+def benchmark_startup(repeat):
+    """Time a fresh interpreter importing each survey script"""
+    print("🚀 Startup (fresh interpreter, import only)")
+
+    def run(code):
+        subprocess.run([sys.executable, '-c', code], check=True, capture_output=True)
+
+    baseline = time_call(lambda: run('pass'), repeat)
+    print(f"   {'python -c pass':<24} {format_durations(baseline)}")
+
+    for module in ['create_qsf_surveys', 'create_xlsforms']:
+        code = f"import sys; sys.path.insert(0, {str(SURVEY_DIR)!r}); import {module}"
+        durations = time_call(lambda: run(code), repeat)
+        probe = subprocess.run(
+            [sys.executable, '-c', code + "; print('pandas' in sys.modules)"],
+            check=True, capture_output=True, text=True
+        )
+        pandas_loaded = probe.stdout.strip() == 'True'
+        overhead = (min(durations) - min(baseline)) * 1000
+        print(f"   {module:<24} {format_durations(durations)}  "
+              f"(+{overhead:.1f} ms, pandas loaded: {'yes' if pandas_loaded else 'no'})")
+
+def benchmark_qsf_conversion(repeat):
+    """Time converting the bundled XLSForm CSVs to QSF and serialising them"""
+    sys.path.insert(0, str(SURVEY_DIR))
+    from create_qsf_surveys import XLSFormToQSFConverter, QualtricsJSONEncoder
+
+    print("📝 QSF conversion (in-process)")
+    for prefix in ['biweekly', 'initial']:
+        def convert():
+            converter = XLSFormToQSFConverter()
+            qsf = converter.convert_survey_to_qsf(
+                SURVEY_DIR / f'{prefix}_survey_data.csv',
+                SURVEY_DIR / f'{prefix}_choices_data.csv',
+                SURVEY_DIR / f'{prefix}_settings_data.csv',
+                prefix
+            )
+            json.dump(qsf, io.StringIO(), indent=2, ensure_ascii=False, cls=QualtricsJSONEncoder)
+
+        print(f"   {prefix:<24} {format_durations(time_call(convert, repeat))}")
+
+def benchmark_xlsform_workbooks(repeat, choice_rows=50000):
+    """Compare streaming and in-memory workbook generation on a large choice sheet"""
+    sys.path.insert(0, str(SURVEY_DIR))
+    from create_xlsforms import create_xlsform_workbook
+
+    print(f"📊 XLSForm workbook ({choice_rows:,} choice rows, e.g. every suburb and ward)")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        choices_csv = tmp / 'choices.csv'
+        with open(choices_csv, 'w', encoding='utf-8') as f:
+            f.write('list_name,name,label\n')
+            for i in range(choice_rows):
+                f.write(f'suburb,suburb_{i},Suburb {i} (Ward {i % 529})\n')
+
+        for label, streaming in [('streaming', True), ('in-memory', False)]:
+            def build():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    create_xlsform_workbook(
+                        SURVEY_DIR / 'biweekly_survey_data.csv',
+                        choices_csv,
+                        SURVEY_DIR / 'biweekly_settings_data.csv',
+                        tmp / 'out.xlsx',
+                        streaming=streaming
+                    )
+
+            durations = time_call(build, max(1, repeat // 5))
+            tracemalloc.start()
+            build()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            print(f"   {label:<24} {format_durations(durations)}  (peak Python memory: {peak / 1e6:.1f} MB)")
+
+def benchmark_export_io(repeat, export_rows=2000, envelope_bytes=24000, points=300000):
+    """Throughput of reading plain/gzip/zip exports and writing plain/gzip/zstd output"""
+    sys.path.insert(0, str(ROOT_DIR))
+    from decrypt_location_data import LocationDecryptor, POINT_FIELDNAMES
+
+    print(f"📦 Export I/O ({export_rows:,} rows with {envelope_bytes // 1000} KB envelopes, {points:,} output points)")
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        plain = tmp / 'export.csv'
+        with open(plain, 'w', encoding='utf-8', newline='') as f:
+            f.write('ResponseId,participantUUID,RecordedDate,locationData\n')
+            f.write('Response ID,Participant UUID,Recorded Date,Location Data\n')
+            for i in range(export_rows):
+                # Encrypted payloads are base64 of random bytes, so compress like it
+                envelope = base64.b64encode(os.urandom(envelope_bytes * 3 // 4)).decode()
+                f.write(f'R_{i},uuid-{i % 200},2025-08-14 10:00:00,"{{""encryptedData"": ""{envelope}""}}"\n')
+        megabytes = plain.stat().st_size / 1e6
+        with open(plain, 'rb') as src, gzip.open(tmp / 'export.csv.gz', 'wb') as out:
+            out.write(src.read())
+        with zipfile.ZipFile(tmp / 'export.zip', 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(plain, 'export.csv')
+
+        for name in ['export.csv', 'export.csv.gz', 'export.zip']:
+            def read():
+                for _ in LocationDecryptor().iter_envelopes(tmp / name):
+                    pass
+            durations = time_call(read, max(1, repeat // 5))
+            size = (tmp / name).stat().st_size / 1e6
+            print(f"   read {name:<19} {format_durations(durations)}  "
+                  f"({megabytes / min(durations):6.1f} MB/s of CSV, file {size:.1f} MB)")
+
+        decryptor = LocationDecryptor()
+        decryptor.decrypted_locations = [
+            dict(zip(POINT_FIELDNAMES, ['P001', f'uuid-{i % 200}', '2025-08-14 10:00:00',
+                                        f'2025-08-{1 + i % 14:02d}T{i % 24:02d}:{i % 60:02d}:00',
+                                        -26.2 + (i % 997) * 1e-5, 28.0 + (i % 991) * 1e-5, 12.5, 0.8, 180.0, 1700.0]))
+            for i in range(points)
+        ]
+        outputs = ['points.csv', 'points.csv.gz']
+        try:
+            import zstandard  # noqa: F401
+            outputs.append('points.csv.zst')
+        except ImportError:
+            print("   (install zstandard to include .zst output)")
+        plain_size = None
+        for name in outputs:
+            def write():
+                with contextlib.redirect_stdout(io.StringIO()):
+                    decryptor.save_decrypted_data(tmp / name)
+            durations = time_call(write, max(1, repeat // 5))
+            size = (tmp / name).stat().st_size / 1e6
+            plain_size = plain_size or size
+            print(f"   write {name:<18} {format_durations(durations)}  "
+                  f"({plain_size / min(durations):6.1f} MB/s of CSV, file {size:.1f} MB)")
+
+BENCHMARKS = {
+    'startup': benchmark_startup,
+    'qsf': benchmark_qsf_conversion,
+    'xlsform': benchmark_xlsform_workbooks,
+    'io': benchmark_export_io,
+}
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the Wellbeing Mapper research tooling")
+    parser.add_argument('benchmarks', nargs='*', metavar='benchmark',
+                        help=f"Benchmarks to run: {', '.join(BENCHMARKS)} (default: all)")
+    parser.add_argument('--repeat', type=int, default=10, help="Repetitions per measurement (default: 10)")
+    args = parser.parse_args()
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark(s): {', '.join(unknown)}")
+
+    for name in args.benchmarks or BENCHMARKS:
+        BENCHMARKS[name](args.repeat)
+        print()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Typed Survey Response Decoder for Wellbeing Mapper Research
+
+Turns a Qualtrics CSV response export into a tidy, typed table using the QSF
+file of the survey. The QSF already records each question's DataExportTag,
+QuestionType, Selector, Choices and validation, so it is compiled once into
+per-column decoders:
+
+- single-answer choices become a label column plus an integer `<tag>_code` column
+- multiple-answer choices are split into one boolean `<tag>_<code>` column per choice
+- text entry with number/decimal validation is cast to int/float
+- everything else (including the encrypted location data) is passed through as text
+
+The export is streamed in batches of columns, so exports of any size can be
+decoded without loading them into memory.
+
+Usage:
+    python decode_survey_responses.py export.csv --qsf Biweekly_Wellbeing_Survey.qsf
+    python decode_survey_responses.py export.csv --qsf survey.qsf -o responses_typed.csv
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import json
+import sys
+from datetime import datetime
+from pathlib import Path
+
+# Qualtrics metadata columns that have a natural non-text type
+METADATA_TYPES = {
+    'Progress': int,
+    'Duration (in seconds)': int,
+    'Duration__in_seconds_': int,
+    'Finished': bool,
+    'Q_RecaptchaScore': float,
+    'LocationLatitude': float,
+    'LocationLongitude': float,
+}
+
+NUMBER_VALIDATION_TYPES = {
+    'ValidNumber': int,
+    'ValidDecimal': float,
+}
+
+def parse_bool(value):
+    """Parse a Qualtrics boolean ('True'/'False'/'1'/'0')"""
+    lowered = value.strip().lower()
+    if lowered in ('true', '1', 'yes'):
+        return True
+    if lowered in ('false', '0', 'no'):
+        return False
+    raise ValueError(f"not a boolean: {value!r}")
+
+def parse_int(value):
+    """Parse an integer, accepting values written as '12.0'"""
+    try:
+        return int(value)
+    except ValueError:
+        number = float(value)
+        if not number.is_integer():
+            raise
+        return int(number)
+
+CASTS = {
+    int: parse_int,
+    float: float,
+    bool: parse_bool,
+}
+
+def iter_response_rows(file):
+    """Yield the data rows of a Qualtrics CSV export as dicts
+
+    Qualtrics writes one or two extra header rows after the column names: the
+    question text, and (in newer exports) a row of {"ImportId": ...} JSON. Both
+    are skipped.
+    """
+    reader = csv.DictReader(file)
+    for index, row in enumerate(reader):
+        if index == 0:
+            continue  # Question text row
+        if index == 1 and any((value or '').startswith('{"ImportId"') for value in row.values()):
+            continue
+        yield row
+
+class ColumnDecoder:
+    """Decodes one export column into one or more typed output columns"""
+    def __init__(self, name):
+        self.name = name
+        self.columns = [name]
+        self.failures = 0
+
+    def decode(self, raw):
+        return [raw if raw else None]
+
+class CastColumn(ColumnDecoder):
+    """Casts a column to int/float/bool; unparseable values become None"""
+    def __init__(self, name, cast):
+        super().__init__(name)
+        self.cast = CASTS[cast]
+
+    def decode(self, raw):
+        if not raw or not raw.strip():
+            return [None]
+        try:
+            return [self.cast(raw)]
+        except ValueError:
+            self.failures += 1
+            return [None]
+
+class SingleChoiceColumn(ColumnDecoder):
+    """Maps a single-answer choice (exported as code or as label) to label and code"""
+    def __init__(self, name, choices):
+        super().__init__(name)
+        self.columns = [name, f"{name}_code"]
+        self.labels = {code: label for code, label in choices}
+        self.codes = {label: code for code, label in choices}
+        self.typed_codes = {code: (int(code) if code.lstrip('-').isdigit() else code) for code, _ in choices}
+
+    def decode(self, raw):
+        if not raw:
+            return [None, None]
+        if raw in self.labels:
+            return [self.labels[raw], self.typed_codes[raw]]
+        if raw in self.codes:
+            return [raw, self.typed_codes[self.codes[raw]]]
+        self.failures += 1
+        return [raw, None]
+
+class MultiChoiceColumn(ColumnDecoder):
+    """Splits a multiple-answer choice into one boolean column per choice"""
+    def __init__(self, name, choices):
+        super().__init__(name)
+        self.codes = [code for code, _ in choices]
+        self.columns = [f"{name}_{code}" for code in self.codes]
+        self.code_index = {code: i for i, code in enumerate(self.codes)}
+        # Labels may contain commas, so they are matched as runs of comma-separated
+        # parts, longest first: "Other, specify" before "Other"
+        self.label_parts = sorted(((label.split(','), self.code_index[code]) for code, label in choices if label),
+                                  key=lambda item: -len(item[0]))
+
+    def decode(self, raw):
+        if not raw:
+            return [None] * len(self.codes)
+        selected = [False] * len(self.codes)
+        parts = raw.split(',')
+        if all(part in self.code_index for part in parts):
+            for part in parts:
+                selected[self.code_index[part]] = True
+        else:
+            # Exported as choice text: each label consumes the parts it matched
+            position = 0
+            unmatched = False
+            while position < len(parts):
+                for label_parts, index in self.label_parts:
+                    if parts[position:position + len(label_parts)] == label_parts:
+                        selected[index] = True
+                        position += len(label_parts)
+                        break
+                else:
+                    unmatched = True
+                    position += 1
+            if unmatched:
+                self.failures += 1
+        return selected
+
+class SplitChoiceColumn(ColumnDecoder):
+    """A multiple-answer choice that Qualtrics already split into `<tag>_<code>` columns"""
+    def decode(self, raw):
+        return [bool(raw and raw.strip())]
+
+def load_qsf_questions(qsf_path):
+    """Return the question payloads from a QSF file
+
+    Handles both the QSF files we generate ("Type": "Question") and files
+    exported from Qualtrics ("Element": "SQ").
+    """
+    with open(qsf_path, 'r', encoding='utf-8') as f:
+        qsf_data = json.load(f)
+
+    return [
+        element['Payload'] for element in qsf_data.get('SurveyElements', [])
+        if element.get('Type') == 'Question' or element.get('Element') == 'SQ'
+    ]
+
+def question_choices(question):
+    """Return [(exported_code, label)] for a choice question, in display order"""
+    choices = question.get('Choices') or {}
+    if isinstance(choices, list):
+        # Qualtrics writes consecutive choice IDs starting at 1 as a JSON array
+        choices = {str(i): choice for i, choice in enumerate(choices, start=1) if choice}
+
+    order = [str(c) for c in question.get('ChoiceOrder') or choices.keys()]
+    recode = question.get('RecodeValues') or {}
+    return [
+        (str(recode.get(choice_id, choice_id)), choices[choice_id].get('Display', ''))
+        for choice_id in order if choice_id in choices
+    ]
+
+class SurveyResponseDecoder:
+    def __init__(self, qsf_path):
+        self.question_decoders = {}
+        self.split_columns = {}
+        self.last_decoders = []
+        self.compile(qsf_path)
+
+    def compile(self, qsf_path):
+        """Build the per-column decoders from the QSF questions"""
+        for question in load_qsf_questions(qsf_path):
+            qtype = question.get('QuestionType')
+            if qtype == 'DB':
+                continue  # Display text has no responses
+            tag = question.get('DataExportTag') or question.get('QuestionID')
+            if not tag:
+                continue
+
+            decoder = None
+            if qtype == 'MC':
+                choices = question_choices(question)
+                if question.get('Selector') in ('MAVR', 'MAHR', 'MACOL', 'MSB'):
+                    decoder = MultiChoiceColumn(tag, choices)
+                    self.split_columns.update(dict.fromkeys(decoder.columns))
+                else:
+                    decoder = SingleChoiceColumn(tag, choices)
+            elif qtype == 'TE':
+                settings = question.get('Validation', {}).get('Settings', {})
+                cast = NUMBER_VALIDATION_TYPES.get(settings.get('ContentType')) or NUMBER_VALIDATION_TYPES.get(settings.get('Type'))
+                if cast:
+                    decoder = CastColumn(tag, cast)
+
+            self.question_decoders[tag] = decoder or ColumnDecoder(tag)
+
+    def decoders_for_header(self, fieldnames):
+        """Pick a decoder for every column in the export header"""
+        decoders = []
+        for name in fieldnames:
+            if name in self.question_decoders:
+                decoders.append(self.question_decoders[name])
+            elif name in self.split_columns:
+                decoders.append(SplitChoiceColumn(name))
+            elif name in METADATA_TYPES:
+                decoders.append(CastColumn(name, METADATA_TYPES[name]))
+            else:
+                decoders.append(ColumnDecoder(name))
+        return decoders
+
+    def iter_batches(self, export_path, batch_size=10000):
+        """Stream the export as batches of typed columns ({column: [values]})"""
+        with open(export_path, 'r', encoding='utf-8-sig', newline='') as file:
+            rows = iter_response_rows(file)
+            first = next(rows, None)
+            if first is None:
+                return
+            fieldnames = list(first.keys())
+            decoders = self.decoders_for_header(fieldnames)
+            for decoder in decoders:
+                decoder.failures = 0
+            self.last_decoders = decoders
+            columns = [column for decoder in decoders for column in decoder.columns]
+
+            def empty_batch():
+                return {column: [] for column in columns}
+
+            batch = empty_batch()
+            count = 0
+            for row in itertools.chain([first], rows):
+                for name, decoder in zip(fieldnames, decoders):
+                    for column, value in zip(decoder.columns, decoder.decode(row.get(name) or '')):
+                        batch[column].append(value)
+                count += 1
+                if count == batch_size:
+                    yield batch
+                    batch = empty_batch()
+                    count = 0
+            if count:
+                yield batch
+
+    def decode_to_csv(self, export_path, output_path, batch_size=10000):
+        """Decode an export and write the typed table to CSV; returns the row count"""
+        row_count = 0
+        writer = None
+        with open(output_path, 'w', newline='', encoding='utf-8') as out:
+            for batch in self.iter_batches(export_path, batch_size):
+                if writer is None:
+                    writer = csv.writer(out)
+                    writer.writerow(list(batch.keys()))
+                writer.writerows(zip(*batch.values()))
+                row_count += len(next(iter(batch.values()), []))
+        return row_count
+
+    def failure_counts(self):
+        """Values that could not be mapped or cast, per column, from the last decode"""
+        return {d.name: d.failures for d in self.last_decoders if d.failures}
+
+def main():
+    parser = argparse.ArgumentParser(description="Decode a Qualtrics response export into a typed table using the survey QSF")
+    parser.add_argument('export', help="Qualtrics CSV response export")
+    parser.add_argument('--qsf', required=True, help="QSF file of the survey (generated or exported from Qualtrics)")
+    parser.add_argument('-o', '--output', help="Output CSV (default: responses_typed_<timestamp>.csv)")
+    parser.add_argument('--batch-size', type=int, default=10000, help="Rows decoded per batch (default: 10000)")
+    args = parser.parse_args()
+
+    for path in (args.export, args.qsf):
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+
+    output = args.output or f"responses_typed_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+    decoder = SurveyResponseDecoder(args.qsf)
+    print(f"📋 Compiled {len(decoder.question_decoders)} question decoders from {args.qsf}")
+
+    row_count = decoder.decode_to_csv(args.export, output, args.batch_size)
+    print(f"✅ Decoded {row_count} responses to: {output}")
+
+    failures = decoder.failure_counts()
+    if failures:
+        print("⚠️  Values that could not be mapped or cast (left as text/empty):")
+        for column, count in failures.items():
+            print(f"   {column}: {count}")
+
+if __name__ == '__main__':
+    main()
@@ -16,17 +16,45 @@ Usage:
 4. Follow the prompts to select your files
 5. The decrypted data will be saved as a new CSV file
 
+Files can also be given on the command line:
+    python decrypt_location_data.py --key private_key.pem --csv export.csv
+Run with --help for all options.
+
 Author: Wellbeing Mapper Development Team
 """
 
+import argparse
+import bisect
+import cProfile
 import csv
+import gzip
+import io
 import json
 import base64
+import hashlib
+import heapq
+import itertools
 import os
+import pickle
+import pstats
+import random
+import re
+import sqlite3
+import statistics
 import sys
-from datetime import datetime
+import tempfile
+import time
+import zipfile
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from pathlib import Path
 
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
 try:
     from cryptography.hazmat.primitives import serialization, hashes
     from cryptography.hazmat.primitives.asymmetric import rsa, padding
@@ -38,49 +66,669 @@ except ImportError:
     print("Then run this script again.")
     sys.exit(1)
 
-class LocationDecryptor:
+# Encrypted payloads of two weeks of points easily exceed the csv module's
+# default 128 KB field limit
+csv.field_size_limit(min(sys.maxsize, 2**31 - 1))
+
+# Columns of the decrypted output, one row per location point
+POINT_FIELDNAMES = [
+    'participant_code',
+    'participant_uuid',
+    'survey_date',
+    'timestamp',
+    'latitude',
+    'longitude',
+    'accuracy',
+    'speed',
+    'heading',
+    'altitude'
+]
+
+# ISO 8601 date and time, for Python 3.6 (no datetime.fromisoformat)
+ISO_TIMESTAMP = re.compile(
+    r'(\d{4})-(\d{2})-(\d{2})'
+    r'(?:[T ](\d{2}):(\d{2})(?::(\d{2})(?:\.(\d{1,6})\d*)?)?)?'
+    r'(?:([+-])(\d{2}):?(\d{2}))?$'
+)
+
+def _fromisoformat(value):
+    """datetime.fromisoformat for Pythons that don't have it; raises ValueError"""
+    match = ISO_TIMESTAMP.match(value)
+    if not match:
+        raise ValueError(f"Invalid isoformat string: {value!r}")
+    year, month, day, hour, minute, second, fraction, sign, offset_h, offset_m = match.groups()
+    tzinfo = None
+    if sign:
+        offset = timedelta(hours=int(offset_h), minutes=int(offset_m))
+        tzinfo = timezone(-offset if sign == '-' else offset)
+    return datetime(int(year), int(month), int(day), int(hour or 0), int(minute or 0), int(second or 0),
+                    int((fraction or '0').ljust(6, '0')), tzinfo=tzinfo)
+
+_iso_datetime = getattr(datetime, 'fromisoformat', _fromisoformat)
+
+def parse_timestamp(value):
+    """Parse a timestamp to epoch seconds, or None if it can't be parsed
+
+    Accepts ISO 8601 (as written by the app, with or without an offset), the
+    'YYYY-MM-DD HH:MM:SS' format of Qualtrics dates, and numeric epoch seconds
+    or milliseconds. Timestamps without an offset are treated as UTC, so the
+    app's local times and Qualtrics dates are compared on the same clock.
+    """
+    if value is None:
+        return None
+    value = str(value).strip()
+    if not value:
+        return None
+    try:
+        number = float(value)
+        return number / 1000.0 if number > 1e11 else number
+    except ValueError:
+        pass
+    try:
+        parsed = _iso_datetime(value.replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+def format_timestamp(epoch):
+    """Format epoch seconds as an ISO 8601 UTC timestamp"""
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+
+class PointDeduplicator:
+    """Drops location points that were already seen in an earlier payload
+
+    Consecutive uploads resend overlapping points, so a point is a duplicate
+    when its (participant, timestamp, latitude, longitude) was seen before.
+    Each participant's points arrive roughly in time order, so only the keys of
+    the last `window_seconds` per participant are kept in memory. Older keys, and
+    any beyond `max_memory_keys` in total, are spilled to an on-disk hash set
+    (SQLite), which is only consulted for points older than what was spilled.
+    Memory use is therefore bounded no matter how large the export is.
+    """
+    name = 'dedupe'
+
+    def __init__(self, window_seconds=14 * 86400, max_memory_keys=2000000, tmp_dir=None):
+        self.window_seconds = window_seconds
+        self.max_memory_keys = max_memory_keys
+        self.tmp_dir = tmp_dir
+        self.recent = {}  # participant -> {"keys": set, "order": deque[(t, key)], "high_water": t, "spilled_until": t}
+        self.memory_keys = 0
+        self.duplicates_dropped = 0
+        self._disk = None
+        self._disk_path = None
+
+    def _point_key(self, participant, point):
+        raw = f"{participant}|{point.get('timestamp', '')}|{point.get('latitude', '')}|{point.get('longitude', '')}"
+        return hashlib.blake2b(raw.encode('utf-8'), digest_size=12).digest()
+
+    def _disk_set(self):
+        if self._disk is None:
+            handle, self._disk_path = tempfile.mkstemp(suffix='.sqlite', dir=self.tmp_dir)
+            os.close(handle)
+            self._disk = sqlite3.connect(self._disk_path)
+            self._disk.execute('PRAGMA journal_mode=OFF')
+            self._disk.execute('PRAGMA synchronous=OFF')
+            self._disk.execute('CREATE TABLE seen (key BLOB PRIMARY KEY) WITHOUT ROWID')
+        return self._disk
+
+    def _on_disk(self, key):
+        if self._disk is None:
+            return False
+        return self._disk.execute('SELECT 1 FROM seen WHERE key = ?', (key,)).fetchone() is not None
+
+    def _spill(self, state, count=None):
+        """Move the oldest `count` keys of a participant (or all expired ones) to disk"""
+        order, keys = state['order'], state['keys']
+        spilled = []
+        expire_before = state['high_water'] - self.window_seconds
+        while order and (len(spilled) < count if count is not None else order[0][0] < expire_before):
+            t, key = order.popleft()
+            keys.discard(key)
+            spilled.append((key,))
+            state['spilled_until'] = max(state['spilled_until'], t)
+        if spilled:
+            self._disk_set().executemany('INSERT OR IGNORE INTO seen VALUES (?)', spilled)
+            self.memory_keys -= len(spilled)
+
+    def _enforce_memory_limit(self):
+        while self.memory_keys > self.max_memory_keys:
+            largest = max(self.recent.values(), key=lambda state: len(state['order']))
+            self._spill(largest, count=max(1, len(largest['order']) // 2))
+
+    def is_duplicate(self, participant, point):
+        """Return True if the point was seen before; otherwise remember it"""
+        key = self._point_key(participant, point)
+        t = parse_timestamp(point.get('timestamp'))
+        if t is None:
+            # No usable time ordering, so go straight to the on-disk set
+            if self._on_disk(key):
+                return True
+            self._disk_set().execute('INSERT INTO seen VALUES (?)', (key,))
+            return False
+
+        state = self.recent.get(participant)
+        if state is None:
+            state = self.recent[participant] = {
+                'keys': set(), 'order': deque(), 'high_water': t, 'spilled_until': float('-inf')
+            }
+
+        if key in state['keys'] or (t <= state['spilled_until'] and self._on_disk(key)):
+            return True
+
+        state['keys'].add(key)
+        state['order'].append((t, key))
+        self.memory_keys += 1
+        if t > state['high_water']:
+            state['high_water'] = t
+            self._spill(state)
+        self._enforce_memory_limit()
+        return False
+
+    def process(self, points):
+        """Filter a payload's points, dropping duplicates"""
+        unique = []
+        for point in points:
+            participant = point.get('participant_uuid') or point.get('participant_code')
+            if participant == 'Unknown':
+                participant = point.get('participant_code')
+            if self.is_duplicate(participant, point):
+                self.duplicates_dropped += 1
+            else:
+                unique.append(point)
+        return unique
+
+    def report(self):
+        print(f"   Duplicate points dropped: {self.duplicates_dropped}")
+
+    def close(self):
+        if self._disk is not None:
+            self._disk.close()
+            os.remove(self._disk_path)
+            self._disk = None
+
+class ExternalSorter:
+    """Sorts more records than fit in memory
+
+    Records are buffered until `run_size` of them have been added; the buffer
+    is then sorted and spilled to a temporary run file. Iterating k-way merges
+    the runs (at most MAX_MERGE_FANIN files open at once; larger sets of runs
+    are first merged into fewer, longer runs). While everything still fits in
+    one run nothing is written to disk.
+
+    It can stand in for a list of records: it supports extend(), len() and
+    (repeated) iteration in sorted order. Call close() to delete the run files.
+    """
+    MAX_MERGE_FANIN = 256
+    CHUNK_SIZE = 1000
+
+    def __init__(self, key=None, run_size=500000, tmp_dir=None):
+        self.key = key
+        self.run_size = run_size
+        self.tmp_dir = tmp_dir
+        self.buffer = []
+        self.runs = []
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, record):
+        self.buffer.append(record)
+        self.count += 1
+        if len(self.buffer) >= self.run_size:
+            self._spill()
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def _write_run(self, records):
+        handle, path = tempfile.mkstemp(suffix='.run', dir=self.tmp_dir)
+        with os.fdopen(handle, 'wb') as f:
+            while True:
+                chunk = list(itertools.islice(records, self.CHUNK_SIZE))
+                if not chunk:
+                    break
+                pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return path
+
+    def _spill(self):
+        if self.buffer:
+            self.buffer.sort(key=self.key)
+            self.runs.append(self._write_run(iter(self.buffer)))
+            self.buffer = []
+
+    @staticmethod
+    def _read_run(path):
+        with open(path, 'rb') as f:
+            while True:
+                try:
+                    chunk = pickle.load(f)
+                except EOFError:
+                    return
+                yield from chunk
+
+    def _merge(self, paths):
+        return heapq.merge(*(self._read_run(path) for path in paths), key=self.key)
+
+    def __iter__(self):
+        if not self.runs:
+            self.buffer.sort(key=self.key)
+            return iter(self.buffer)
+        self._spill()
+        while len(self.runs) > self.MAX_MERGE_FANIN:
+            # Merge consecutive groups so records with equal keys keep their order
+            merged = []
+            for i in range(0, len(self.runs), self.MAX_MERGE_FANIN):
+                group = self.runs[i:i + self.MAX_MERGE_FANIN]
+                merged.append(self._write_run(self._merge(group)))
+                for path in group:
+                    os.remove(path)
+            self.runs = merged
+        return self._merge(self.runs)
+
+    def close(self):
+        for path in self.runs:
+            if os.path.exists(path):
+                os.remove(path)
+        self.runs = []
+        self.buffer = []
+
+def point_sort_key(point):
+    """(participant_uuid, timestamp) order; points without a parseable timestamp go last"""
+    t = parse_timestamp(point.get('timestamp'))
+    participant = point.get('participant_uuid', point.get('participant_id', ''))
+    return (str(participant), t is None, t or 0.0)
+
+OAEP_PADDING = padding.OAEP(
+    mgf=padding.MGF1(algorithm=hashes.SHA256()),
+    algorithm=hashes.SHA256(),
+    label=None
+)
+
+# Envelope formats the decryptor understands:
+# - aes-cbc-oaep: RSA-OAEP(SHA-256) wrapped AES key, AES-CBC data with the IV prefixed
+# - xor-pkcs1: RSA-PKCS1v15 wrapped key, repeating-key XOR data (the app's
+#   "AES-256-GCM + RSA-PKCS1" envelopes), payload {"locationData": [...]}
+ENVELOPE_FORMATS = ['aes-cbc-oaep', 'xor-pkcs1']
+
+def detect_envelope_format(envelope):
+    """Guess the envelope format from its `algorithm` field"""
+    algorithm = str(envelope.get('algorithm', ''))
+    return 'xor-pkcs1' if 'PKCS1' in algorithm.upper() else 'aes-cbc-oaep'
+
+def fix_base64_padding(data):
+    """Add missing base64 padding (some exports lose the trailing '=')"""
+    missing_padding = len(data) % 4
+    if missing_padding:
+        data += '=' * (4 - missing_padding)
+    return data
+
+@contextmanager
+def open_export(path):
+    """Open a Qualtrics export for reading as text, decompressing on the fly
+
+    Accepts a bare .csv, a .gz file, or the .zip archive Qualtrics downloads
+    come in (the CSV member is read straight from the archive, so nothing is
+    unpacked to disk; the largest CSV is used if there are several).
+    """
+    path = str(path)
+    if path.lower().endswith('.zip'):
+        with zipfile.ZipFile(path) as archive:
+            members = [info for info in archive.infolist() if info.filename.lower().endswith('.csv')]
+            if not members:
+                raise ValueError(f"No CSV file found in {path}")
+            member = max(members, key=lambda info: info.file_size)
+            if len(members) > 1:
+                print(f"📦 Reading {member.filename} from {path} ({len(members)} CSV files in the archive)")
+            with archive.open(member) as raw:
+                with io.TextIOWrapper(raw, encoding='utf-8', newline='') as file:
+                    yield file
+    elif path.lower().endswith('.gz'):
+        with gzip.open(path, 'rt', encoding='utf-8', newline='') as file:
+            yield file
+    else:
+        with open(path, 'r', encoding='utf-8') as file:
+            yield file
+
+def open_output(path):
+    """Open a CSV file for writing, gzip- or zstd-compressed when it ends in .gz or .zst"""
+    path = str(path)
+    if path.lower().endswith('.gz'):
+        return gzip.open(path, 'wt', encoding='utf-8', newline='', compresslevel=6)
+    if path.lower().endswith('.zst'):
+        try:
+            import zstandard
+        except ImportError:
+            raise ImportError("Writing .zst files needs the 'zstandard' library (pip install zstandard)")
+        raw = open(path, 'wb')
+        try:
+            writer = zstandard.ZstdCompressor(level=3).stream_writer(raw)
+        except Exception:
+            raw.close()
+            raise
+        return io.TextIOWrapper(writer, encoding='utf-8', newline='')
+    return open(path, 'w', newline='', encoding='utf-8')
+
+def extract_location_points(location_data):
+    """Return the list of point dicts in a decrypted payload"""
+    if isinstance(location_data, dict):
+        location_data = location_data.get('locationData', [])
+    if not isinstance(location_data, list):
+        return []
+    return [point for point in location_data if isinstance(point, dict)]
+
+def describe_range(values, unit=''):
+    """'min / median / max' of a list of numbers, for the preview profile"""
+    if not values:
+        return 'n/a'
+    def number(value):
+        if value == int(value):
+            return f"{int(value):,}"
+        return f"{value:.3g}" if abs(value) < 10 else f"{value:,.1f}"
+    return " / ".join(number(value) for value in (min(values), statistics.median(values), max(values))) + unit
+
+# Participant columns of an export, matched on lower-case letters and digits
+# only, so participantCode, ParticipantCode and participant_code all match
+IDENTITY_COLUMNS = {
+    'response_id': 'responseid',
+    'participant_code': 'participantcode',
+    'participant_uuid': 'participantuuid',
+    'survey_date': 'recordeddate',
+}
+
+def identity_columns(fieldnames):
+    """Map each IDENTITY_COLUMNS key to the export's column for it (None if missing); the first match wins"""
+    found = {}
+    for name in fieldnames or []:
+        found.setdefault(''.join(c for c in name.lower() if c.isalnum()), name)
+    return {key: found.get(normalised) for key, normalised in IDENTITY_COLUMNS.items()}
+
+def row_value(row, column, default=''):
+    """A CSV row's value in `column`, or `default` if the export has no such column"""
+    if column is None:
+        return default
+    return row.get(column) or ''
+
+class DecryptionError(Exception):
+    """An encrypted location envelope could not be decrypted
+
+    `stage` names the step that failed (envelope_json, envelope_fields,
+    rsa_decrypt, symmetric_decrypt or payload_json) and `cause` is the
+    original exception.
+    """
+    def __init__(self, stage, cause):
+        super().__init__(f"{stage}: {cause}")
+        self.stage = stage
+        self.cause = cause
+
+class QuarantineSink:
+    """Records rows that failed to decrypt, one JSON object per line
+
+    Each record has the row's context (ResponseId, row number, participant,
+    survey date), the failing stage, the exception class and message, and the
+    original envelope, so the rows can be retried with --retry-quarantine
+    without reprocessing the whole export. The file is only created once the
+    first row fails.
+    """
+    CONTEXT_FIELDS = ['response_id', 'row_number', 'participant_code', 'participant_uuid', 'survey_date']
+
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        self._file = None
+
+    def record(self, context, error, envelope):
+        if self._file is None:
+            self._file = open(self.path, 'w', encoding='utf-8')
+        record = {field: context.get(field, '') for field in self.CONTEXT_FIELDS}
+        record.update({
+            'stage': error.stage,
+            'error_class': error.cause.__class__.__name__,
+            'error_message': str(error.cause),
+            'envelope': envelope,
+        })
+        self._file.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.count += 1
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+def read_quarantine(path):
+    """Yield the records of a quarantine file"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+class PipelineMetrics:
+    """Per-stage timers, histograms and counters for a decryption run
+
+    Stages are timed with `with metrics.timer('rsa_decrypt'): ...`. Each stage
+    keeps its cumulative time, call count and a histogram of call durations,
+    which can be written as JSON or in the Prometheus text format.
+    """
+    # Histogram bucket upper bounds, in seconds
+    BUCKETS = [0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0]
+
     def __init__(self):
-        self.private_key = None
-        self.decrypted_locations = []
-        
-    def load_private_key(self, key_file_path, password=None):
-        """Load RSA private key from file"""
+        self.started = time.perf_counter()
+        self.finished = None
+        self.stages = {}
+        self.counters = {}
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def observe(self, stage, seconds):
+        stats = self.stages.get(stage)
+        if stats is None:
+            stats = self.stages[stage] = {'seconds': 0.0, 'count': 0, 'buckets': [0] * (len(self.BUCKETS) + 1)}
+        stats['seconds'] += seconds
+        stats['count'] += 1
+        stats['buckets'][bisect.bisect_left(self.BUCKETS, seconds)] += 1
+
+    def count(self, name, amount=1):
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def finish(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def elapsed(self):
+        return (self.finished or time.perf_counter()) - self.started
+
+    @staticmethod
+    def peak_rss_bytes():
+        """Peak resident set size of this process, or None where unsupported"""
+        # On Linux, ru_maxrss keeps the parent's peak from before exec, so a
+        # tool started from a large process (a notebook, a test run) would
+        # report that instead; VmHWM starts afresh with the new program
+        try:
+            with open('/proc/self/status', encoding='ascii') as status:
+                for line in status:
+                    if line.startswith('VmHWM:'):
+                        return int(line.split()[1]) * 1024
+        except (OSError, ValueError, IndexError):
+            pass
+        if resource is None:
+            return None
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Linux reports kilobytes, macOS bytes
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+    def to_dict(self):
+        elapsed = self.elapsed
+        return {
+            'elapsed_seconds': round(elapsed, 6),
+            'rows_per_second': round(self.counters.get('rows', 0) / elapsed, 3) if elapsed else None,
+            'points_per_second': round(self.counters.get('points', 0) / elapsed, 3) if elapsed else None,
+            'peak_rss_bytes': self.peak_rss_bytes(),
+            'counters': dict(self.counters),
+            'stages': {
+                name: {
+                    'seconds': round(stats['seconds'], 6),
+                    'count': stats['count'],
+                    'histogram': {
+                        (f"le_{bound:g}" if i < len(self.BUCKETS) else 'le_inf'): n
+                        for i, (bound, n) in enumerate(zip(self.BUCKETS + [float('inf')], stats['buckets']))
+                    },
+                }
+                for name, stats in self.stages.items()
+            },
+        }
+
+    def to_prometheus(self):
+        lines = [
+            '# HELP wellbeing_decrypt_elapsed_seconds Wall-clock time of the run',
+            '# TYPE wellbeing_decrypt_elapsed_seconds gauge',
+            f'wellbeing_decrypt_elapsed_seconds {self.elapsed:.6f}',
+        ]
+        peak = self.peak_rss_bytes()
+        if peak is not None:
+            lines += [
+                '# HELP wellbeing_decrypt_peak_rss_bytes Peak resident set size',
+                '# TYPE wellbeing_decrypt_peak_rss_bytes gauge',
+                f'wellbeing_decrypt_peak_rss_bytes {peak}',
+            ]
+        lines += ['# TYPE wellbeing_decrypt_total counter']
+        for name, value in self.counters.items():
+            lines.append(f'wellbeing_decrypt_total{{counter="{name}"}} {value}')
+        lines += [
+            '# HELP wellbeing_decrypt_stage_seconds Time spent per pipeline stage',
+            '# TYPE wellbeing_decrypt_stage_seconds histogram',
+        ]
+        for name, stats in self.stages.items():
+            cumulative = 0
+            for bound, n in zip(self.BUCKETS + [float('inf')], stats['buckets']):
+                cumulative += n
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'wellbeing_decrypt_stage_seconds_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+            lines.append(f'wellbeing_decrypt_stage_seconds_sum{{stage="{name}"}} {stats["seconds"]:.6f}')
+            lines.append(f'wellbeing_decrypt_stage_seconds_count{{stage="{name}"}} {stats["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, path, metrics_format=None):
+        """Write the metrics as JSON, or as Prometheus text for .prom/.txt files"""
+        if metrics_format is None:
+            metrics_format = 'prometheus' if str(path).endswith(('.prom', '.txt')) else 'json'
+        with open(path, 'w', encoding='utf-8') as f:
+            if metrics_format == 'prometheus':
+                f.write(self.to_prometheus())
+            else:
+                json.dump(self.to_dict(), f, indent=2)
+
+    def report(self):
+        elapsed = self.elapsed
+        print(f"   Time: {elapsed:.2f}s "
+              f"({self.counters.get('rows', 0) / elapsed:.1f} rows/s, "
+              f"{self.counters.get('points', 0) / elapsed:.1f} points/s)")
+        for name, stats in sorted(self.stages.items(), key=lambda item: -item[1]['seconds']):
+            print(f"     {name:<18} {stats['seconds']:8.3f}s over {stats['count']} calls")
+
+class KeyRegistry:
+    """The private keys of one or more research sites, each unlocked once
+
+    Envelopes name the site that encrypted them (`researchSite`), so each one
+    goes straight to that site's key. Envelopes from a site without its own
+    key, or without the field, go to the keys whose modulus size matches the
+    length of the encrypted key; with one key per key size that is a single
+    key as well.
+    """
+    DEFAULT_SITE = 'default'
+
+    def __init__(self):
+        self.keys = {}
+        self._sites_by_size = {}
+
+    def __len__(self):
+        return len(self.keys)
+
+    def add(self, site, private_key):
+        """Register an unlocked private key for a site (replacing any earlier one)"""
+        if site in self.keys:
+            old_size = self.keys[site].key_size // 8
+            self._sites_by_size[old_size].remove(site)
+        self.keys[site] = private_key
+        self._sites_by_size.setdefault(private_key.key_size // 8, []).append(site)
+
+    def load(self, site, key_file_path, password=None):
+        """Read, parse and unlock a PEM private key for a site; returns True on success"""
         try:
             with open(key_file_path, 'rb') as key_file:
-                if password:
-                    password = password.encode('utf-8')
-                
-                self.private_key = serialization.load_pem_private_key(
+                private_key = serialization.load_pem_private_key(
                     key_file.read(),
-                    password=password,
+                    password=password.encode('utf-8') if password else None,
                     backend=default_backend()
                 )
+            self.add(site, private_key)
             print(f"✅ Successfully loaded private key from {key_file_path}")
             return True
         except Exception as e:
             print(f"❌ Error loading private key: {e}")
             return False
+
+    def candidates(self, research_site, encrypted_key_length):
+        """Return [(site, private_key)] to try for an envelope, best match first"""
+        if research_site in self.keys:
+            return [(research_site, self.keys[research_site])]
+        sites = self._sites_by_size.get(encrypted_key_length) or list(self.keys)
+        return [(site, self.keys[site]) for site in sites]
+
+class LocationDecryptor:
+    def __init__(self, stages=None, log_rows=False, log_interval=1.0, quarantine=None, decrypted_locations=None,
+                 participant_index=None, compact_participants=False):
+        self.private_key = None
+        # Unlocked keys of every configured site; envelopes are routed by researchSite
+        self.keys = KeyRegistry()
+        # Kept points; pass an ExternalSorter to get them in (participant, time) order
+        self.decrypted_locations = decrypted_locations if decrypted_locations is not None else []
+        # Optional QuarantineSink for rows that fail to decrypt
+        self.quarantine = quarantine
+        # Stages each filter/transform a payload's points before they are kept,
+        # e.g. PointDeduplicator; each reports its own summary at the end
+        self.stages = list(stages or [])
+        # Optional ParticipantIndex (participant_index.py): adds a participant_id
+        # to every point and records each ResponseId; compact output then
+        # leaves out the participant code and UUID strings
+        self.participant_index = participant_index
+        self.compact_participants = compact_participants and participant_index is not None
+        self.metrics = PipelineMetrics()
+        # Per-row progress messages are opt-in and printed at most once per interval
+        self.log_rows = log_rows
+        self.log_interval = log_interval
+        self._last_row_log = float('-inf')
+        
+    def load_private_key(self, key_file_path, password=None, site=KeyRegistry.DEFAULT_SITE):
+        """Load RSA private key from file (optionally as the key of one research site)"""
+        if not self.keys.load(site, key_file_path, password):
+            return False
+        self.private_key = self.keys.keys[site]
+        return True
     
-    def decrypt_aes_key(self, encrypted_key_b64):
-        """Decrypt the AES key using RSA private key"""
-        try:
-            encrypted_key = base64.b64decode(encrypted_key_b64)
-            aes_key = self.private_key.decrypt(
-                encrypted_key,
-                padding.OAEP(
-                    mgf=padding.MGF1(algorithm=hashes.SHA256()),
-                    algorithm=hashes.SHA256(),
-                    label=None
-                )
-            )
-            return aes_key
-        except Exception as e:
-            print(f"❌ Error decrypting AES key: {e}")
-            return None
+    def _key_candidates(self, research_site, encrypted_key):
+        candidates = self.keys.candidates(research_site, len(encrypted_key))
+        if not candidates and self.private_key is not None:
+            candidates = [(KeyRegistry.DEFAULT_SITE, self.private_key)]
+        if not candidates:
+            raise ValueError("No private key loaded")
+        return candidates
     
-    def decrypt_location_data(self, encrypted_data_b64, aes_key):
-        """Decrypt location data using AES key"""
-        try:
+    def _rsa_decrypt(self, private_key, encrypted_key, rsa_padding):
+        with self.metrics.timer('rsa_decrypt'):
+            return private_key.decrypt(encrypted_key, rsa_padding)
+    
+    def _aes_cbc_decrypt(self, encrypted_data_b64, aes_key):
+        with self.metrics.timer('symmetric_decrypt'):
             encrypted_data = base64.b64decode(encrypted_data_b64)
             
             # Extract IV (first 16 bytes) and encrypted content
@@ -98,112 +746,398 @@ class LocationDecryptor:
             
             # Remove PKCS7 padding
             padding_length = padded_data[-1]
-            location_json = padded_data[:-padding_length].decode('utf-8')
-            
-            return json.loads(location_json)
+            return padded_data[:-padding_length].decode('utf-8')
+    
+    def _xor_decrypt(self, encrypted_data_b64, key):
+        # The app's current "AES-256-GCM" is a repeating-key XOR (see
+        # location_encryption_service.dart), so undo it the same way
+        with self.metrics.timer('symmetric_decrypt'):
+            encrypted_data = base64.b64decode(fix_base64_padding(encrypted_data_b64))
+            repeats = len(encrypted_data) // len(key) + 1
+            keystream = (key * repeats)[:len(encrypted_data)]
+            decrypted = int.from_bytes(encrypted_data, 'big') ^ int.from_bytes(keystream, 'big')
+            return decrypted.to_bytes(len(encrypted_data), 'big').decode('utf-8')
+    
+    def decrypt_aes_key(self, encrypted_key_b64):
+        """Decrypt the AES key using RSA private key"""
+        try:
+            encrypted_key = base64.b64decode(fix_base64_padding(encrypted_key_b64))
+            error = None
+            for _, private_key in self._key_candidates(None, encrypted_key):
+                try:
+                    return self._rsa_decrypt(private_key, encrypted_key, OAEP_PADDING)
+                except ValueError as e:
+                    error = e
+            raise error
+        except Exception as e:
+            print(f"❌ Error decrypting AES key: {e}")
+            return None
+    
+    def decrypt_location_data(self, encrypted_data_b64, aes_key):
+        """Decrypt location data using AES key"""
+        try:
+            location_json = self._aes_cbc_decrypt(encrypted_data_b64, aes_key)
+            with self.metrics.timer('json_parse'):
+                return json.loads(location_json)
         except Exception as e:
             print(f"❌ Error decrypting location data: {e}")
             return None
     
-    def process_encrypted_location(self, encrypted_location_data):
-        """Process a complete encrypted location data string"""
+    def decrypt_envelope(self, envelope_text, envelope_format='auto'):
+        """Decrypt an encrypted location envelope, raising DecryptionError on failure
+
+        `envelope_format` is one of ENVELOPE_FORMATS; 'auto' picks the format
+        from the envelope's `algorithm` field.
+        """
         try:
-            # Parse the encrypted location data JSON
-            encrypted_data = json.loads(encrypted_location_data)
-            
-            # Extract components
-            encrypted_aes_key = encrypted_data.get('encryptedKey')
-            encrypted_location_data = encrypted_data.get('encryptedData')
-            
-            if not encrypted_aes_key or not encrypted_location_data:
-                print("❌ Missing encryption components in location data")
-                return None
-            
-            # Decrypt AES key
-            aes_key = self.decrypt_aes_key(encrypted_aes_key)
-            if not aes_key:
-                return None
-            
-            # Decrypt location data
-            location_data = self.decrypt_location_data(encrypted_location_data, aes_key)
+            with self.metrics.timer('json_parse'):
+                envelope = json.loads(envelope_text)
+        except Exception as e:
+            raise DecryptionError('envelope_json', e)
+        if not isinstance(envelope, dict):
+            raise DecryptionError('envelope_fields', ValueError("envelope is not a JSON object"))
+        
+        # Extract components
+        encrypted_aes_key = envelope.get('encryptedKey')
+        encrypted_location_data = envelope.get('encryptedData')
+        if not encrypted_aes_key or not encrypted_location_data:
+            raise DecryptionError('envelope_fields', ValueError("Missing encryption components in location data"))
+        
+        if envelope_format == 'auto':
+            envelope_format = detect_envelope_format(envelope)
+        if envelope_format not in ENVELOPE_FORMATS:
+            raise DecryptionError('envelope_fields', ValueError(f"Unknown envelope format: {envelope_format}"))
+        
+        try:
+            encrypted_key = base64.b64decode(fix_base64_padding(encrypted_aes_key))
+            candidates = self._key_candidates(envelope.get('researchSite'), encrypted_key)
+        except Exception as e:
+            raise DecryptionError('rsa_decrypt', e)
+        
+        # Only envelopes from a site without its own key, sharing a key size
+        # with another site's key, ever need more than one attempt
+        for attempt, (site, private_key) in enumerate(candidates, 1):
+            try:
+                location_data = self._decrypt_with_key(private_key, encrypted_key, encrypted_location_data, envelope_format)
+            except DecryptionError:
+                if attempt == len(candidates):
+                    raise
+                continue
+            self.metrics.count(f'site_{site}')
             return location_data
-            
-        except json.JSONDecodeError as e:
-            print(f"❌ Error parsing encrypted location data JSON: {e}")
-            return None
+    
+    def _decrypt_with_key(self, private_key, encrypted_key, encrypted_location_data, envelope_format):
+        # Decrypt AES key
+        try:
+            rsa_padding = padding.PKCS1v15() if envelope_format == 'xor-pkcs1' else OAEP_PADDING
+            aes_key = self._rsa_decrypt(private_key, encrypted_key, rsa_padding)
+        except Exception as e:
+            raise DecryptionError('rsa_decrypt', e)
+        
+        # Decrypt location data
+        try:
+            if envelope_format == 'xor-pkcs1':
+                location_json = self._xor_decrypt(encrypted_location_data, aes_key)
+            else:
+                location_json = self._aes_cbc_decrypt(encrypted_location_data, aes_key)
         except Exception as e:
-            print(f"❌ Error processing encrypted location: {e}")
+            raise DecryptionError('symmetric_decrypt', e)
+        
+        try:
+            with self.metrics.timer('json_parse'):
+                return json.loads(location_json)
+        except Exception as e:
+            raise DecryptionError('payload_json', e)
+    
+    def process_encrypted_location(self, encrypted_location_data):
+        """Process a complete encrypted location data string"""
+        try:
+            return self.decrypt_envelope(encrypted_location_data)
+        except DecryptionError as e:
+            print(f"❌ Error processing encrypted location ({e.stage}): {e.cause}")
             return None
     
-    def process_qualtrics_csv(self, csv_file_path):
-        """Process Qualtrics CSV export and decrypt location data"""
+    def process_envelope(self, envelope_text, context, envelope_format='auto'):
+        """Decrypt one envelope and keep its points; returns True on success
+
+        `context` holds the row's response_id, row_number, participant_code,
+        participant_uuid and survey_date. Failures are sent to the quarantine
+        sink (if any) with everything needed to retry them later.
+        """
+        points = self.decrypt_points(envelope_text, context, envelope_format)
+        if points is None:
+            return False
+        self.decrypted_locations.extend(points)
+        return True
+    
+    def decrypt_points(self, envelope_text, context, envelope_format='auto', run_stages=True):
+        """Decrypt one envelope into point dicts passed through the stages
+
+        Returns None (after quarantining the row) if the envelope can't be
+        decrypted. Unlike process_envelope, the points are not kept. With
+        `run_stages=False` the stages are left to a later finish_points() call,
+        e.g. once a whole file has been read.
+        """
+        participant_id = None
+        if self.participant_index is not None:
+            # Indexed before decrypting, so quarantined rows are known too
+            participant_id = self.participant_index.resolve(context)
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                # Skip the first row (Qualtrics metadata)
-                csv_reader = csv.DictReader(file)
-                next(csv_reader)  # Skip first data row if it's metadata
+            location_data = self.decrypt_envelope(envelope_text, envelope_format)
+        except DecryptionError as e:
+            self.metrics.count('error_rows')
+            print(f"❌ Failed to decrypt location data in row {context.get('row_number')} ({e.stage}: {e.cause})")
+            if self.quarantine is not None:
+                self.quarantine.record(context, e, envelope_text)
+            return None
+        
+        # Process each location point
+        points = []
+        for location_point in extract_location_points(location_data):
+            points.append({
+                'participant_code': context['participant_code'],
+                'participant_uuid': context['participant_uuid'],
+                'survey_date': context['survey_date'],
+                'timestamp': location_point.get('timestamp', ''),
+                'latitude': location_point.get('latitude', ''),
+                'longitude': location_point.get('longitude', ''),
+                'accuracy': location_point.get('accuracy', ''),
+                'speed': location_point.get('speed', ''),
+                'heading': location_point.get('heading', ''),
+                'altitude': location_point.get('altitude', ''),
+            })
+        if self.participant_index is not None:
+            for point in points:
+                point['participant_id'] = participant_id
+        self.metrics.count('processed_rows')
+        return self.finish_points(points) if run_stages else points
+
+    def finish_points(self, points):
+        """Run a batch of decrypted points through the stages, then drop the columns left out of the output"""
+        points = self.run_stages(points)
+        if self.compact_participants:
+            for point in points:
+                del point['participant_code'], point['participant_uuid']
+        return points
+    
+    def run_stages(self, points):
+        """Pass a batch of point dicts through every stage (deduplication, filters, tagging)"""
+        for stage in self.stages:
+            with self.metrics.timer(stage.name):
+                points = stage.process(points)
+        self.metrics.count('points', len(points))
+        return points
+    
+    def iter_envelopes(self, csv_file_path):
+        """Yield (context, envelope_text) for each row of a Qualtrics export (.csv, .zip or .gz) with location data"""
+        with open_export(csv_file_path) as file:
+            # Skip the first row (Qualtrics metadata)
+            csv_reader = csv.DictReader(file)
+            next(csv_reader)  # Skip first data row if it's metadata
+            columns = identity_columns(csv_reader.fieldnames)
+            metrics = self.metrics
+            
+            row_num = 2  # Start at 3 since we skip header + metadata
+            while True:
+                with metrics.timer('csv_parse'):
+                    row = next(csv_reader, None)
+                if row is None:
+                    break
+                row_num += 1
+                metrics.count('rows')
                 
-                processed_count = 0
-                error_count = 0
+                # Look for location data column (adjust column name as needed)
+                location_column = None
+                for col_name in row.keys():
+                    if 'location' in col_name.lower() or 'QID' in col_name:
+                        if row[col_name] and row[col_name].strip():
+                            location_column = col_name
+                            break
                 
-                for row_num, row in enumerate(csv_reader, start=3):  # Start at 3 since we skip header + metadata
-                    # Look for location data column (adjust column name as needed)
-                    location_column = None
-                    for col_name in row.keys():
-                        if 'location' in col_name.lower() or 'QID' in col_name:
-                            if row[col_name] and row[col_name].strip():
-                                location_column = col_name
-                                break
-                    
-                    if not location_column:
-                        continue
-                    
-                    encrypted_location = row[location_column].strip()
-                    if not encrypted_location or encrypted_location == '':
-                        continue
-                    
-                    print(f"Processing row {row_num}...")
-                    
-                    # Decrypt location data
-                    location_data = self.process_encrypted_location(encrypted_location)
-                    
-                    if location_data:
-                        # Extract participant info
-                        participant_code = row.get('participantCode', row.get('ParticipantCode', 'Unknown'))
-                        participant_uuid = row.get('participantUUID', row.get('ParticipantUUID', 'Unknown'))
-                        survey_date = row.get('RecordedDate', row.get('recordedDate', 'Unknown'))
-                        
-                        # Process each location point
-                        if isinstance(location_data, list):
-                            for location_point in location_data:
-                                self.decrypted_locations.append({
-                                    'participant_code': participant_code,
-                                    'participant_uuid': participant_uuid,
-                                    'survey_date': survey_date,
-                                    'timestamp': location_point.get('timestamp', ''),
-                                    'latitude': location_point.get('latitude', ''),
-                                    'longitude': location_point.get('longitude', ''),
-                                    'accuracy': location_point.get('accuracy', ''),
-                                    'speed': location_point.get('speed', ''),
-                                    'heading': location_point.get('heading', ''),
-                                    'altitude': location_point.get('altitude', ''),
-                                })
-                        processed_count += 1
-                    else:
-                        error_count += 1
-                        print(f"❌ Failed to decrypt location data in row {row_num}")
+                if not location_column:
+                    continue
                 
-                print(f"\n✅ Processing complete!")
-                print(f"   Successfully processed: {processed_count} rows")
-                print(f"   Errors: {error_count} rows")
-                print(f"   Total location points extracted: {len(self.decrypted_locations)}")
+                encrypted_location = row[location_column].strip()
+                if not encrypted_location or encrypted_location == '':
+                    continue
                 
-                return True
+                self.log_row(row_num)
                 
+                # Extract participant info
+                context = {
+                    'response_id': row_value(row, columns['response_id']).strip(),
+                    'row_number': row_num,
+                    'participant_code': row_value(row, columns['participant_code']).strip() or 'Unknown',
+                    'participant_uuid': row_value(row, columns['participant_uuid']).strip() or 'Unknown',
+                    'survey_date': row_value(row, columns['survey_date'], 'Unknown'),
+                }
+                yield context, encrypted_location
+    
+    def process_qualtrics_csv(self, csv_file_path, envelope_format='auto'):
+        """Process Qualtrics CSV export and decrypt location data"""
+        try:
+            processed_count = 0
+            error_count = 0
+            for context, encrypted_location in self.iter_envelopes(csv_file_path):
+                if self.process_envelope(encrypted_location, context, envelope_format):
+                    processed_count += 1
+                else:
+                    error_count += 1
+            
+            self.print_summary(processed_count, error_count)
+            return True
+            
         except Exception as e:
             print(f"❌ Error processing CSV file: {e}")
             return False
     
+    def retry_quarantine(self, quarantine_path, envelope_format='auto'):
+        """Reprocess only the rows recorded in a quarantine file
+
+        Use with a different key or envelope format; rows that still fail are
+        quarantined again (to this decryptor's quarantine sink).
+        """
+        try:
+            processed_count = 0
+            error_count = 0
+            for record in read_quarantine(quarantine_path):
+                self.metrics.count('rows')
+                self.log_row(record['row_number'])
+                context = {field: record.get(field, '') for field in QuarantineSink.CONTEXT_FIELDS}
+                if self.process_envelope(record['envelope'], context, envelope_format):
+                    processed_count += 1
+                else:
+                    error_count += 1
+            
+            self.print_summary(processed_count, error_count)
+            return True
+            
+        except Exception as e:
+            print(f"❌ Error processing quarantine file: {e}")
+            return False
+    
+    def preview(self, csv_file_path, sample_size=20, envelope_format='auto', seed=None):
+        """Decrypt a random sample of an export's rows and print a profile of it
+
+        A quick check of a new export before the full run: rows are
+        reservoir-sampled in one pass (only the envelope sizes of the other
+        rows are kept), and just the sampled rows are decrypted, without the
+        stages or the quarantine. Nothing is saved. Returns False if the
+        export can't be read.
+        """
+        rng = random.Random(seed)
+        start = time.perf_counter()
+        sample, sizes = [], []
+        try:
+            for index, (context, envelope_text) in enumerate(self.iter_envelopes(csv_file_path)):
+                sizes.append(len(envelope_text))
+                if index < sample_size:
+                    sample.append((context, envelope_text))
+                else:
+                    slot = rng.randrange(index + 1)
+                    if slot < sample_size:
+                        sample[slot] = (context, envelope_text)
+        except Exception as e:
+            print(f"❌ Error reading CSV file: {e}")
+            return False
+        scanned = time.perf_counter() - start
+
+        formats, sites, failures = Counter(), Counter(), Counter()
+        points_per_row, latitudes, longitudes, accuracies, epochs = [], [], [], [], []
+        bad_coordinates = 0
+        for context, envelope_text in sample:
+            try:
+                envelope = json.loads(envelope_text)
+                formats[detect_envelope_format(envelope) if envelope_format == 'auto' else envelope_format] += 1
+                sites[str(envelope.get('researchSite') or '(none)')] += 1
+            except (ValueError, AttributeError):
+                formats['(not an envelope)'] += 1
+            try:
+                points = extract_location_points(self.decrypt_envelope(envelope_text, envelope_format))
+            except DecryptionError as e:
+                failures[e.stage] += 1
+                continue
+            points_per_row.append(len(points))
+            for point in points:
+                try:
+                    lat, lon = float(point.get('latitude')), float(point.get('longitude'))
+                except (TypeError, ValueError):
+                    bad_coordinates += 1
+                    continue
+                if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (lat == 0 and lon == 0):
+                    bad_coordinates += 1
+                    continue
+                latitudes.append(lat)
+                longitudes.append(lon)
+                try:
+                    accuracies.append(float(point.get('accuracy')))
+                except (TypeError, ValueError):
+                    pass
+                epoch = parse_timestamp(point.get('timestamp'))
+                if epoch is not None:
+                    epochs.append(epoch)
+
+        def counts(counter):
+            return ", ".join(f"{name} {n}" for name, n in counter.most_common()) or 'none'
+
+        print(f"\n🔎 Preview of {csv_file_path}")
+        print(f"   Rows with location data: {len(sizes)} (scanned in {scanned:.1f}s)")
+        print(f"   Envelope size (min / median / max): {describe_range([size / 1024 for size in sizes], ' KB')}")
+        print(f"\n   Sampled rows: {len(sample)}")
+        print(f"   Envelope formats: {counts(formats)}")
+        print(f"   Research sites: {counts(sites)}")
+        print(f"   Decrypted: {len(points_per_row)} of {len(sample)}"
+              + (f" (failed: {counts(failures)})" if failures else ""))
+        print(f"   Points per row (min / median / max): {describe_range(points_per_row)}")
+        if epochs:
+            print(f"   Time range: {format_timestamp(min(epochs))} to {format_timestamp(max(epochs))}")
+        if latitudes:
+            print(f"   Latitude range: {min(latitudes):.5f} to {max(latitudes):.5f}")
+            print(f"   Longitude range: {min(longitudes):.5f} to {max(longitudes):.5f}")
+        print(f"   Accuracy (min / median / max): {describe_range(accuracies, ' m')}")
+        if bad_coordinates:
+            print(f"   ⚠️  Points with missing, invalid or 0,0 coordinates: {bad_coordinates}")
+        if sample and not points_per_row and 'rsa_decrypt' in failures:
+            print("   ⚠️  No sampled row could be decrypted with the loaded key(s). Is this the right key "
+                  "for this export (or the right --site-key for each site)?")
+        return True
+    
+    def print_summary(self, processed_count, error_count):
+        print(f"\n✅ Processing complete!")
+        print(f"   Successfully processed: {processed_count} rows")
+        print(f"   Errors: {error_count} rows")
+        if self.quarantine is not None and self.quarantine.count:
+            print(f"   Quarantined rows written to: {self.quarantine.path}")
+        print(f"   Total location points extracted: {len(self.decrypted_locations)}")
+        if len(self.keys) > 1:
+            sites = {name[len('site_'):]: n for name, n in self.metrics.counters.items() if name.startswith('site_')}
+            print("   Rows per site key: " + ", ".join(f"{site} {n}" for site, n in sorted(sites.items())))
+        for stage in self.stages:
+            stage.report()
+        if self.participant_index is not None:
+            self.participant_index.report()
+        self.metrics.report()
+    
+
+    def log_row(self, row_num):
+        """Print a progress message for a row, if enabled and not printed too recently"""
+        if not self.log_rows:
+            return
+        now = time.monotonic()
+        if now - self._last_row_log >= self.log_interval:
+            self._last_row_log = now
+            print(f"Processing row {row_num}...")
+    
+    def point_fieldnames(self):
+        """Output columns of this decryptor's points"""
+        fieldnames = list(POINT_FIELDNAMES)
+        if self.participant_index is not None:
+            fieldnames.insert(0, 'participant_id')
+        if self.compact_participants:
+            fieldnames = [name for name in fieldnames if name not in ('participant_code', 'participant_uuid')]
+        # Enrichment stages (e.g. boundaries) add their own columns
+        return fieldnames + [name for stage in self.stages for name in getattr(stage, 'fieldnames', [])]
+
     def save_decrypted_data(self, output_file_path):
         """Save decrypted location data to new CSV file"""
         try:
@@ -211,23 +1145,12 @@ class LocationDecryptor:
                 print("❌ No location data to save")
                 return False
             
-            with open(output_file_path, 'w', newline='', encoding='utf-8') as file:
-                fieldnames = [
-                    'participant_code',
-                    'participant_uuid', 
-                    'survey_date',
-                    'timestamp',
-                    'latitude',
-                    'longitude',
-                    'accuracy',
-                    'speed',
-                    'heading',
-                    'altitude'
-                ]
-                
-                writer = csv.DictWriter(file, fieldnames=fieldnames)
-                writer.writeheader()
-                writer.writerows(self.decrypted_locations)
+            with open_output(output_file_path) as file:
+                fieldnames = self.point_fieldnames()
+                with self.metrics.timer('write'):
+                    writer = csv.DictWriter(file, fieldnames=fieldnames)
+                    writer.writeheader()
+                    writer.writerows(self.decrypted_locations)
             
             print(f"✅ Decrypted location data saved to: {output_file_path}")
             return True
@@ -246,8 +1169,10 @@ def find_files_in_directory():
         key_files.extend(list(current_dir.glob(f'*private*{ext}')))
         key_files.extend(list(current_dir.glob(f'*key*{ext}')))
     
-    # Look for CSV files
-    csv_files = list(current_dir.glob('*.csv'))
+    # Look for exports: CSV files, compressed or still in the Qualtrics .zip
+    csv_files = []
+    for pattern in ['*.csv', '*.csv.gz', '*.zip']:
+        csv_files.extend(sorted(current_dir.glob(pattern)))
     
     return key_files, csv_files
 
@@ -287,7 +1212,7 @@ def get_user_input():
             print("❌ CSV file not found.")
             return None, None
     else:
-        print(f"\n📁 Found {len(csv_files)} CSV file(s):")
+        print(f"\n📁 Found {len(csv_files)} CSV export(s):")
         for i, csv_file in enumerate(csv_files, 1):
             print(f"   {i}. {csv_file.name}")
         
@@ -304,7 +1229,138 @@ def get_user_input():
     
     return key_file_path, csv_file_path
 
+def key_password(key_file_path, site=KeyRegistry.DEFAULT_SITE):
+    """Password for a private key file, or None if the key is not encrypted
+
+    Taken from WELLBEING_KEY_PASSWORD_<SITE> when set, otherwise asked for once.
+    """
+    try:
+        with open(key_file_path, 'r') as f:
+            if 'ENCRYPTED' not in f.read():
+                return None
+    except:
+        return None
+    env_name = f"WELLBEING_KEY_PASSWORD_{site.upper().replace('-', '_')}"
+    if os.environ.get(env_name):
+        return os.environ[env_name]
+    if site == KeyRegistry.DEFAULT_SITE:
+        return input("\n🔒 Private key is password protected. Enter password: ")
+    return input(f"\n🔒 Private key for site '{site}' is password protected. Enter password: ")
+
+def parse_site_key(value):
+    """argparse type for --site-key SITE=PATH"""
+    site, sep, path = value.partition('=')
+    if not sep or not site or not path:
+        raise argparse.ArgumentTypeError(f"expected SITE=PATH, got {value!r}")
+    return site, path
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description="Decrypt location data from a Qualtrics survey export. "
+                    "Without --key/--csv the tool looks for files in the current folder and asks."
+    )
+    parser.add_argument('--key', help="RSA private key file (.pem)")
+    parser.add_argument('--site-key', action='append', type=parse_site_key, default=[], metavar='SITE=PATH',
+                        help="Private key of one research site, e.g. gauteng=gauteng_private_key.pem; repeat for "
+                             "mixed-site exports. Envelopes go to the key of their researchSite")
+    parser.add_argument('--csv', help="Qualtrics export with encrypted location data (.csv, .csv.gz, "
+                                          "or the .zip as downloaded)")
+    parser.add_argument('-o', '--output', help="Output CSV (default: decrypted_locations_<timestamp>.csv); "
+                                                "compressed when it ends in .gz or .zst")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Keep points that were resent in overlapping uploads")
+    parser.add_argument('--dedupe-window-days', type=float, default=14,
+                        help="Days of recent points per participant kept in memory for deduplication (default: 14)")
+    parser.add_argument('--dedupe-max-keys', type=int, default=2000000,
+                        help="Maximum deduplication keys held in memory before spilling to disk (default: 2000000)")
+    parser.add_argument('--max-accuracy', type=float, metavar='METRES',
+                        help="Drop fixes with a reported accuracy radius above this; needs numpy "
+                             "and gps_quality_filter.py next to this script")
+    parser.add_argument('--bbox', metavar='BOX',
+                        help="Drop fixes outside this box: 'gauteng' or min_lon,min_lat,max_lon,max_lat")
+    parser.add_argument('--max-speed-kmh', type=float, metavar='KMH',
+                        help="Drop teleport jumps needing more than this speed (default with the quality "
+                             "filter: 300)")
+    parser.add_argument('--flag-quality', action='store_true',
+                        help="Keep low-quality fixes, with the reason in a quality_flag column")
+    parser.add_argument('--quality-report', metavar='CSV',
+                        help="Write per-participant counts of low-quality fixes to this file")
+    parser.add_argument('--boundaries', metavar='GEOJSON',
+                        help="Tag each point with the boundary (e.g. ward) it falls in; needs numpy "
+                             "and enrich_boundaries.py next to this script")
+    parser.add_argument('--boundary-fields', metavar='NAMES',
+                        help="Comma-separated boundary properties to add (default: all)")
+    parser.add_argument('--raster', action='append', default=[], metavar='NAME=PATH',
+                        help="Add a column NAME with the value of a raster (.tif or .npy, e.g. greenness) "
+                             "under each point; repeat for several. Needs numpy and enrich_rasters.py")
+    parser.add_argument('--density-tiles', metavar='PATH',
+                        help="Also write a k-suppressed density tile pyramid (a directory, or a .npz file); "
+                             "needs numpy and density_tiles.py next to this script")
+    parser.add_argument('--density-k', type=int, default=5,
+                        help="Suppress density cells with fewer participants than this (default: 5)")
+    parser.add_argument('--rollups', metavar='STORE',
+                        help="Also add the new points to a daily/hourly rollup store (see activity_rollups.py)")
+    parser.add_argument('--participant-index', metavar='STORE',
+                        help="Participant index file (created if missing) that gives each participant a small "
+                             "integer ID, kept across waves and sites; adds a participant_id column")
+    parser.add_argument('--compact-participants', action='store_true',
+                        help="With --participant-index, leave the participant_code and participant_uuid columns out")
+    parser.add_argument('--sort', action='store_true',
+                        help="Write the points ordered by participant and timestamp (sorted out of core)")
+    parser.add_argument('--sort-run-size', type=int, default=500000,
+                        help="Points sorted in memory before a run is spilled to disk (default: 500000)")
+    parser.add_argument('--tmp-dir', metavar='DIR',
+                        help="Directory for temporary sort runs and deduplication files (default: system temp)")
+    parser.add_argument('--log-rows', action='store_true',
+                        help="Print a progress message per row (rate-limited by --log-interval)")
+    parser.add_argument('--log-interval', type=float, default=1.0,
+                        help="Minimum seconds between row progress messages (default: 1.0)")
+    parser.add_argument('--metrics', metavar='PATH',
+                        help="Write run metrics to PATH (JSON, or Prometheus text for .prom/.txt)")
+    parser.add_argument('--metrics-format', choices=['json', 'prometheus'],
+                        help="Metrics file format (default: from the file extension)")
+    parser.add_argument('--profile', nargs='?', const='', metavar='PATH',
+                        help="Run under cProfile, print the top functions and save stats to PATH "
+                             "(default: decrypt_profile_<timestamp>.prof)")
+    parser.add_argument('--quarantine', metavar='PATH',
+                        help="Where to record rows that fail to decrypt (default: quarantine_<timestamp>.jsonl)")
+    parser.add_argument('--retry-quarantine', metavar='PATH',
+                        help="Reprocess only the rows in a quarantine file (e.g. with a different --key or "
+                             "--envelope-format) instead of a Qualtrics export")
+    parser.add_argument('--preview', nargs='?', type=int, const=20, metavar='N',
+                        help="Only decrypt a random sample of N rows (default: 20) and print a profile of the "
+                             "export (formats, sizes, coordinate ranges); nothing is saved")
+    parser.add_argument('--envelope-format', choices=['auto'] + ENVELOPE_FORMATS, default='auto',
+                        help="How envelopes were encrypted (default: auto, from each envelope's algorithm field)")
+    args = parser.parse_args()
+    if args.retry_quarantine and not (args.key or args.site_key):
+        parser.error("--retry-quarantine requires --key or --site-key")
+    if args.retry_quarantine and args.quarantine and Path(args.quarantine).resolve() == Path(args.retry_quarantine).resolve():
+        parser.error("--quarantine must be a different file from --retry-quarantine")
+    if args.preview is not None and args.preview < 1:
+        parser.error("--preview needs at least 1 row")
+    if args.preview and args.retry_quarantine:
+        parser.error("--preview cannot be combined with --retry-quarantine")
+    if args.compact_participants and not args.participant_index:
+        parser.error("--compact-participants requires --participant-index")
+    if args.raster:
+        from enrich_rasters import parse_raster_spec
+        try:
+            args.raster = [parse_raster_spec(spec) for spec in args.raster]
+        except argparse.ArgumentTypeError as e:
+            parser.error(f"--raster: {e}")
+    if args.bbox:
+        from gps_quality_filter import parse_bbox
+        try:
+            args.bbox = parse_bbox(args.bbox)
+        except argparse.ArgumentTypeError as e:
+            parser.error(f"--bbox: {e}")
+    return args
+
 def main():
+    args = parse_args()
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
     print("=" * 60)
     print("   🗺️  WELLBEING MAPPER LOCATION DATA DECRYPTION TOOL")
     print("=" * 60)
@@ -315,47 +1371,154 @@ def main():
     print("  ✓ CSV export from Qualtrics with encrypted location data")
     print()
     
-    # Get file paths from user
-    key_file_path, csv_file_path = get_user_input()
+    # Get file paths from the command line, or ask the user
+    key_file_path, csv_file_path = args.key, args.csv or args.retry_quarantine
+    need_key = not key_file_path and not args.site_key
+    if need_key or not csv_file_path:
+        found_key, found_csv = get_user_input()
+        key_file_path = key_file_path or (found_key if need_key else None)
+        csv_file_path = csv_file_path or found_csv
     
-    if not key_file_path or not csv_file_path:
+    if not (key_file_path or args.site_key) or not csv_file_path:
         print("❌ Required files not found. Exiting.")
         return
     
-    # Check if private key is password protected
-    password = None
-    try:
-        with open(key_file_path, 'r') as f:
-            content = f.read()
-            if 'ENCRYPTED' in content:
-                password = input("\n🔒 Private key is password protected. Enter password: ")
-    except:
-        pass
-    
     # Initialize decryptor
-    decryptor = LocationDecryptor()
+    stages = []
+    if not args.keep_duplicates:
+        stages.append(PointDeduplicator(
+            window_seconds=args.dedupe_window_days * 86400,
+            max_memory_keys=args.dedupe_max_keys,
+            tmp_dir=args.tmp_dir
+        ))
+    quality = None
+    if (args.max_accuracy is not None or args.bbox or args.max_speed_kmh is not None
+            or args.flag_quality or args.quality_report):
+        from gps_quality_filter import GPSQualityFilter
+        max_speed_kmh = 300 if args.max_speed_kmh is None else args.max_speed_kmh
+        quality = GPSQualityFilter(args.max_accuracy, args.bbox, max_speed_kmh, flag=args.flag_quality)
+        stages.append(quality)
+    if args.boundaries:
+        # Optional stage with extra dependencies, only imported when asked for
+        from enrich_boundaries import BoundaryTagger, parse_fields
+        stages.append(BoundaryTagger(args.boundaries, parse_fields(args.boundary_fields)))
+    if args.raster:
+        from enrich_rasters import open_sampler
+        try:
+            stages.append(open_sampler(args.raster))
+        except (KeyError, OSError, ValueError) as e:
+            print(f"❌ Cannot read raster: {e}")
+            return
+    density = None
+    if args.density_tiles:
+        from density_tiles import DensityPyramid
+        density = DensityPyramid(k=args.density_k)
+        stages.append(density)
+    sorter = None
+    if args.sort:
+        sorter = ExternalSorter(key=point_sort_key, run_size=args.sort_run_size, tmp_dir=args.tmp_dir)
+    quarantine = QuarantineSink(args.quarantine or f"quarantine_{timestamp}.jsonl")
+    participant_index = None
+    if args.participant_index and not args.preview:
+        from participant_index import ParticipantIndex
+        participant_index = ParticipantIndex(args.participant_index)
+    decryptor = LocationDecryptor(stages=stages, log_rows=args.log_rows, log_interval=args.log_interval,
+                                  quarantine=quarantine, decrypted_locations=sorter,
+                                  participant_index=participant_index,
+                                  compact_participants=args.compact_participants)
     
-    # Load private key
-    print(f"\n🔑 Loading private key...")
-    if not decryptor.load_private_key(key_file_path, password):
+    # Load and unlock every private key once, before any row is read
+    print(f"\n🔑 Loading private key{'s' if args.site_key else ''}...")
+    if key_file_path and not decryptor.load_private_key(key_file_path, key_password(key_file_path)):
         return
+    for site, site_key_path in args.site_key:
+        if not decryptor.load_private_key(site_key_path, key_password(site_key_path, site), site=site):
+            return
     
-    # Process CSV file
-    print(f"\n📊 Processing Qualtrics CSV export...")
-    if not decryptor.process_qualtrics_csv(csv_file_path):
+    if args.preview:
+        # Spot-check a sample of the export and stop; nothing is written
+        try:
+            decryptor.preview(csv_file_path, args.preview, args.envelope_format)
+        finally:
+            for stage in stages:
+                stage.close()
+            quarantine.close()
+            if sorter:
+                sorter.close()
         return
     
+    # Process CSV file (or the quarantined rows of an earlier run)
+    profiler = cProfile.Profile() if args.profile is not None else None
+    succeeded = False
+    try:
+        if profiler:
+            profiler.enable()
+        if args.retry_quarantine:
+            print(f"\n♻️  Retrying quarantined rows from {args.retry_quarantine}...")
+            succeeded = decryptor.retry_quarantine(args.retry_quarantine, args.envelope_format)
+        else:
+            print(f"\n📊 Processing Qualtrics CSV export...")
+            succeeded = decryptor.process_qualtrics_csv(csv_file_path, args.envelope_format)
+        if not succeeded:
+            return
+    finally:
+        if profiler:
+            profiler.disable()
+        for stage in stages:
+            stage.close()
+        quarantine.close()
+        if participant_index is not None:
+            participant_index.close()
+        if sorter and not succeeded:
+            sorter.close()
+    
     # Generate output filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    output_file = f"decrypted_locations_{timestamp}.csv"
-    
-    # Save decrypted data
-    print(f"\n💾 Saving decrypted data...")
-    if decryptor.save_decrypted_data(output_file):
-        print(f"\n🎉 SUCCESS!")
-        print(f"   Decrypted location data saved to: {output_file}")
-        print(f"   Total location points: {len(decryptor.decrypted_locations)}")
-        print(f"   You can now open this file in Excel or any spreadsheet program.")
+    output_file = args.output or f"decrypted_locations_{timestamp}.csv"
+    
+    # Save decrypted data (merging the sorted runs, if sorting)
+    print(f"\n💾 Saving decrypted data{' in participant and time order' if sorter else ''}...")
+    try:
+        if decryptor.save_decrypted_data(output_file):
+            print(f"\n🎉 SUCCESS!")
+            print(f"   Decrypted location data saved to: {output_file}")
+            print(f"   Total location points: {len(decryptor.decrypted_locations)}")
+            print(f"   You can now open this file in Excel or any spreadsheet program.")
+            if quality and args.quality_report:
+                quality.write_report(args.quality_report)
+                print(f"📄 Per-participant low-quality fix counts written to: {args.quality_report}")
+            if density:
+                try:
+                    with decryptor.metrics.timer('density'):
+                        density.write(args.density_tiles)
+                    print(f"🗺️  Density tiles (k = {args.density_k}) written to: {args.density_tiles}")
+                except OSError as e:
+                    print(f"❌ Error writing density tiles: {e}")
+            if args.rollups:
+                from activity_rollups import RollupStore
+                store = RollupStore(args.rollups)
+                try:
+                    with decryptor.metrics.timer('rollups'):
+                        totals = store.update(decryptor.decrypted_locations, run_size=args.sort_run_size)
+                finally:
+                    store.close()
+                print(f"📅 Rolled up {totals['applied']} new points into {totals['days_updated']} "
+                      f"participant-days in: {args.rollups}")
+                if totals['late']:
+                    print(f"⚠️  {totals['late']} points older than the rollup store's merge window were left out")
+    finally:
+        if sorter:
+            sorter.close()
+    decryptor.metrics.finish()
+    
+    if args.metrics:
+        decryptor.metrics.write(args.metrics, args.metrics_format)
+        print(f"📈 Metrics written to: {args.metrics}")
+    
+    if profiler:
+        profile_file = args.profile or f"decrypt_profile_{timestamp}.prof"
+        profiler.dump_stats(profile_file)
+        print(f"\n⏱️  Profile saved to: {profile_file} (top functions by cumulative time)")
+        pstats.Stats(profiler).sort_stats('cumulative').print_stats(15)
     
     print("\n" + "=" * 60)
     print("Thank you for using the Wellbeing Mapper decryption tool!")
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+"""
+Privacy-Preserving Density Tile Pyramid from Decrypted Points
+
+Builds study-wide heatmaps that can be shared and rendered without access to
+raw traces. Points are binned once into Web Mercator (XYZ) cells at the finest
+zoom level, and every coarser level is derived from the one below it by
+merging 2x2 cells, so no level re-reads the points.
+
+Each level keeps the distinct (cell, participant) pairs with their point
+counts, so every cell knows both how many points and how many different
+participants it contains. Cells with fewer than `k` participants (and,
+optionally, fewer than a minimum number of points) are suppressed before
+anything is written. Suppression works across levels: a cell's children are
+only shown if the cell is shown and every non-empty child passes the
+threshold. Otherwise a coarse cell's count minus its visible children would
+give away the suppressed ones; this way every count shown is the sum of the
+shown cells below it, or has none shown below it.
+
+Output is either
+- a directory of static tiles, `<z>/<x>/<y>.json`, where each tile lists the
+  non-suppressed cells `detail` levels below it as [column, row, points,
+  participants] (a 2**detail by 2**detail grid per tile), or
+- a single `.npz` array file with the cell x, y, points and participants of
+  every level.
+
+Usage:
+    python density_tiles.py decrypted_locations.csv -o density_tiles
+    python density_tiles.py decrypted_locations.csv -o density.npz --min-zoom 8 --max-zoom 16 -k 10
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+MAX_LATITUDE = 85.05112878
+
+def lonlat_to_cells(longitudes, latitudes, zoom):
+    """Web Mercator XYZ cell (x, y) at a zoom level for arrays of coordinates"""
+    n = 2 ** zoom
+    lat = np.radians(np.clip(latitudes, -MAX_LATITUDE, MAX_LATITUDE))
+    x = np.floor((np.asarray(longitudes) + 180.0) / 360.0 * n)
+    y = np.floor((1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / math.pi) / 2.0 * n)
+    return np.clip(x, 0, n - 1).astype(np.int64), np.clip(y, 0, n - 1).astype(np.int64)
+
+class DensityPyramid:
+    """Streams point coordinates into a multi-resolution, k-suppressed count pyramid
+
+    Used as a decryptor stage it only observes the points: process() returns
+    them unchanged.
+    """
+    name = 'density'
+    # Consolidate the buffered (cell, participant) pairs once this many are pending
+    FLUSH_PAIRS = 2000000
+
+    def __init__(self, min_zoom=8, max_zoom=16, k=5, min_points=1):
+        if not 0 <= min_zoom <= max_zoom <= 20:
+            raise ValueError("zoom levels must satisfy 0 <= min_zoom <= max_zoom <= 20")
+        self.min_zoom = min_zoom
+        self.max_zoom = max_zoom
+        self.k = k
+        self.min_points = min_points
+        # Pair key = (x << max_zoom | y) << participant_bits | participant
+        self.participant_bits = 63 - 2 * max_zoom
+        self.participant_ids = {}
+        self.keys = np.empty(0, dtype=np.int64)
+        self.counts = np.empty(0, dtype=np.int64)
+        self._pending = []
+        self._pending_size = 0
+        self.points_binned = 0
+        self.points_skipped = 0
+
+    def _participant_id(self, participant):
+        pid = self.participant_ids.get(participant)
+        if pid is None:
+            pid = self.participant_ids[participant] = len(self.participant_ids)
+            if pid >= 2 ** self.participant_bits:
+                raise ValueError(f"too many participants for max zoom {self.max_zoom}")
+        return pid
+
+    def add(self, participants, longitudes, latitudes):
+        """Bin a batch of coordinates (parallel sequences); invalid coordinates are skipped"""
+        lon = np.asarray(longitudes, dtype=float)
+        lat = np.asarray(latitudes, dtype=float)
+        valid = np.isfinite(lon) & np.isfinite(lat) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)
+        self.points_skipped += int(len(lon) - np.count_nonzero(valid))
+        if not valid.any():
+            return
+        pids = np.fromiter((self._participant_id(p) for p in participants), dtype=np.int64, count=len(lon))[valid]
+        x, y = lonlat_to_cells(lon[valid], lat[valid], self.max_zoom)
+        keys = (((x << self.max_zoom) | y) << self.participant_bits) | pids
+        unique, counts = np.unique(keys, return_counts=True)
+        self._pending.append((unique, counts))
+        self._pending_size += len(unique)
+        self.points_binned += int(np.count_nonzero(valid))
+        if self._pending_size >= self.FLUSH_PAIRS:
+            self._consolidate()
+
+    def _consolidate(self):
+        if not self._pending:
+            return
+        keys = np.concatenate([self.keys] + [k for k, _ in self._pending])
+        counts = np.concatenate([self.counts] + [c for _, c in self._pending])
+        self.keys, self.counts = _sum_by_key(keys, counts)
+        self._pending = []
+        self._pending_size = 0
+
+    def process(self, points):
+        participants, longitudes, latitudes = [], [], []
+        for point in points:
+            participant = point.get('participant_uuid')
+            if not participant or participant == 'Unknown':
+                participant = point.get('participant_code')
+            participants.append(participant or '')
+            longitudes.append(_to_float(point.get('longitude')))
+            latitudes.append(_to_float(point.get('latitude')))
+        self.add(participants, longitudes, latitudes)
+        return points
+
+    def levels(self):
+        """Yield (zoom, x, y, points, participants) arrays from the finest level to the coarsest,
+        before suppression"""
+        self._consolidate()
+        mask = (1 << self.participant_bits) - 1
+        cell_mask = (1 << self.max_zoom) - 1
+        cells = self.keys >> self.participant_bits
+        pids = self.keys & mask
+        x, y = cells >> self.max_zoom, cells & cell_mask
+        counts = self.counts
+        for zoom in range(self.max_zoom, self.min_zoom - 1, -1):
+            if zoom < self.max_zoom:
+                # Merge 2x2 children into their parent, keeping distinct participants
+                x, y = x >> 1, y >> 1
+                pair_keys, counts = _sum_by_key((((x << zoom) | y) << self.participant_bits) | pids, counts)
+                cells = pair_keys >> self.participant_bits
+                pids = pair_keys & mask
+                x, y = cells >> zoom, cells & ((1 << zoom) - 1)
+            level_cells = (x << zoom) | y
+            boundaries = np.flatnonzero(np.diff(level_cells)) + 1 if len(level_cells) else np.empty(0, dtype=np.int64)
+            starts = np.concatenate([[0], boundaries]).astype(np.int64) if len(level_cells) else boundaries
+            points = np.add.reduceat(counts, starts) if len(starts) else np.empty(0, dtype=np.int64)
+            participants = np.diff(np.concatenate([starts, [len(level_cells)]]))
+            yield zoom, x[starts], y[starts], points, participants
+
+    def suppressed_levels(self):
+        """Like levels(), with cells below the k-participant / minimum-point threshold removed, and the
+        children of every cell that is removed or has a removed child; yields
+        (zoom, x, y, points, participants, suppressed_cell_count)"""
+        # Decided from the coarsest level down, as each level depends on its parents
+        levels = list(self.levels())[::-1]
+        kept = []
+        shown_parents = None
+        for zoom, x, y, points, participants in levels:
+            keep = (participants >= self.k) & (points >= self.min_points)
+            if shown_parents is not None:
+                parents = ((x >> 1) << (zoom - 1)) | (y >> 1)
+                unique_parents, parent_index = np.unique(parents, return_inverse=True)
+                failing = np.bincount(parent_index, weights=~keep, minlength=len(unique_parents))
+                keep &= (failing[parent_index] == 0) & np.isin(parents, shown_parents)
+            shown_parents = ((x << zoom) | y)[keep]
+            kept.append((zoom, x[keep], y[keep], points[keep], participants[keep],
+                         int(len(keep) - np.count_nonzero(keep))))
+        yield from reversed(kept)
+
+    def write_npz(self, path):
+        """Write all levels to one .npz file; returns {zoom: (cells_kept, cells_suppressed)}"""
+        arrays, summary = {}, {}
+        for zoom, x, y, points, participants, suppressed in self.suppressed_levels():
+            arrays.update({f'z{zoom}_x': x, f'z{zoom}_y': y, f'z{zoom}_points': points,
+                           f'z{zoom}_participants': participants})
+            summary[zoom] = (len(x), suppressed)
+        metadata = {'min_zoom': self.min_zoom, 'max_zoom': self.max_zoom, 'k': self.k,
+                    'min_points': self.min_points, 'scheme': 'xyz'}
+        np.savez_compressed(path, metadata=np.array(json.dumps(metadata)), **arrays)
+        return summary
+
+    def write_tiles(self, directory, detail=4):
+        """Write <z>/<x>/<y>.json tiles of the cells `detail` levels below each tile
+
+        Tiles are written for zooms min_zoom - detail .. max_zoom - detail (never below 0).
+        Returns {tile_zoom: (cells_kept, cells_suppressed)}.
+        """
+        directory = Path(directory)
+        _remove_tiles(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        summary = {}
+        for zoom, x, y, points, participants, suppressed in self.suppressed_levels():
+            tile_zoom = zoom - detail
+            if tile_zoom < 0:
+                continue
+            summary[tile_zoom] = (len(x), suppressed)
+            tile_x, tile_y = x >> detail, y >> detail
+            order = np.lexsort((tile_y, tile_x))
+            tile_keys = (tile_x[order] << tile_zoom) | tile_y[order]
+            starts = np.flatnonzero(np.diff(tile_keys)) + 1
+            for group in np.split(order, starts):
+                if not len(group):
+                    continue
+                tx, ty = int(tile_x[group[0]]), int(tile_y[group[0]])
+                tile = {
+                    'zoom': zoom,
+                    'cells': [[int(cx) - (tx << detail), int(cy) - (ty << detail), int(p), int(n)]
+                              for cx, cy, p, n in zip(x[group], y[group], points[group], participants[group])],
+                }
+                tile_path = directory / str(tile_zoom) / str(tx) / f"{ty}.json"
+                tile_path.parent.mkdir(parents=True, exist_ok=True)
+                with open(tile_path, 'w', encoding='utf-8') as f:
+                    json.dump(tile, f, separators=(',', ':'))
+        with open(directory / 'metadata.json', 'w', encoding='utf-8') as f:
+            json.dump({
+                'scheme': 'xyz', 'detail': detail, 'k': self.k, 'min_points': self.min_points,
+                'tile_zooms': sorted(summary), 'cell_zooms': [self.min_zoom, self.max_zoom],
+                'cell_format': ['column', 'row', 'points', 'participants'],
+            }, f, indent=2)
+        return summary
+
+    def write(self, output, detail=4):
+        """Write .npz for paths ending in .npz, otherwise a tile directory"""
+        if str(output).endswith('.npz'):
+            return self.write_npz(output)
+        return self.write_tiles(output, detail)
+
+    def report(self):
+        print(f"   Points binned for density tiles: {self.points_binned} "
+              f"from {len(self.participant_ids)} participants")
+
+    def close(self):
+        pass
+
+def _remove_tiles(directory):
+    """Delete the tiles of an earlier run in a tile directory (one with a metadata.json)"""
+    if not (directory / 'metadata.json').is_file():
+        return
+    for zoom_dir in directory.iterdir():
+        if not (zoom_dir.is_dir() and zoom_dir.name.isdigit()):
+            continue
+        for column_dir in zoom_dir.iterdir():
+            if column_dir.is_dir() and column_dir.name.isdigit():
+                for tile in column_dir.glob('*.json'):
+                    tile.unlink()
+                if not any(column_dir.iterdir()):
+                    column_dir.rmdir()
+        if not any(zoom_dir.iterdir()):
+            zoom_dir.rmdir()
+    (directory / 'metadata.json').unlink()
+
+def _sum_by_key(keys, counts):
+    """Sorted unique keys with the counts of equal keys summed"""
+    if not len(keys):
+        return keys, counts
+    order = np.argsort(keys, kind='stable')
+    keys, counts = keys[order], counts[order]
+    starts = np.concatenate([[0], np.flatnonzero(np.diff(keys)) + 1])
+    return keys[starts], np.add.reduceat(counts, starts)
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return float('nan')
+
+def print_summary(summary, label):
+    for zoom in sorted(summary):
+        kept, suppressed = summary[zoom]
+        print(f"   {label} {zoom:>2}: {kept} cells written, {suppressed} suppressed")
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a k-suppressed density tile pyramid from decrypted points")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('-o', '--output', required=True, help="Tile directory, or a .npz file for an array file")
+    parser.add_argument('--min-zoom', type=int, default=8, help="Coarsest cell zoom level (default: 8)")
+    parser.add_argument('--max-zoom', type=int, default=16, help="Finest cell zoom level, at most 20 (default: 16)")
+    parser.add_argument('-k', type=int, default=5, help="Suppress cells with fewer participants than this (default: 5)")
+    parser.add_argument('--min-points', type=int, default=1, help="Also suppress cells with fewer points (default: 1)")
+    parser.add_argument('--detail', type=int, default=4,
+                        help="Cell levels below each tile, i.e. 2^detail cells across a tile (default: 4)")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Points binned per batch (default: 100000)")
+    args = parser.parse_args()
+
+    if not Path(args.points).exists():
+        print(f"❌ File not found: {args.points}")
+        sys.exit(1)
+    try:
+        pyramid = DensityPyramid(args.min_zoom, args.max_zoom, args.k, args.min_points)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    with open(args.points, 'r', encoding='utf-8', newline='') as file:
+        batch = []
+        for row in csv.DictReader(file):
+            batch.append(row)
+            if len(batch) >= args.batch_size:
+                pyramid.process(batch)
+                batch = []
+        pyramid.process(batch)
+
+    print(f"🗺️  Binned {pyramid.points_binned} points from {len(pyramid.participant_ids)} participants "
+          f"(k = {args.k})")
+    summary = pyramid.write(args.output, args.detail)
+    print_summary(summary, 'cell zoom' if str(args.output).endswith('.npz') else 'tile zoom')
+    print(f"✅ Density pyramid written to: {args.output}")
+
+if __name__ == '__main__':
+    main()
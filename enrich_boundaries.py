@@ -0,0 +1,314 @@
+#!/usr/bin/env python3
+"""
+Administrative Boundary Enrichment for Decrypted Location Points
+
+Tags every location point with the properties (ward, municipality, ...) of
+the polygon it falls in, using a local GeoJSON boundary file such as the
+Gauteng ward or municipal boundaries. Nothing is sent over the network.
+
+The boundary file is loaded once and prepared for fast lookups:
+- polygon bounding boxes are packed into a Sort-Tile-Recursive (STR) index,
+  so each point is only tested against the few polygons whose box contains it
+- each polygon's edges are bucketed into horizontal bands, so a point is only
+  tested against the edges that cross its latitude
+
+Points are tagged in NumPy batches, either as they come out of the decryptor
+(decrypt_location_data.py --boundaries) or from a decrypted CSV.
+
+Usage:
+    python enrich_boundaries.py decrypted_locations.csv --boundaries gauteng_wards.geojson
+    python enrich_boundaries.py decrypted_locations.csv --boundaries wards.geojson \\
+        --fields WardID,Municipality -o tagged_locations.csv
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import json
+import math
+import sys
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import POINT_FIELDNAMES
+
+class PreparedPolygon:
+    """A (multi)polygon prepared for vectorized point-in-polygon tests
+
+    All rings of all parts are kept as one edge list and tested with the
+    even-odd rule, which handles holes and multi-part wards alike. Edges are
+    bucketed into horizontal bands so each point is only tested against the
+    edges spanning its latitude.
+    """
+    # Upper bound on the points x edges matrix evaluated at once
+    MAX_CELLS = 2000000
+
+    def __init__(self, rings):
+        x1, y1, x2, y2 = [], [], [], []
+        for ring in rings:
+            if len(ring) < 3:
+                continue
+            for (ax, ay), (bx, by) in zip(ring, ring[1:] + ring[:1]):
+                if ay != by:  # Horizontal edges never cross a horizontal ray
+                    x1.append(ax); y1.append(ay); x2.append(bx); y2.append(by)
+        self.x1 = np.array(x1, dtype=float)
+        self.y1 = np.array(y1, dtype=float)
+        self.x2 = np.array(x2, dtype=float)
+        self.y2 = np.array(y2, dtype=float)
+        self.slope = (self.x2 - self.x1) / (self.y2 - self.y1)
+
+        all_x = [x for ring in rings for x, _ in ring]
+        all_y = [y for ring in rings for _, y in ring]
+        self.bounds = (min(all_x), min(all_y), max(all_x), max(all_y)) if all_x else (math.inf, math.inf, -math.inf, -math.inf)
+
+        # Edge bands: band b covers [miny + b*h, miny + (b+1)*h]
+        self.band_count = max(1, min(256, len(self.x1) // 16))
+        self.band_height = (self.bounds[3] - self.bounds[1]) / self.band_count or 1.0
+        low = np.minimum(self.y1, self.y2)
+        high = np.maximum(self.y1, self.y2)
+        first = np.clip(((low - self.bounds[1]) / self.band_height).astype(int), 0, self.band_count - 1)
+        last = np.clip(((high - self.bounds[1]) / self.band_height).astype(int), 0, self.band_count - 1)
+        self.band_edges = [[] for _ in range(self.band_count)]
+        for edge, (a, b) in enumerate(zip(first, last)):
+            for band in range(a, b + 1):
+                self.band_edges[band].append(edge)
+        self.band_edges = [np.array(edges, dtype=np.intp) for edges in self.band_edges]
+
+    def _crossings_odd(self, xs, ys, edges):
+        inside = np.zeros(len(xs), dtype=bool)
+        if not len(edges):
+            return inside
+        x1, y1, y2, slope = self.x1[edges], self.y1[edges], self.y2[edges], self.slope[edges]
+        step = max(1, self.MAX_CELLS // len(edges))
+        for start in range(0, len(xs), step):
+            px = xs[start:start + step, None]
+            py = ys[start:start + step, None]
+            crosses = (y1 > py) != (y2 > py)
+            hits = crosses & (px < x1 + (py - y1) * slope)
+            inside[start:start + step] = np.count_nonzero(hits, axis=1) % 2 == 1
+        return inside
+
+    def contains(self, xs, ys):
+        """Boolean array: which of the points (xs = longitudes, ys = latitudes) are inside"""
+        inside = np.zeros(len(xs), dtype=bool)
+        bands = np.clip(((ys - self.bounds[1]) / self.band_height).astype(int), 0, self.band_count - 1)
+        order = np.argsort(bands, kind='stable')
+        sorted_bands = bands[order]
+        boundaries = np.flatnonzero(np.diff(sorted_bands)) + 1
+        for group in np.split(order, boundaries):
+            if len(group):
+                inside[group] = self._crossings_odd(xs[group], ys[group], self.band_edges[bands[group[0]]])
+        return inside
+
+class STRIndex:
+    """Sort-Tile-Recursive packed bounding-box index (one level of leaf nodes)
+
+    Polygons are sorted into vertical slices by box centre x, each slice by
+    centre y, and packed `node_capacity` to a node. A query tests a batch of
+    points against the node boxes, then the member boxes of the nodes they hit.
+    """
+    def __init__(self, bounds, node_capacity=16):
+        self.bounds = np.array(bounds, dtype=float).reshape(-1, 4)
+        count = len(self.bounds)
+        leaves = max(1, math.ceil(count / node_capacity))
+        slice_size = node_capacity * max(1, math.ceil(math.sqrt(leaves)))
+
+        centre_x = (self.bounds[:, 0] + self.bounds[:, 2]) / 2
+        centre_y = (self.bounds[:, 1] + self.bounds[:, 3]) / 2
+        self.node_members = []
+        by_x = np.argsort(centre_x, kind='stable')
+        for start in range(0, count, slice_size):
+            tile = by_x[start:start + slice_size]
+            tile = tile[np.argsort(centre_y[tile], kind='stable')]
+            for node_start in range(0, len(tile), node_capacity):
+                self.node_members.append(tile[node_start:node_start + node_capacity])
+
+        self.node_bounds = np.array([
+            [self.bounds[m, 0].min(), self.bounds[m, 1].min(), self.bounds[m, 2].max(), self.bounds[m, 3].max()]
+            for m in self.node_members
+        ]).reshape(-1, 4)
+
+    @staticmethod
+    def _within(xs, ys, box):
+        return (xs >= box[0]) & (xs <= box[2]) & (ys >= box[1]) & (ys <= box[3])
+
+    def query(self, xs, ys):
+        """Yield (polygon_index, point_indices) for every polygon box containing points"""
+        for node_box, members in zip(self.node_bounds, self.node_members):
+            in_node = np.flatnonzero(self._within(xs, ys, node_box))
+            if not len(in_node):
+                continue
+            node_xs, node_ys = xs[in_node], ys[in_node]
+            for polygon in members:
+                hits = in_node[self._within(node_xs, node_ys, self.bounds[polygon])]
+                if len(hits):
+                    yield polygon, hits
+
+def geometry_rings(geometry):
+    """Return the rings of a GeoJSON Polygon/MultiPolygon as lists of (lon, lat), or None"""
+    if not geometry:
+        return None
+    if geometry.get('type') == 'Polygon':
+        polygons = [geometry.get('coordinates') or []]
+    elif geometry.get('type') == 'MultiPolygon':
+        polygons = geometry.get('coordinates') or []
+    else:
+        return None
+    rings = []
+    for polygon in polygons:
+        for ring in polygon:
+            points = [(float(p[0]), float(p[1])) for p in ring]
+            if len(points) > 1 and points[0] == points[-1]:
+                points.pop()
+            rings.append(points)
+    return rings
+
+def load_boundaries(boundary_file):
+    """Read a GeoJSON file; returns ([properties], [PreparedPolygon], skipped_feature_count)"""
+    with open(boundary_file, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+
+    features = data.get('features', []) if data.get('type') == 'FeatureCollection' else [data]
+    properties, polygons, skipped = [], [], 0
+    for feature in features:
+        rings = geometry_rings(feature.get('geometry'))
+        if not rings:
+            skipped += 1
+            continue
+        properties.append(feature.get('properties') or {})
+        polygons.append(PreparedPolygon(rings))
+    return properties, polygons, skipped
+
+def _coordinate_array(values):
+    array = np.empty(len(values), dtype=float)
+    for i, value in enumerate(values):
+        try:
+            array[i] = float(value)
+        except (TypeError, ValueError):
+            array[i] = np.nan
+    return array
+
+class BoundaryTagger:
+    """Pipeline stage that adds boundary properties to each point
+
+    `fields` selects which feature properties to copy (default: all of them).
+    Properties that clash with a point column are written as `boundary_<name>`.
+    Points outside every polygon get empty values. Where polygons overlap the
+    first matching feature in the file wins.
+    """
+    name = 'boundaries'
+
+    def __init__(self, boundary_file, fields=None):
+        self.properties, self.polygons, self.skipped_features = load_boundaries(boundary_file)
+        self.index = STRIndex([polygon.bounds for polygon in self.polygons])
+
+        if fields is None:
+            fields = list(dict.fromkeys(name for props in self.properties for name in props))
+        self.fields = list(fields)
+        self.fieldnames = [f"boundary_{name}" if name in POINT_FIELDNAMES else name for name in self.fields]
+        # Row of output values per polygon, so tagging is a single lookup
+        self.values = [
+            [('' if props.get(name) is None else props.get(name)) for name in self.fields]
+            for props in self.properties
+        ]
+        self.empty_values = [''] * len(self.fields)
+        self.tagged = 0
+        self.untagged = 0
+
+    def locate(self, longitudes, latitudes):
+        """Index of the polygon containing each point, or -1"""
+        xs = np.asarray(longitudes, dtype=float)
+        ys = np.asarray(latitudes, dtype=float)
+        found = np.full(len(xs), -1, dtype=np.intp)
+        # The index visits polygons in tile order, not file order; a point keeps
+        # the earliest feature in the file that contains it
+        for polygon, candidates in self.index.query(xs, ys):
+            candidates = candidates[(found[candidates] < 0) | (found[candidates] > polygon)]
+            if len(candidates):
+                inside = self.polygons[polygon].contains(xs[candidates], ys[candidates])
+                found[candidates[inside]] = polygon
+        return found
+
+    def process(self, points):
+        """Tag a batch of point dicts in place and return them"""
+        if not points:
+            return points
+        found = self.locate(
+            _coordinate_array([point.get('longitude') for point in points]),
+            _coordinate_array([point.get('latitude') for point in points])
+        )
+        for point, polygon in zip(points, found.tolist()):
+            values = self.values[polygon] if polygon >= 0 else self.empty_values
+            point.update(zip(self.fieldnames, values))
+        matched = int(np.count_nonzero(found >= 0))
+        self.tagged += matched
+        self.untagged += len(points) - matched
+        return points
+
+    def report(self):
+        print(f"   Points inside a boundary: {self.tagged} (outside every boundary: {self.untagged})")
+
+    def close(self):
+        pass
+
+def enrich_csv(input_csv, output_csv, tagger, batch_size=100000):
+    """Tag the points of a decrypted location CSV in batches; returns the number of rows"""
+    count = 0
+    with open(input_csv, 'r', encoding='utf-8', newline='') as src, \
+         open(output_csv, 'w', newline='', encoding='utf-8') as out:
+        reader = csv.DictReader(src)
+        fieldnames = list(reader.fieldnames or []) + [name for name in tagger.fieldnames if name not in (reader.fieldnames or [])]
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                writer.writerows(tagger.process(batch))
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.writerows(tagger.process(batch))
+            count += len(batch)
+    return count
+
+def parse_fields(value):
+    return [name.strip() for name in value.split(',') if name.strip()] if value else None
+
+def main():
+    parser = argparse.ArgumentParser(description="Tag decrypted location points with the boundary (e.g. ward) they fall in")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--boundaries', required=True, help="GeoJSON file of boundary polygons")
+    parser.add_argument('--fields', help="Comma-separated feature properties to add (default: all)")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Points tagged per batch (default: 100000)")
+    parser.add_argument('-o', '--output', help="Output CSV (default: tagged_locations_<timestamp>.csv)")
+    args = parser.parse_args()
+
+    for path in (args.points, args.boundaries):
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+
+    tagger = BoundaryTagger(args.boundaries, parse_fields(args.fields))
+    print(f"🗺️  Loaded {len(tagger.polygons)} boundaries from {args.boundaries}")
+    if tagger.skipped_features:
+        print(f"⚠️  Skipped {tagger.skipped_features} features without polygon geometry")
+
+    output = args.output or f"tagged_locations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    count = enrich_csv(args.points, output, tagger, args.batch_size)
+    print(f"✅ Tagged {count} points, written to: {output}")
+    tagger.report()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,406 @@
+#!/usr/bin/env python3
+"""
+Raster Exposure Sampling for Decrypted Location Points
+
+Adds the value of local rasters (greenness, land use, night-time light, ...)
+under every location point, for exposure measures along each participant's
+trace. Nothing is sent over the network.
+
+Rasters are memory-mapped, never loaded into RAM: points are converted to
+pixel rows and columns with vectorized affine arithmetic and the pixels are
+gathered in one bulk read per batch (in file order, so the operating system
+only pages in the parts of the raster the points actually touch). Millions
+of points over a country-sized raster take seconds.
+
+Supported rasters:
+- uncompressed GeoTIFF / BigTIFF (striped or tiled, any band), in
+  longitude/latitude (e.g. EPSG:4326) or Web Mercator (EPSG:3857).
+  Compressed or otherwise projected files can be converted once with GDAL:
+      gdalwarp -t_srs EPSG:4326 -co COMPRESS=NONE -co TILED=YES in.tif out.tif
+- a NumPy .npy array with a JSON sidecar (same name, .json) holding its
+  geotransform: {"geotransform": [x0, dx, 0, y0, 0, -dy], "nodata": -9999,
+  "crs": "EPSG:4326"}, or an array and geotransform passed from Python
+
+Each value is taken from the pixel containing the point (nearest
+neighbour). Points outside the raster or on nodata pixels get empty values.
+
+Usage:
+    python enrich_rasters.py decrypted_locations.csv --raster ndvi=gauteng_ndvi.tif
+    python enrich_rasters.py decrypted_locations.csv --raster ndvi=ndvi.tif --raster light=viirs.tif \\
+        --raster landuse=landcover.npy -o exposure.csv
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import json
+import struct
+import sys
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import POINT_FIELDNAMES
+from enrich_boundaries import enrich_csv
+
+WEB_MERCATOR_RADIUS = 6378137.0
+# Coordinate systems given as EPSG codes that points can be projected to
+LONLAT_CRS = 'EPSG:4326'
+MERCATOR_CRS = 'EPSG:3857'
+MERCATOR_CODES = {3857, 3785, 900913}
+
+# TIFF field types: (struct code, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1), 2: ('s', 1), 3: ('H', 2), 4: ('I', 4), 5: ('II', 8), 6: ('b', 1), 7: ('B', 1),
+    8: ('h', 2), 9: ('i', 4), 10: ('ii', 8), 11: ('f', 4), 12: ('d', 8), 16: ('Q', 8), 17: ('q', 8), 18: ('Q', 8),
+}
+
+def read_tiff_tags(path):
+    """Read the tags of the first image of a TIFF or BigTIFF file; returns (byte order, {tag: values})"""
+    with open(path, 'rb') as f:
+        header = f.read(16)
+        if header[:2] not in (b'II', b'MM'):
+            raise ValueError(f"{path} is not a TIFF file")
+        order = '<' if header[:2] == b'II' else '>'
+        magic = struct.unpack(order + 'H', header[2:4])[0]
+        if magic == 42:
+            ifd_offset = struct.unpack(order + 'I', header[4:8])[0]
+            count_format, entry_format, entry_size, inline_size = 'H', 'HHI4s', 12, 4
+        elif magic == 43:
+            ifd_offset = struct.unpack(order + 'Q', header[8:16])[0]
+            count_format, entry_format, entry_size, inline_size = 'Q', 'HHQ8s', 20, 8
+        else:
+            raise ValueError(f"{path} is not a TIFF file")
+
+        f.seek(ifd_offset)
+        (count,) = struct.unpack(order + count_format, f.read(struct.calcsize(count_format)))
+        entries = f.read(count * entry_size)
+        tags = {}
+        for i in range(count):
+            tag, field_type, n, inline = struct.unpack(order + entry_format, entries[i * entry_size:(i + 1) * entry_size])
+            if field_type not in TIFF_TYPES:
+                continue
+            code, size = TIFF_TYPES[field_type]
+            length = size * n
+            if length <= inline_size:
+                data = inline[:length]
+            else:
+                f.seek(struct.unpack(order + ('I' if inline_size == 4 else 'Q'), inline)[0])
+                data = f.read(length)
+            if field_type == 2:
+                tags[tag] = data.split(b'\0', 1)[0].decode('ascii', 'replace')
+            else:
+                values = struct.unpack(order + code[0] * (n * len(code)), data)
+                if field_type in (5, 10):
+                    values = tuple(values[j] / values[j + 1] if values[j + 1] else 0.0 for j in range(0, len(values), 2))
+                tags[tag] = values
+        return order, tags
+
+def lonlat_to_mercator(longitudes, latitudes):
+    """Project longitude/latitude arrays to Web Mercator metres"""
+    lat = np.clip(latitudes, -85.05112878, 85.05112878)
+    x = WEB_MERCATOR_RADIUS * np.radians(longitudes)
+    y = WEB_MERCATOR_RADIUS * np.log(np.tan(np.pi / 4 + np.radians(lat) / 2))
+    return x, y
+
+class Raster:
+    """A georeferenced single-band raster sampled at longitude/latitude points
+
+    Subclasses provide `width`, `height`, `dtype` and `_gather(rows, cols)`.
+    `geotransform` is GDAL-style: (x0, pixel width, row rotation, y0, column
+    rotation, pixel height), mapping (column, row) to the raster's coordinates.
+    """
+
+    def __init__(self, geotransform, nodata=None, crs=LONLAT_CRS):
+        if crs not in (LONLAT_CRS, MERCATOR_CRS):
+            raise ValueError(f"Unsupported coordinate system {crs} (use {LONLAT_CRS} or {MERCATOR_CRS})")
+        x0, a, b, y0, d, e = [float(value) for value in geotransform]
+        det = a * e - b * d
+        if det == 0:
+            raise ValueError("Geotransform is not invertible")
+        self.geotransform = (x0, a, b, y0, d, e)
+        # Inverse affine transform, from raster coordinates to (column, row)
+        self._inverse = (e / det, -b / det, -d / det, a / det)
+        self.nodata = nodata
+        self.crs = crs
+
+    def pixel_indices(self, longitudes, latitudes):
+        """Return (rows, cols, inside) for arrays of point coordinates"""
+        lon = np.asarray(longitudes, dtype=float)
+        lat = np.asarray(latitudes, dtype=float)
+        x, y = lonlat_to_mercator(lon, lat) if self.crs == MERCATOR_CRS else (lon, lat)
+        x0, _, _, y0, _, _ = self.geotransform
+        ia, ib, id_, ie = self._inverse
+        with np.errstate(invalid='ignore'):
+            cols = np.floor(ia * (x - x0) + ib * (y - y0))
+            rows = np.floor(id_ * (x - x0) + ie * (y - y0))
+            inside = (cols >= 0) & (cols < self.width) & (rows >= 0) & (rows < self.height)
+        rows = np.where(inside, rows, 0).astype(np.int64)
+        cols = np.where(inside, cols, 0).astype(np.int64)
+        return rows, cols, inside
+
+    def sample(self, longitudes, latitudes):
+        """Return (values, valid): the pixel value under each point, and whether it has one"""
+        rows, cols, inside = self.pixel_indices(longitudes, latitudes)
+        values = np.zeros(len(rows), dtype=self.dtype)
+        where = np.flatnonzero(inside)
+        if len(where):
+            # Read in file order, so pages are touched sequentially
+            flat = rows[where] * self.width + cols[where]
+            order = np.argsort(flat, kind='stable')
+            where = where[order]
+            values[where] = self._gather(rows[where], cols[where])
+        valid = inside.copy()
+        if self.nodata is not None:
+            valid &= values != self.nodata
+        if values.dtype.kind == 'f':
+            valid &= ~np.isnan(values)
+        return values, valid
+
+    def close(self):
+        pass
+
+class ArrayRaster(Raster):
+    """A raster held in a 2-D NumPy array (or memory-mapped .npy file)"""
+
+    def __init__(self, array, geotransform, nodata=None, crs=LONLAT_CRS):
+        if np.ndim(array) != 2:
+            raise ValueError("Raster array must be 2-D (rows, columns)")
+        self.array = array
+        self.height, self.width = array.shape
+        self.dtype = array.dtype
+        super().__init__(geotransform, nodata, crs)
+
+    @classmethod
+    def from_npy(cls, path):
+        """Memory-map a .npy raster; its geotransform is read from the JSON file next to it"""
+        sidecar = Path(path).with_suffix('.json')
+        if not sidecar.exists():
+            raise ValueError(f"{path} needs a {sidecar.name} file with its geotransform")
+        with open(sidecar, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if 'geotransform' not in meta:
+            raise ValueError(f"{sidecar} has no geotransform")
+        return cls(np.load(path, mmap_mode='r'), meta['geotransform'], meta.get('nodata'), meta.get('crs', LONLAT_CRS))
+
+    def _gather(self, rows, cols):
+        return self.array[rows, cols]
+
+    def close(self):
+        self.array = None
+
+class GeoTiffRaster(Raster):
+    """One band of an uncompressed GeoTIFF, memory-mapped
+
+    Pixel addresses are computed from the strip or tile layout, so any
+    uncompressed striped or tiled file can be sampled without decoding it.
+    """
+
+    def __init__(self, path, band=1):
+        order, tags = read_tiff_tags(path)
+        self.path = str(path)
+        self.width = tags[256][0]
+        self.height = tags[257][0]
+        compression = tags.get(259, (1,))[0]
+        if compression != 1:
+            raise ValueError(f"{path} is compressed; memory-mapping needs an uncompressed file "
+                             "(gdal_translate -co COMPRESS=NONE in.tif out.tif)")
+        self.samples = tags.get(277, (1,))[0]
+        if not 1 <= band <= self.samples:
+            raise ValueError(f"{path} has {self.samples} band(s), not band {band}")
+        self.band = band - 1
+        self.planar = tags.get(284, (1,))[0]
+        bits = tags.get(258, (8,))[0]
+        kind = {1: 'u', 2: 'i', 3: 'f'}.get(tags.get(339, (1,))[0])
+        if kind is None or bits % 8 or (kind == 'f' and bits not in (32, 64)):
+            raise ValueError(f"{path} has an unsupported pixel type ({bits}-bit, sample format {tags.get(339, (1,))[0]})")
+        self.dtype = np.dtype(f"{order}{kind}{bits // 8}")
+
+        if 322 in tags:
+            self.chunk_width, self.chunk_height = tags[322][0], tags[323][0]
+            self.offsets = np.array(tags[324], dtype=np.int64)
+            counts = tags.get(325)
+        else:
+            # Strips are chunks spanning the full width; RowsPerStrip may exceed the height
+            self.chunk_width, self.chunk_height = self.width, min(tags.get(278, (self.height,))[0], self.height)
+            self.offsets = np.array(tags[273], dtype=np.int64)
+            counts = tags.get(279)
+        # Sparse files leave empty chunks unwritten (offset and byte count 0)
+        self.present = np.array(counts, dtype=np.int64) > 0 if counts else np.ones(len(self.offsets), dtype=bool)
+        self.chunks_across = -(-self.width // self.chunk_width)
+        self.chunks_per_band = self.chunks_across * -(-self.height // self.chunk_height)
+
+        geotransform, crs = self._georeference(path, tags)
+        nodata = tags.get(42113)
+        nodata = float(nodata) if nodata and nodata.strip().lower() != 'nan' else None
+        super().__init__(geotransform, nodata, crs)
+        self._file = np.memmap(path, dtype=np.uint8, mode='r')
+
+    @staticmethod
+    def _georeference(path, tags):
+        keys = {}
+        directory = tags.get(34735)
+        if directory:
+            for i in range(4, 4 + 4 * directory[3], 4):
+                key, location, _, value = directory[i:i + 4]
+                if location == 0:
+                    keys[key] = value
+        model_type = keys.get(1024)
+        if model_type == 1:
+            projected = keys.get(3072)
+            if projected not in MERCATOR_CODES:
+                raise ValueError(f"{path} is in a projected coordinate system (EPSG:{projected}); reproject it "
+                                 "to longitude/latitude first (gdalwarp -t_srs EPSG:4326 in.tif out.tif)")
+            crs = MERCATOR_CRS
+        else:
+            crs = LONLAT_CRS
+
+        if 34264 in tags:
+            m = tags[34264]
+            geotransform = [m[3], m[0], m[1], m[7], m[4], m[5]]
+        elif 33550 in tags and 33922 in tags:
+            scale_x, scale_y = tags[33550][:2]
+            i, j, _, x, y, _ = tags[33922][:6]
+            geotransform = [x - i * scale_x, scale_x, 0.0, y + j * scale_y, 0.0, -scale_y]
+        else:
+            raise ValueError(f"{path} has no georeferencing (not a GeoTIFF)")
+        if keys.get(1025) == 2:
+            # PixelIsPoint: the tie point is the centre of the pixel, not its corner
+            x0, a, b, y0, d, e = geotransform
+            geotransform = [x0 - (a + b) / 2, a, b, y0 - (d + e) / 2, d, e]
+        return geotransform, crs
+
+    def _gather(self, rows, cols):
+        chunk = (rows // self.chunk_height) * self.chunks_across + cols // self.chunk_width
+        within = (rows % self.chunk_height) * self.chunk_width + cols % self.chunk_width
+        if self.planar == 2:
+            chunk = chunk + self.band * self.chunks_per_band
+        else:
+            within = within * self.samples + self.band
+        present = self.present[chunk]
+        starts = self.offsets[chunk] + within * self.dtype.itemsize
+        # Gather each value's bytes, then reinterpret them in the file's byte order
+        byte_index = starts[:, None] + np.arange(self.dtype.itemsize)
+        values = np.ascontiguousarray(self._file[byte_index[present]]).view(self.dtype).ravel()
+        if present.all():
+            return values
+        gathered = np.full(len(rows), self.nodata if self.nodata is not None else 0, dtype=self.dtype)
+        gathered[present] = values
+        return gathered
+
+    def close(self):
+        self._file = None
+
+def open_raster(path, band=1):
+    """Open a .tif/.tiff raster or a .npy array (with its .json sidecar)"""
+    if str(path).lower().endswith('.npy'):
+        return ArrayRaster.from_npy(path)
+    return GeoTiffRaster(path, band)
+
+def parse_raster_spec(value):
+    """Parse NAME=PATH or NAME=PATH@BAND into (name, path, band)"""
+    name, separator, path = value.partition('=')
+    if not separator or not name.strip() or not path.strip():
+        raise argparse.ArgumentTypeError(f"expected NAME=PATH, got {value!r}")
+    band = 1
+    head, at, tail = path.rpartition('@')
+    if at and tail.isdigit():
+        path, band = head, int(tail)
+    return name.strip(), path.strip(), band
+
+def _coordinate_array(values):
+    array = np.empty(len(values), dtype=float)
+    for i, value in enumerate(values):
+        try:
+            array[i] = float(value)
+        except (TypeError, ValueError):
+            array[i] = np.nan
+    return array
+
+class RasterSampler:
+    """Pipeline stage that adds one column per raster with the value under each point
+
+    `rasters` maps column names to Raster objects. Names that clash with a
+    point column are written as `raster_<name>`. Points outside a raster or
+    on its nodata pixels get empty values.
+    """
+    name = 'rasters'
+
+    def __init__(self, rasters):
+        self.rasters = dict(rasters)
+        self.fieldnames = [f"raster_{name}" if name in POINT_FIELDNAMES else name for name in self.rasters]
+        self.sampled = {name: 0 for name in self.rasters}
+        self.missing = {name: 0 for name in self.rasters}
+
+    def process(self, points):
+        """Add the raster values to a batch of point dicts in place and return them"""
+        if not points:
+            return points
+        longitudes = _coordinate_array([point.get('longitude') for point in points])
+        latitudes = _coordinate_array([point.get('latitude') for point in points])
+        for (name, raster), fieldname in zip(self.rasters.items(), self.fieldnames):
+            values, valid = raster.sample(longitudes, latitudes)
+            # float32 values are written at their own precision, not as float64 noise
+            values = values.astype(str) if values.dtype.kind == 'f' and values.dtype.itemsize < 8 else values
+            for point, value, ok in zip(points, values.tolist(), valid.tolist()):
+                point[fieldname] = value if ok else ''
+            found = int(np.count_nonzero(valid))
+            self.sampled[name] += found
+            self.missing[name] += len(points) - found
+        return points
+
+    def report(self):
+        for name in self.rasters:
+            print(f"   Raster {name}: {self.sampled[name]} points sampled "
+                  f"(outside the raster or nodata: {self.missing[name]})")
+
+    def close(self):
+        for raster in self.rasters.values():
+            raster.close()
+
+def open_sampler(specs):
+    """Build a RasterSampler from (name, path, band) specs"""
+    return RasterSampler({name: open_raster(path, band) for name, path, band in specs})
+
+def main():
+    parser = argparse.ArgumentParser(description="Add raster values (e.g. greenness) under decrypted location points")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--raster', action='append', type=parse_raster_spec, required=True, metavar='NAME=PATH',
+                        help="Column name and raster (.tif or .npy); add @BAND to pick a band of a "
+                             "multi-band GeoTIFF. Repeat for several rasters")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Points sampled per batch (default: 100000)")
+    parser.add_argument('-o', '--output', help="Output CSV (default: exposure_locations_<timestamp>.csv)")
+    args = parser.parse_args()
+
+    for path in [args.points] + [path for _, path, _ in args.raster]:
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+
+    try:
+        sampler = open_sampler(args.raster)
+    except (KeyError, ValueError) as e:
+        print(f"❌ Cannot read raster: {e}")
+        sys.exit(1)
+    for name, raster in sampler.rasters.items():
+        print(f"🛰️  {name}: {raster.width} x {raster.height} pixels ({raster.dtype}, {raster.crs})")
+
+    output = args.output or f"exposure_locations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    try:
+        count = enrich_csv(args.points, output, sampler, args.batch_size)
+    finally:
+        sampler.close()
+    print(f"✅ Sampled {count} points, written to: {output}")
+    sampler.report()
+
+if __name__ == '__main__':
+    main()
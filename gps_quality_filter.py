@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+"""
+GPS Quality Filter for Decrypted Location Points
+
+Removes (or flags) fixes that would distort every downstream measure:
+- invalid coordinates and the 0,0 "zero island" fix
+- fixes whose reported accuracy radius is above a threshold
+- fixes outside a bounding box, e.g. the Gauteng extent
+- teleport jumps: short runs of fixes (up to 3) reached from the previous
+  fix at a physically impossible speed and left again just as fast. The
+  newest fixes of a batch can't be told apart from a real relocation yet
+  (e.g. the first fixes after a flight): they are dropped, but if the next
+  batch carries on from them, that becomes the participant's position
+
+Points are checked in columnar NumPy batches (per decrypted payload, or per
+block of CSV rows). Each participant's last accepted fix is carried between
+batches, so jumps across batch boundaries are caught too. Rejections are
+counted per participant and reason.
+
+Usage:
+    python gps_quality_filter.py decrypted_locations.csv --max-accuracy 100 --bbox gauteng
+    python gps_quality_filter.py decrypted_locations.csv --max-speed-kmh 250 --flag -o checked.csv \\
+        --report rejections_per_participant.csv
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import sys
+from collections import Counter, defaultdict
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import parse_timestamp
+from join_responses_locations import EARTH_RADIUS_M
+
+# (min_longitude, min_latitude, max_longitude, max_latitude), with a small margin
+BOUNDING_BOXES = {
+    'gauteng': (27.0, -27.0, 29.2, -25.0),
+}
+
+REASONS = ['invalid', 'zero_island', 'accuracy', 'outside_bbox', 'speed']
+
+def parse_bbox(value):
+    """A named box (e.g. 'gauteng') or 'min_lon,min_lat,max_lon,max_lat'"""
+    if value.lower() in BOUNDING_BOXES:
+        return BOUNDING_BOXES[value.lower()]
+    try:
+        box = tuple(float(part) for part in value.split(','))
+    except ValueError:
+        box = ()
+    if len(box) != 4 or box[0] >= box[2] or box[1] >= box[3]:
+        raise argparse.ArgumentTypeError(
+            f"expected {' or '.join(BOUNDING_BOXES)} or min_lon,min_lat,max_lon,max_lat, got {value!r}"
+        )
+    return box
+
+def haversine_m_array(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in metres"""
+    phi1, phi2 = np.radians(lat1), np.radians(lat2)
+    a = np.sin((phi2 - phi1) / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(np.radians(lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+def _column(points, name):
+    values = np.empty(len(points), dtype=float)
+    for i, point in enumerate(points):
+        try:
+            values[i] = float(point.get(name))
+        except (TypeError, ValueError):
+            values[i] = np.nan
+    return values
+
+class GPSQualityFilter:
+    """Pipeline stage that drops (or flags) implausible GPS fixes
+
+    With `flag=True` every point is kept and a `quality_flag` column holds the
+    rejection reason ('' for good fixes). Any check can be switched off by
+    passing None for its threshold.
+    """
+    name = 'quality'
+    # Longest run of fixes treated as a jump away from the real trace
+    MAX_JUMP_POINTS = 3
+    # Jump removal passes per batch
+    MAX_SPEED_PASSES = 20
+
+    def __init__(self, max_accuracy=None, bbox=None, max_speed_kmh=300, flag=False):
+        self.max_accuracy = max_accuracy
+        self.bbox = bbox
+        self.max_speed = max_speed_kmh / 3.6 if max_speed_kmh else None
+        self.flag = flag
+        self.fieldnames = ['quality_flag'] if flag else []
+        # participant -> (epoch, lat, lon) of the last accepted fix
+        self.last_fix = {}
+        # participant -> (epoch, lat, lon) of the newest fix dropped as a jump
+        # at the end of a batch; accepted if the next batch carries on from it
+        self.unconfirmed = {}
+        self.rejections = defaultdict(Counter)
+        self.checked = 0
+
+    def check(self, participants, epochs, latitudes, longitudes, accuracies):
+        """Reason codes for a batch of columns: index into REASONS, or -1 for a good fix"""
+        lat, lon = np.asarray(latitudes, dtype=float), np.asarray(longitudes, dtype=float)
+        reason = np.full(len(lat), -1, dtype=np.int8)
+
+        invalid = ~(np.isfinite(lat) & np.isfinite(lon) & (np.abs(lat) <= 90) & (np.abs(lon) <= 180))
+        reason[invalid] = REASONS.index('invalid')
+        zero = (reason < 0) & (lat == 0) & (lon == 0)
+        reason[zero] = REASONS.index('zero_island')
+        if self.max_accuracy is not None:
+            # Missing accuracy is not held against a fix
+            with np.errstate(invalid='ignore'):
+                inaccurate = (reason < 0) & (np.asarray(accuracies, dtype=float) > self.max_accuracy)
+            reason[inaccurate] = REASONS.index('accuracy')
+        if self.bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = self.bbox
+            outside = (reason < 0) & ~((lon >= min_lon) & (lon <= max_lon) & (lat >= min_lat) & (lat <= max_lat))
+            reason[outside] = REASONS.index('outside_bbox')
+        if self.max_speed is not None:
+            self._check_speed(participants, np.asarray(epochs, dtype=float), lat, lon, reason)
+        return reason
+
+    def _check_speed(self, participants, epochs, lat, lon, reason):
+        candidates = np.flatnonzero((reason < 0) & np.isfinite(epochs))
+        if not len(candidates):
+            return
+        codes, pid = np.unique(np.asarray(participants, dtype=object)[candidates].astype(str), return_inverse=True)
+        order = np.lexsort((epochs[candidates], pid))
+        rows, pid = candidates[order], pid[order]
+
+        # Previous fix from earlier batches, for the first point of each participant
+        first_rows = rows[np.concatenate([[True], pid[1:] != pid[:-1]])]
+        for code, row in zip(codes, first_rows):
+            self._confirm_relocation(code, epochs[row], lat[row], lon[row])
+        known = np.array([code in self.last_fix for code in codes])
+        carried = np.array([self.last_fix.get(code, (np.nan, np.nan, np.nan)) for code in codes], dtype=float).reshape(-1, 3)
+
+        keep = np.ones(len(rows), dtype=bool)
+        unconfirmed = np.zeros(len(rows), dtype=bool)
+        for _ in range(self.MAX_SPEED_PASSES):
+            idx = np.flatnonzero(keep)
+            if not len(idx):
+                break
+            r, p = rows[idx], pid[idx]
+            t, la, lo = epochs[r], lat[r], lon[r]
+            first = np.concatenate([[True], p[1:] != p[:-1]])
+
+            prev_t = np.concatenate([[np.nan], t[:-1]])
+            prev_la = np.concatenate([[np.nan], la[:-1]])
+            prev_lo = np.concatenate([[np.nan], lo[:-1]])
+            prev_t[first], prev_la[first], prev_lo[first] = carried[p[first]].T
+            has_prev = ~first | known[p]
+
+            with np.errstate(invalid='ignore'):
+                step = haversine_m_array(prev_la, prev_lo, la, lo) / np.maximum(np.abs(t - prev_t), 1.0)
+            jump = has_prev & (step > self.max_speed)
+
+            # Split each trace at the impossible jumps; a short run entered by
+            # a jump and left by one (or still the newest fixes) is an excursion
+            starts = np.flatnonzero(jump | first)
+            lengths = np.diff(np.concatenate([starts, [len(jump)]]))
+            newest = np.concatenate([first[starts[1:]], [True]])
+            left = np.concatenate([jump[starts[1:]] & ~first[starts[1:]], [False]])
+            short = jump[starts] & (lengths <= self.MAX_JUMP_POINTS)
+            # Runs whose way out is not known yet (the newest fixes) only count
+            # once no run is left that both starts and ends with a jump
+            excursion = short & left
+            confirmed = excursion.any()
+            if not confirmed:
+                excursion = short & newest
+            if not excursion.any():
+                break
+            # Shortest excursions first: once a spike is gone, the good fixes
+            # around it are no longer cut off by jumps
+            excursion &= lengths == lengths[excursion].min()
+            # Back-to-back excursions (spike, good fix, spike) are resolved
+            # from the oldest, which is anchored on a trusted fix
+            excursion[1:] &= ~(excursion[:-1] & ~first[starts[1:]])
+            dropped = idx[np.repeat(excursion, lengths)]
+            keep[dropped] = False
+            unconfirmed[dropped] = not confirmed
+
+        reason[rows[~keep]] = REASONS.index('speed')
+
+        # Newest fixes dropped without a way back seen yet may be a relocation
+        last = np.concatenate([pid[1:] != pid[:-1], [True]])
+        for code_index, row, pending in zip(pid[last], rows[last], unconfirmed[last]):
+            if pending:
+                self.unconfirmed[codes[code_index]] = (epochs[row], lat[row], lon[row])
+
+        # Remember each participant's newest accepted fix
+        kept_rows, kept_pid = rows[keep], pid[keep]
+        if len(kept_rows):
+            newest = np.concatenate([kept_pid[1:] != kept_pid[:-1], [True]])
+            for code_index, row in zip(kept_pid[newest], kept_rows[newest]):
+                code = codes[code_index]
+                previous = self.last_fix.get(code)
+                if previous is None or epochs[row] >= previous[0]:
+                    self.last_fix[code] = (epochs[row], lat[row], lon[row])
+
+    def _confirm_relocation(self, code, epoch, latitude, longitude):
+        """Move a participant's last fix to the one dropped at the end of the
+        previous batch if this batch's first fix can only be reached from there"""
+        pending = self.unconfirmed.pop(code, None)
+        previous = self.last_fix.get(code)
+        if pending is None or previous is None or pending[0] < previous[0]:
+            return
+        fixes = np.array([previous, pending], dtype=float)
+        speeds = haversine_m_array(fixes[:, 1], fixes[:, 2], latitude, longitude) / \
+            np.maximum(np.abs(epoch - fixes[:, 0]), 1.0)
+        if speeds[0] > self.max_speed and speeds[1] <= self.max_speed:
+            self.last_fix[code] = pending
+
+    def process(self, points):
+        """Check a batch of point dicts; returns the good ones (or all, flagged)"""
+        if not points:
+            return points
+        participants = []
+        for point in points:
+            participant = point.get('participant_uuid')
+            if not participant or participant == 'Unknown':
+                participant = point.get('participant_code') or ''
+            participants.append(participant)
+        epochs = np.array([parse_timestamp(point.get('timestamp')) for point in points], dtype=float)
+        reason = self.check(participants, epochs, _column(points, 'latitude'),
+                            _column(points, 'longitude'), _column(points, 'accuracy'))
+        self.checked += len(points)
+
+        for i in np.flatnonzero(reason >= 0).tolist():
+            self.rejections[participants[i]][REASONS[reason[i]]] += 1
+        if self.flag:
+            for point, code in zip(points, reason.tolist()):
+                point['quality_flag'] = REASONS[code] if code >= 0 else ''
+            return points
+        return [point for point, code in zip(points, reason.tolist()) if code < 0]
+
+    def totals(self):
+        totals = Counter()
+        for counts in self.rejections.values():
+            totals.update(counts)
+        return totals
+
+    def report(self):
+        totals = self.totals()
+        verb = 'flagged' if self.flag else 'dropped'
+        print(f"   Low-quality fixes {verb}: {sum(totals.values())} of {self.checked}"
+              + (f" ({', '.join(f'{reason} {totals[reason]}' for reason in REASONS if totals[reason])})" if totals else ''))
+        worst = sorted(self.rejections.items(), key=lambda item: -sum(item[1].values()))[:5]
+        for participant, counts in worst:
+            print(f"     {participant}: {sum(counts.values())}")
+
+    def write_report(self, path):
+        """Write per-participant rejection counts to CSV"""
+        with open(path, 'w', newline='', encoding='utf-8') as out:
+            writer = csv.writer(out)
+            writer.writerow(['participant'] + REASONS + ['total'])
+            for participant in sorted(self.rejections):
+                counts = self.rejections[participant]
+                writer.writerow([participant] + [counts[reason] for reason in REASONS] + [sum(counts.values())])
+
+    def close(self):
+        pass
+
+def filter_csv(input_csv, output_csv, quality_filter, batch_size=100000):
+    """Filter a decrypted location CSV in batches; returns (rows_read, rows_written)"""
+    read = written = 0
+    with open(input_csv, 'r', encoding='utf-8', newline='') as src, \
+         open(output_csv, 'w', newline='', encoding='utf-8') as out:
+        reader = csv.DictReader(src)
+        fieldnames = list(reader.fieldnames or []) + [n for n in quality_filter.fieldnames if n not in (reader.fieldnames or [])]
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        batch = []
+        for row in reader:
+            batch.append(row)
+            if len(batch) >= batch_size:
+                kept = quality_filter.process(batch)
+                writer.writerows(kept)
+                read, written, batch = read + len(batch), written + len(kept), []
+        kept = quality_filter.process(batch)
+        writer.writerows(kept)
+        read, written = read + len(batch), written + len(kept)
+    return read, written
+
+def main():
+    parser = argparse.ArgumentParser(description="Drop or flag low-quality GPS fixes in decrypted location data")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--max-accuracy', type=float, metavar='METRES',
+                        help="Reject fixes with a reported accuracy radius above this")
+    parser.add_argument('--bbox', type=parse_bbox, metavar='BOX',
+                        help="Reject fixes outside this box: 'gauteng' or min_lon,min_lat,max_lon,max_lat")
+    parser.add_argument('--max-speed-kmh', type=float, default=300,
+                        help="Reject jumps needing more than this speed; 0 to disable (default: 300)")
+    parser.add_argument('--flag', action='store_true', help="Keep every fix and add a quality_flag column instead")
+    parser.add_argument('--report', metavar='CSV', help="Write per-participant rejection counts to this file")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Points checked per batch (default: 100000)")
+    parser.add_argument('-o', '--output', help="Output CSV (default: filtered_locations_<timestamp>.csv)")
+    args = parser.parse_args()
+
+    if not Path(args.points).exists():
+        print(f"❌ File not found: {args.points}")
+        sys.exit(1)
+
+    quality_filter = GPSQualityFilter(args.max_accuracy, args.bbox, args.max_speed_kmh, args.flag)
+    output = args.output or f"filtered_locations_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    read, written = filter_csv(args.points, output, quality_filter, args.batch_size)
+    print(f"✅ Checked {read} points, wrote {written} to: {output}")
+    quality_filter.report()
+    if args.report:
+        quality_filter.write_report(args.report)
+        print(f"📄 Per-participant rejection counts written to: {args.report}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+"""
+Home and Anchor Locations per Participant
+
+Finds each participant's likely home, regular daytime place (work, school)
+and other frequently visited places from their decrypted points:
+
+- home: where they are most often seen at night (22:00-06:00 local time)
+- work: where they are most often seen on weekdays during the day
+  (09:00-17:00), away from home
+- other_1, other_2, ...: the next most visited places at any time, away from
+  the anchors already found
+
+Points are binned into fine Web Mercator cells (zoom 18, about 140 m in
+Gauteng). A place is a cell together with its 8 neighbours, so a home on a
+cell border is not split in two. Places are ranked by the number of distinct
+days (for home: nights) the participant was seen there, then by points, so a
+burst of points on one day cannot outweigh a place visited every day. An
+anchor is only reported when it was seen on at least --min-days days, and home
+and work only when they cover at least --min-share of the participant's
+nights or weekdays with data (the `share` column).
+
+Points are sorted by participant and time out of core (see
+join_responses_locations.external_sort_points); each participant is then
+aggregated with NumPy in one go, so the full study never has to be in memory.
+
+Usage:
+    python infer_anchors.py decrypted_locations.csv --utc-offset 2 -o anchors.csv
+    python infer_anchors.py decrypted_locations.csv --utc-offset 2 --min-days 5 --min-share 0.6 --others 3 -o anchors.csv
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import sys
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from density_tiles import lonlat_to_cells
+from join_responses_locations import external_sort_points
+
+ANCHOR_FIELDNAMES = ['participant_uuid', 'anchor', 'latitude', 'longitude', 'days', 'class_days', 'share', 'points']
+
+# A place is a cell and its 8 neighbours
+NEIGHBOUR_DX, NEIGHBOUR_DY = (offset.ravel() for offset in np.meshgrid([-1, 0, 1], [-1, 0, 1]))
+
+def parse_hours(text):
+    """Parse an hour range such as '22-6' into (start, end); the range may wrap past midnight"""
+    try:
+        start, end = (int(part) for part in text.split('-'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected START-END hours, e.g. 22-6, got {text!r}")
+    if not (0 <= start <= 23 and 0 <= end <= 24) or start == end:
+        raise argparse.ArgumentTypeError(f"invalid hour range {text!r}")
+    return start, end
+
+def _in_hours(hours, start, end):
+    if start < end:
+        return (hours >= start) & (hours < end)
+    return (hours >= start) | (hours < end)
+
+class AnchorFinder:
+    """Infers the anchor places of one participant at a time
+
+    `utc_offset_hours` sets local time for the night and daytime classes;
+    `zoom` the cell size. See the module docstring for the thresholds.
+    """
+
+    def __init__(self, zoom=18, utc_offset_hours=0.0, night_hours=(22, 6), day_hours=(9, 17),
+                 min_days=3, min_share=0.4, others=2):
+        if not 10 <= zoom <= 22:
+            raise ValueError("zoom must be between 10 and 22")
+        self.zoom = zoom
+        self.offset_seconds = int(utc_offset_hours * 3600)
+        self.night_hours = night_hours
+        self.day_hours = day_hours
+        self.min_days = min_days
+        self.min_share = min_share
+        self.others = others
+
+    def find(self, epochs, latitudes, longitudes):
+        """Return the anchors of one participant's points as a list of dicts (without participant_uuid)"""
+        t = np.asarray(epochs, dtype=float)
+        lat = np.asarray(latitudes, dtype=float)
+        lon = np.asarray(longitudes, dtype=float)
+        if not len(t):
+            return []
+        x, y = lonlat_to_cells(lon, lat, self.zoom)
+        local = np.floor(t).astype(np.int64) + self.offset_seconds
+        day = local // 86400
+        hour = (local % 86400) // 3600
+        # 1 January 1970 was a Thursday; 0 is Monday
+        weekday = (day + 3) % 7
+        # A night is counted once, on the date it started
+        night_day = (local - 12 * 3600) // 86400
+
+        night = _in_hours(hour, *self.night_hours)
+        daytime = (weekday < 5) & _in_hours(hour, *self.day_hours)
+        anchors = []
+        taken = []
+        for name, mask, days in [('home', night, night_day), ('work', daytime, day)]:
+            places = self._places(x[mask], y[mask], days[mask], lat[mask], lon[mask])
+            anchor = self._best(places, taken, self.min_share)
+            if anchor:
+                anchors.append(dict(anchor, anchor=name))
+        places = self._places(x, y, day, lat, lon)
+        for rank in range(1, self.others + 1):
+            anchor = self._best(places, taken, 0.0)
+            if not anchor:
+                break
+            anchors.append(dict(anchor, anchor=f'other_{rank}'))
+        return anchors
+
+    def _places(self, x, y, days, lat, lon):
+        """Distinct days, points and mean position of the points around every visited cell"""
+        if not len(x):
+            return None
+        class_days = len(np.unique(days))
+        # Collapse the points to distinct (cell, day) pairs first, then spread
+        # each pair over its neighbourhood; far fewer rows than the points
+        day_span = int(days.max() - days.min()) + 1
+        cells = (x << self.zoom) | y
+        pairs, inverse = np.unique(cells * day_span + (days - days.min()), return_inverse=True)
+        inverse = inverse.ravel()
+        counts = np.bincount(inverse)
+        sum_lat = np.bincount(inverse, weights=lat)
+        sum_lon = np.bincount(inverse, weights=lon)
+        pair_cells, pair_days = pairs // day_span, pairs % day_span
+
+        mask = (1 << self.zoom) - 1
+        spread_x = ((pair_cells >> self.zoom)[:, None] + NEIGHBOUR_DX).ravel()
+        spread_y = ((pair_cells & mask)[:, None] + NEIGHBOUR_DY).ravel()
+        spread_cells = (np.clip(spread_x, 0, mask) << self.zoom) | np.clip(spread_y, 0, mask)
+        spread_days = np.repeat(pair_days, len(NEIGHBOUR_DX))
+        spread_pairs, pair_inverse = np.unique(spread_cells * day_span + spread_days, return_inverse=True)
+        pair_inverse = pair_inverse.ravel()
+        place_cells, cell_inverse = np.unique(spread_pairs // day_span, return_inverse=True)
+        cell_inverse = cell_inverse.ravel()
+        # Every spread pair maps to its place; weights follow the pairs
+        spread_to_place = cell_inverse[pair_inverse]
+        repeat = len(NEIGHBOUR_DX)
+        return {
+            'cells': place_cells,
+            'days': np.bincount(cell_inverse, minlength=len(place_cells)),
+            'points': np.bincount(spread_to_place, weights=np.repeat(counts, repeat)),
+            'sum_lat': np.bincount(spread_to_place, weights=np.repeat(sum_lat, repeat)),
+            'sum_lon': np.bincount(spread_to_place, weights=np.repeat(sum_lon, repeat)),
+            'class_days': class_days,
+        }
+
+    def _best(self, places, taken, min_share):
+        """The top place away from the `taken` cells, if it passes the thresholds; adds it to `taken`"""
+        if places is None:
+            return None
+        cells = places['cells']
+        mask = (1 << self.zoom) - 1
+        px, py = cells >> self.zoom, cells & mask
+        free = np.ones(len(cells), dtype=bool)
+        for cell in taken:
+            # Neighbourhoods within two cells overlap
+            free &= (np.abs(px - (cell >> self.zoom)) > 2) | (np.abs(py - (cell & mask)) > 2)
+        if not free.any():
+            return None
+        candidates = np.flatnonzero(free)
+        best = candidates[np.lexsort((places['points'][candidates], places['days'][candidates]))[-1]]
+        days = int(places['days'][best])
+        share = days / places['class_days']
+        if days < self.min_days or share < min_share:
+            return None
+        taken.append(int(cells[best]))
+        points = places['points'][best]
+        return {
+            'latitude': round(places['sum_lat'][best] / points, 6),
+            'longitude': round(places['sum_lon'][best] / points, 6),
+            'days': days,
+            'class_days': places['class_days'],
+            'share': round(share, 3),
+            'points': int(points),
+        }
+
+def iter_anchors(points, finder):
+    """Yield (participant_uuid, anchors) from (participant_uuid, epoch, lat, lon) tuples in participant order"""
+    for participant, group in itertools.groupby(points, key=lambda point: point[0]):
+        fixes = np.array([point[1:4] for point in group], dtype=float)
+        yield participant, finder.find(fixes[:, 0], fixes[:, 1], fixes[:, 2])
+
+def infer_anchors_csv(points_csv, output_csv, finder, run_size=500000, tmp_dir=None):
+    """Write the anchors of every participant in a decrypted points CSV; returns a dict of counts"""
+    totals = {'participants': 0, 'home': 0, 'work': 0, 'other': 0}
+    with open(output_csv, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=ANCHOR_FIELDNAMES)
+        writer.writeheader()
+        points = external_sort_points(points_csv, run_size=run_size, tmp_dir=tmp_dir)
+        for participant, anchors in iter_anchors(points, finder):
+            totals['participants'] += 1
+            for anchor in anchors:
+                totals[anchor['anchor'].split('_')[0]] += 1
+                writer.writerow(dict(anchor, participant_uuid=participant))
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Infer home, work and other anchor places per participant")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('-o', '--output', required=True, help="Output CSV with one row per anchor")
+    parser.add_argument('--utc-offset', type=float, default=0.0,
+                        help="Hours to add to UTC for local time, e.g. 2 for South Africa (default: 0)")
+    parser.add_argument('--zoom', type=int, default=18, help="Cell zoom level, 10-22 (default: 18, about 140 m)")
+    parser.add_argument('--night-hours', type=parse_hours, default=(22, 6), metavar='START-END',
+                        help="Local hours counted as night, for home (default: 22-6)")
+    parser.add_argument('--day-hours', type=parse_hours, default=(9, 17), metavar='START-END',
+                        help="Local weekday hours counted as daytime, for work (default: 9-17)")
+    parser.add_argument('--min-days', type=int, default=3,
+                        help="Days (nights for home) a place must be seen on to be reported (default: 3)")
+    parser.add_argument('--min-share', type=float, default=0.4,
+                        help="Share of nights/weekdays with data that home/work must cover (default: 0.4)")
+    parser.add_argument('--others', type=int, default=2, help="Other frequently visited places to report (default: 2)")
+    parser.add_argument('--run-size', type=int, default=500000, help="Points sorted in memory per run (default: 500000)")
+    parser.add_argument('--tmp-dir', metavar='DIR', help="Directory for temporary sort runs (default: system temp)")
+    args = parser.parse_args()
+
+    if not Path(args.points).exists():
+        print(f"❌ File not found: {args.points}")
+        sys.exit(1)
+    try:
+        finder = AnchorFinder(args.zoom, args.utc_offset, args.night_hours, args.day_hours,
+                              args.min_days, args.min_share, args.others)
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+    totals = infer_anchors_csv(args.points, args.output, finder, args.run_size, args.tmp_dir)
+    print(f"🏠 {totals['participants']} participants: {totals['home']} with a home, {totals['work']} with a work "
+          f"place, {totals['other']} other places")
+    print(f"✅ Anchors written to: {args.output}")
+
+if __name__ == '__main__':
+    main()
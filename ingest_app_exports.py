@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Bulk Ingestion of Wellbeing Mapper "Export Data" Bundles
+
+Participants can export everything the app holds about them from the side
+drawer ("Export Data", see docs/EXPORT_DATA_FIX_SUMMARY.md). Beta testers and
+withdrawn participants send us these JSON bundles. This tool reads many of
+them in parallel, detects each bundle's format version, and normalises the
+location records into the same point schema that decrypt_location_data.py
+writes, so app-side and Qualtrics-side traces end up in one dataset:
+
+    {"export_info": {"export_format_version": "1.0", "user_id": ..., ...},
+     "location_data": [{"timestamp": ..., "coords": {"latitude": ..., "longitude": ...,
+                        "accuracy": ..., "user_uuid": ...}}, ...], ...}
+
+A bare list of location records (the app's "share locations" format) is
+read too. Bundles are parsed in worker processes; points go through the
+same deduplication (and optional sorting) as the decryption tool. Points
+from bundles have no participant code, and their survey_date is the time
+of the export.
+
+Usage:
+    python ingest_app_exports.py bundles/ -o app_locations.csv
+    python ingest_app_exports.py bundles/ withdrawn/P017.json --key gauteng_private_key.pem \\
+        --csv qualtrics_export.zip -o all_locations.csv --sort
+
+Requirements:
+- Python 3.6+
+- cryptography library (install with: pip install cryptography)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import gzip
+import json
+import os
+import sys
+from collections import Counter, deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from decrypt_location_data import (
+    ExternalSorter,
+    LocationDecryptor,
+    PointDeduplicator,
+    QuarantineSink,
+    key_password,
+    parse_site_key,
+    point_sort_key,
+)
+
+# Major versions of export_info.export_format_version this tool understands
+SUPPORTED_MAJOR_VERSIONS = ['1']
+# Version reported for a bare list of location records
+SHARE_FORMAT = 'share'
+
+def detect_format_version(bundle):
+    """Return a bundle's export_format_version (or SHARE_FORMAT); raises ValueError if unsupported"""
+    if isinstance(bundle, list):
+        return SHARE_FORMAT
+    info = bundle.get('export_info') if isinstance(bundle, dict) else None
+    if not isinstance(info, dict) or info.get('export_format_version') is None:
+        raise ValueError("not a Wellbeing Mapper data export (no export_info.export_format_version)")
+    version = str(info['export_format_version'])
+    if version.split('.')[0] not in SUPPORTED_MAJOR_VERSIONS:
+        raise ValueError(f"unsupported export_format_version {version} "
+                         f"(this tool reads {', '.join(v + '.x' for v in SUPPORTED_MAJOR_VERSIONS)})")
+    return version
+
+def normalise_point(record, participant_uuid, export_date):
+    """Map one exported location record to the decrypted point schema"""
+    # Version 1.0 nests the position under 'coords'; accept flat records too
+    coords = record.get('coords') if isinstance(record.get('coords'), dict) else record
+    return {
+        'participant_code': 'Unknown',
+        'participant_uuid': coords.get('user_uuid') or participant_uuid or 'Unknown',
+        'survey_date': export_date,
+        'timestamp': record.get('timestamp', ''),
+        'latitude': coords.get('latitude', ''),
+        'longitude': coords.get('longitude', ''),
+        'accuracy': coords.get('accuracy', ''),
+        'speed': coords.get('speed', ''),
+        'heading': coords.get('heading', ''),
+        'altitude': coords.get('altitude', ''),
+    }
+
+def normalise_bundle(bundle):
+    """Return (version, info, points) for a parsed bundle; raises ValueError if unsupported"""
+    version = detect_format_version(bundle)
+    if version == SHARE_FORMAT:
+        info, records = {}, bundle
+    else:
+        info, records = bundle['export_info'], bundle.get('location_data') or []
+    if not isinstance(records, list):
+        raise ValueError("location_data is not a list")
+    participant_uuid = info.get('user_id') or ''
+    export_date = info.get('timestamp') or 'Unknown'
+    points = [normalise_point(record, participant_uuid, export_date)
+              for record in records if isinstance(record, dict)]
+    return version, info, points
+
+def load_bundle(path):
+    """Read and normalise one bundle file (.json or .json.gz); never raises
+
+    Returns a dict with the path, version, participant, app mode and points,
+    or with 'error' set if the file could not be used.
+    """
+    result = {'path': str(path), 'version': None, 'participant_uuid': '', 'app_mode': '', 'points': [], 'error': None}
+    try:
+        opener = gzip.open if str(path).lower().endswith('.gz') else open
+        # utf-8-sig: bundles saved from some mail clients start with a BOM
+        with opener(path, 'rt', encoding='utf-8-sig') as f:
+            bundle = json.load(f)
+        version, info, points = normalise_bundle(bundle)
+    except (OSError, ValueError) as e:
+        result['error'] = str(e)
+        return result
+    result.update({
+        'version': version,
+        'participant_uuid': info.get('user_id') or (points[0]['participant_uuid'] if points else ''),
+        'app_mode': info.get('app_mode') or 'Unknown',
+        'points': points,
+    })
+    return result
+
+def find_bundles(inputs):
+    """Expand files and directories (searched recursively) into bundle paths"""
+    paths = []
+    for item in inputs:
+        item = Path(item)
+        if item.is_dir():
+            paths.extend(sorted(p for p in item.rglob('*') if p.name.lower().endswith(('.json', '.json.gz'))))
+        else:
+            paths.append(item)
+    return paths
+
+def iter_bundles(paths, workers=None):
+    """Yield load_bundle results in order, parsing up to `workers` bundles at a time
+
+    Only a few bundles per worker are in flight at once, so memory stays
+    bounded however many bundles there are.
+    """
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(paths) < 2:
+        for path in paths:
+            yield load_bundle(path)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for path in paths:
+            pending.append(executor.submit(load_bundle, path))
+            if len(pending) >= workers * 2:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def ingest_bundles(paths, decryptor, workers=None):
+    """Add the points of every bundle to a LocationDecryptor, through its stages
+
+    Returns a Counter with 'bundles', 'failed', and bundles per format
+    version ('version_<v>') and app mode ('mode_<mode>').
+    """
+    totals = Counter()
+    for result in iter_bundles(paths, workers):
+        if result['error']:
+            totals['failed'] += 1
+            print(f"❌ Skipping {result['path']}: {result['error']}")
+            continue
+        decryptor.decrypted_locations.extend(decryptor.run_stages(result['points']))
+        totals['bundles'] += 1
+        totals[f"version_{result['version']}"] += 1
+        totals[f"mode_{result['app_mode']}"] += 1
+    return totals
+
+def print_bundle_summary(totals, points):
+    print(f"\n✅ Read {totals['bundles']} bundle(s) ({points} points kept), {totals['failed']} failed")
+    for prefix, label in [('version_', 'Format versions'), ('mode_', 'App modes')]:
+        counts = {name[len(prefix):]: n for name, n in totals.items() if name.startswith(prefix)}
+        if counts:
+            print(f"   {label}: " + ", ".join(f"{name} {n}" for name, n in sorted(counts.items())))
+
+def main():
+    parser = argparse.ArgumentParser(description="Load app 'Export Data' bundles into the decrypted point schema")
+    parser.add_argument('bundles', nargs='+', help="Bundle files (.json, .json.gz) or folders of them")
+    parser.add_argument('-o', '--output', help="Output CSV (default: app_locations_<timestamp>.csv); "
+                                               "compressed when it ends in .gz or .zst")
+    parser.add_argument('--csv', help="Also decrypt this Qualtrics export into the same output")
+    parser.add_argument('--key', help="RSA private key file (.pem) for --csv")
+    parser.add_argument('--site-key', action='append', type=parse_site_key, default=[], metavar='SITE=PATH',
+                        help="Private key of one research site for --csv; repeat for mixed-site exports")
+    parser.add_argument('--quarantine', metavar='JSONL',
+                        help="Where to record --csv rows that fail to decrypt (default: quarantine_<timestamp>.jsonl)")
+    parser.add_argument('--workers', type=int, help="Bundles parsed in parallel (default: one per CPU)")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Keep points that appear in several bundles or uploads")
+    parser.add_argument('--sort', action='store_true', help="Write the points ordered by participant and timestamp")
+    parser.add_argument('--tmp-dir', metavar='DIR', help="Directory for temporary sort and deduplication files")
+    args = parser.parse_args()
+    if args.csv and not (args.key or args.site_key):
+        parser.error("--csv requires --key or --site-key")
+
+    paths = find_bundles(args.bundles)
+    missing = [str(path) for path in paths if not path.exists()]
+    if missing:
+        print(f"❌ File not found: {', '.join(missing)}")
+        sys.exit(1)
+    if not paths:
+        print("❌ No .json bundles found.")
+        sys.exit(1)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    stages = [] if args.keep_duplicates else [PointDeduplicator(tmp_dir=args.tmp_dir)]
+    sorter = ExternalSorter(key=point_sort_key, tmp_dir=args.tmp_dir) if args.sort else None
+    quarantine = QuarantineSink(args.quarantine or f"quarantine_{timestamp}.jsonl")
+    decryptor = LocationDecryptor(stages=stages, quarantine=quarantine, decrypted_locations=sorter)
+
+    if args.csv:
+        # Unlock the keys before the (possibly long) bundle pass
+        if args.key and not decryptor.load_private_key(args.key, key_password(args.key)):
+            sys.exit(1)
+        for site, site_key_path in args.site_key:
+            if not decryptor.load_private_key(site_key_path, key_password(site_key_path, site), site=site):
+                sys.exit(1)
+
+    try:
+        print(f"📦 Reading {len(paths)} bundle(s)...")
+        totals = ingest_bundles(paths, decryptor, args.workers)
+        print_bundle_summary(totals, len(decryptor.decrypted_locations))
+        if args.csv:
+            print(f"\n📊 Processing Qualtrics export {args.csv}...")
+            if not decryptor.process_qualtrics_csv(args.csv):
+                sys.exit(1)
+        else:
+            for stage in stages:
+                stage.report()
+
+        output = args.output or f"app_locations_{timestamp}.csv"
+        if not decryptor.save_decrypted_data(output):
+            sys.exit(1)
+        print(f"   Total location points: {len(decryptor.decrypted_locations)}")
+    finally:
+        for stage in stages:
+            stage.close()
+        quarantine.close()
+        if sorter:
+            sorter.close()
+
+if __name__ == '__main__':
+    main()
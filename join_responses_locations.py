@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Temporal Join of Survey Responses to Decrypted Location Windows
+
+Links each biweekly survey response to the participant's location points in the
+look-back window before it (14 days by default) and writes one row of
+activity-space features per response.
+
+Both inputs are put in (participant_uuid, time) order and joined with a single
+merge pass, so the cost is dominated by the sort (O(n log n)) instead of the
+responses x points nested loop. The points are sorted out of core in bounded
+runs, so a full study does not have to fit in memory; only the points of one
+window are held at a time.
+
+Points decrypted with --participant-index (see participant_index.py) can be
+joined through the same index: responses are then matched to points by
+participant_id, found from their ResponseId, which also works for files
+written with --compact-participants.
+
+Usage:
+    python join_responses_locations.py --responses export.csv --points decrypted_locations.csv
+    python join_responses_locations.py --responses export.csv --points decrypted_locations.csv \\
+        --lookback-days 14 -o response_features.csv
+    python join_responses_locations.py --responses export.csv --points compact_locations.csv \\
+        --participant-index index.sqlite
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import math
+import sys
+from collections import deque
+from datetime import datetime
+from pathlib import Path
+
+from decode_survey_responses import iter_response_rows
+from decrypt_location_data import ExternalSorter, format_timestamp, parse_timestamp
+
+EARTH_RADIUS_M = 6371008.8
+
+PARTICIPANT_UUID_COLUMNS = ['participantUUID', 'ParticipantUUID', 'participant_uuid']
+PARTICIPANT_CODE_COLUMNS = ['participantCode', 'ParticipantCode', 'participant_code']
+RECORDED_DATE_COLUMNS = ['RecordedDate', 'recordedDate', 'recorded_date']
+RESPONSE_ID_COLUMNS = ['ResponseId', 'responseId', 'response_id']
+
+FEATURE_FIELDNAMES = [
+    'response_id',
+    'participant_uuid',
+    'recorded_date',
+    'window_start',
+    'window_end',
+    'point_count',
+    'first_point',
+    'last_point',
+    'span_hours',
+    'centroid_latitude',
+    'centroid_longitude',
+    'radius_of_gyration_m',
+    'max_distance_from_centroid_m',
+    'path_length_m',
+]
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in metres"""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+def first_present(row, names, default=''):
+    """Return the first non-empty value among several possible column names"""
+    for name in names:
+        value = row.get(name)
+        if value:
+            return value
+    return default
+
+def _parse_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def external_sort_points(points_csv, run_size=500000, tmp_dir=None, participant_column=None):
+    """Yield (participant_uuid, epoch, lat, lon) from a points CSV in (participant, time) order
+
+    Points are sorted out of core with ExternalSorter: runs of at most
+    `run_size` points are sorted and spilled to temporary files, then k-way
+    merged. Points without a participant, a parseable timestamp or coordinates
+    are skipped.
+    """
+    sorter = ExternalSorter(run_size=run_size, tmp_dir=tmp_dir)
+    try:
+        with open(points_csv, 'r', encoding='utf-8', newline='') as file:
+            for row in csv.DictReader(file):
+                if participant_column:
+                    participant = row.get(participant_column, '')
+                else:
+                    # Files written with --compact-participants only have participant_id
+                    participant = row.get('participant_uuid') or row.get('participant_id', '')
+                epoch = parse_timestamp(row.get('timestamp'))
+                lat = _parse_float(row.get('latitude'))
+                lon = _parse_float(row.get('longitude'))
+                if participant and participant != 'Unknown' and epoch is not None and lat is not None and lon is not None:
+                    sorter.append((participant, epoch, lat, lon))
+        yield from sorter
+    finally:
+        sorter.close()
+
+def load_responses(responses_csv, participant_index=None):
+    """Read (participant_uuid, epoch, response_id, recorded_date) from a Qualtrics export, sorted
+
+    With a ParticipantIndex, responses are keyed by their participant_id (as a
+    string, like in the points CSV) instead of their UUID.
+    """
+    responses = []
+    with open(responses_csv, 'r', encoding='utf-8-sig', newline='') as file:
+        for row in iter_response_rows(file):
+            participant = first_present(row, PARTICIPANT_UUID_COLUMNS)
+            if participant_index is not None:
+                participant_id = participant_index.find(first_present(row, RESPONSE_ID_COLUMNS), participant,
+                                                        first_present(row, PARTICIPANT_CODE_COLUMNS))
+                participant = str(participant_id) if participant_id is not None else ''
+            recorded_date = first_present(row, RECORDED_DATE_COLUMNS)
+            epoch = parse_timestamp(recorded_date)
+            if not participant or epoch is None:
+                continue
+            responses.append((participant, epoch, first_present(row, RESPONSE_ID_COLUMNS), recorded_date))
+    responses.sort()
+    return responses
+
+def window_features(points):
+    """Activity-space features for a list of (epoch, lat, lon) points in time order"""
+    count = len(points)
+    if not count:
+        return {'point_count': 0}
+
+    mean_lat = sum(p[1] for p in points) / count
+    mean_lon = sum(p[2] for p in points) / count
+    distances = [haversine_m(mean_lat, mean_lon, lat, lon) for _, lat, lon in points]
+    path_length = sum(
+        haversine_m(a[1], a[2], b[1], b[2]) for a, b in zip(points, points[1:])
+    )
+
+    return {
+        'point_count': count,
+        'first_point': format_timestamp(points[0][0]),
+        'last_point': format_timestamp(points[-1][0]),
+        'span_hours': round((points[-1][0] - points[0][0]) / 3600.0, 3),
+        'centroid_latitude': round(mean_lat, 6),
+        'centroid_longitude': round(mean_lon, 6),
+        'radius_of_gyration_m': round(math.sqrt(sum(d * d for d in distances) / count), 1),
+        'max_distance_from_centroid_m': round(max(distances), 1),
+        'path_length_m': round(path_length, 1),
+    }
+
+def join_windows(responses, points, lookback_seconds):
+    """Merge-join sorted responses with sorted points
+
+    `responses` is a sorted list of (participant, epoch, response_id, recorded_date)
+    and `points` an iterator of (participant, epoch, lat, lon) in the same order.
+    Yields (response, [(epoch, lat, lon), ...]) with the points in
+    (epoch - lookback, epoch] for every response.
+    """
+    points = iter(points)
+    pending = next(points, None)
+
+    for participant, participant_responses in itertools.groupby(responses, key=lambda r: r[0]):
+        # Skip points of participants without responses
+        while pending is not None and pending[0] < participant:
+            pending = next(points, None)
+
+        window = deque()
+        for response in participant_responses:
+            end = response[1]
+            start = end - lookback_seconds
+            while pending is not None and pending[0] == participant and pending[1] <= end:
+                window.append((pending[1], pending[2], pending[3]))
+                pending = next(points, None)
+            while window and window[0][0] <= start:
+                window.popleft()
+            yield response, list(window)
+
+        # Drop the rest of this participant's points (after their last response)
+        while pending is not None and pending[0] == participant:
+            pending = next(points, None)
+
+def join_responses_to_locations(responses_csv, points_csv, output_csv, lookback_days=14, run_size=500000,
+                                participant_index=None):
+    """Write one row of window features per response; returns the number of responses"""
+    responses = load_responses(responses_csv, participant_index)
+    points = external_sort_points(points_csv, run_size=run_size,
+                                  participant_column='participant_id' if participant_index is not None else None)
+    lookback_seconds = lookback_days * 86400
+
+    count = 0
+    with open(output_csv, 'w', newline='', encoding='utf-8') as out:
+        writer = csv.DictWriter(out, fieldnames=FEATURE_FIELDNAMES)
+        writer.writeheader()
+        for (participant, epoch, response_id, recorded_date), window in join_windows(responses, points, lookback_seconds):
+            if participant_index is not None:
+                participant = participant_index.lookup(participant)[0] or participant
+            row = {
+                'response_id': response_id,
+                'participant_uuid': participant,
+                'recorded_date': recorded_date,
+                'window_start': format_timestamp(epoch - lookback_seconds),
+                'window_end': format_timestamp(epoch),
+            }
+            row.update(window_features(window))
+            writer.writerow(row)
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Join survey responses to the participant's location points in the preceding window")
+    parser.add_argument('--responses', required=True, help="Qualtrics CSV response export")
+    parser.add_argument('--points', required=True, help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--lookback-days', type=float, default=14, help="Window length before each response, in days (default: 14)")
+    parser.add_argument('--run-size', type=int, default=500000, help="Points sorted in memory per run (default: 500000)")
+    parser.add_argument('--participant-index', metavar='STORE',
+                        help="Participant index the points were decrypted with; match responses by participant_id")
+    parser.add_argument('-o', '--output', help="Output CSV (default: response_features_<timestamp>.csv)")
+    args = parser.parse_args()
+
+    for path in filter(None, (args.responses, args.points, args.participant_index)):
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+
+    participant_index = None
+    if args.participant_index:
+        from participant_index import ParticipantIndex
+        participant_index = ParticipantIndex(args.participant_index)
+    output = args.output or f"response_features_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    print(f"🔗 Joining responses to the {args.lookback_days:g} days of locations before each response...")
+    try:
+        count = join_responses_to_locations(args.responses, args.points, output, args.lookback_days, args.run_size,
+                                            participant_index)
+    finally:
+        if participant_index is not None:
+            participant_index.close()
+    print(f"✅ Wrote features for {count} responses to: {output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Columnar Access to Decrypted Location Data from Python
+
+Decrypts a Qualtrics export straight into typed column batches, for notebooks
+and pipelines that would otherwise read back the CSV written by
+decrypt_location_data.py and parse every value again:
+
+    from location_batches import iter_batches
+
+    for batch in iter_batches('qualtrics_export.csv', 'private_key.pem'):
+        batch['latitude']   # float64 NumPy array, NaN where missing
+        batch['timestamp']  # datetime64[ms] (UTC), NaT where unparseable
+
+Pass `arrow=True` to get `pyarrow.RecordBatch`es instead (missing values
+become nulls), e.g. to build a table with `pyarrow.Table.from_batches`.
+`read_points` collects every batch into one table or dict of arrays.
+
+Points go through the same deduplication (and any other stages) as the
+command line tool, and rows that fail to decrypt are skipped with a message.
+
+The module can also convert an export to a columnar file:
+    python location_batches.py --key private_key.pem --csv export.csv -o points.parquet
+    python location_batches.py --key private_key.pem --csv export.csv -o points.npz
+
+Requirements:
+- numpy (install with: pip install numpy)
+- pyarrow, for Arrow batches and .parquet/.arrow output (install with: pip install pyarrow)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import sys
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import (
+    KeyRegistry,
+    LocationDecryptor,
+    POINT_FIELDNAMES,
+    PointDeduplicator,
+    key_password,
+    parse_site_key,
+    parse_timestamp,
+)
+
+TEXT_COLUMNS = ['participant_code', 'participant_uuid', 'survey_date']
+FLOAT_COLUMNS = ['latitude', 'longitude', 'accuracy', 'speed', 'heading', 'altitude']
+
+def _floats(values):
+    """float64 array of JSON numbers or strings, NaN for anything else"""
+    try:
+        return np.array(values, dtype=float)
+    except (TypeError, ValueError):
+        pass
+    array = np.empty(len(values), dtype=float)
+    for i, value in enumerate(values):
+        try:
+            array[i] = float(value)
+        except (TypeError, ValueError):
+            array[i] = np.nan
+    return array
+
+def _timestamps(values):
+    """datetime64[ms] array of the app's timestamps, NaT where unparseable"""
+    seconds = np.array([parse_timestamp(value) for value in values], dtype=float)
+    millis = np.round(seconds * 1000.0)
+    missing = ~np.isfinite(millis)
+    millis[missing] = 0
+    array = millis.astype('int64').astype('datetime64[ms]')
+    array[missing] = np.datetime64('NaT')
+    return array
+
+class ColumnBuilder:
+    """Collects point dicts column by column and emits typed batches"""
+
+    def __init__(self, fieldnames):
+        self.fieldnames = list(fieldnames)
+        self.columns = {name: [] for name in self.fieldnames}
+
+    def __len__(self):
+        return len(self.columns[self.fieldnames[0]])
+
+    def extend(self, points):
+        for name, column in self.columns.items():
+            column.extend(point.get(name, '') for point in points)
+
+    def flush(self):
+        """Return the collected points as a dict of NumPy arrays and start over"""
+        batch = {}
+        for name, values in self.columns.items():
+            if name == 'timestamp':
+                batch[name] = _timestamps(values)
+            elif name in FLOAT_COLUMNS:
+                batch[name] = _floats(values)
+            else:
+                batch[name] = np.array(['' if value is None else str(value) for value in values], dtype=object)
+        self.columns = {name: [] for name in self.fieldnames}
+        return batch
+
+def to_record_batch(batch):
+    """Convert a dict of NumPy arrays (from iter_batches) to a pyarrow.RecordBatch"""
+    import pyarrow as pa
+
+    arrays = []
+    for name, values in batch.items():
+        if name == 'timestamp':
+            arrays.append(pa.array(values, type=pa.timestamp('ms', tz='UTC'), from_pandas=True))
+        elif name in FLOAT_COLUMNS:
+            arrays.append(pa.array(values, type=pa.float64(), from_pandas=True))
+        else:
+            arrays.append(pa.array(values, type=pa.string()))
+    return pa.RecordBatch.from_arrays(arrays, names=list(batch))
+
+def _load_keys(decryptor, key, password):
+    if isinstance(key, dict):
+        sites = key.items()
+    else:
+        sites = [(KeyRegistry.DEFAULT_SITE, key)]
+    for site, site_key in sites:
+        if isinstance(site_key, (str, Path)):
+            site_password = password.get(site) if isinstance(password, dict) else password
+            if not decryptor.load_private_key(site_key, site_password, site=site):
+                raise ValueError(f"Could not load private key: {site_key}")
+        else:
+            # An already unlocked key object
+            decryptor.keys.add(site, site_key)
+            decryptor.private_key = site_key
+
+def iter_batches(export_path, key, password=None, batch_size=100000, arrow=False,
+                 envelope_format='auto', dedupe=True, stages=None):
+    """Decrypt a Qualtrics export into batches of typed columns
+
+    `key` is the path of a private key file, an unlocked key, or a dict of
+    {research_site: key} for mixed-site exports; `password` unlocks an
+    encrypted key (a dict of passwords per site for several keys). Batches
+    hold about `batch_size` points each, as a dict of NumPy arrays, or a
+    pyarrow.RecordBatch when `arrow` is true. Extra `stages` (e.g. a
+    BoundaryTagger) add their columns as strings.
+    """
+    stages = list(stages or [])
+    if dedupe:
+        stages.insert(0, PointDeduplicator())
+    decryptor = LocationDecryptor(stages=stages)
+    try:
+        _load_keys(decryptor, key, password)
+        builder = ColumnBuilder(decryptor.point_fieldnames())
+        for context, envelope in decryptor.iter_envelopes(export_path):
+            points = decryptor.decrypt_points(envelope, context, envelope_format)
+            if points:
+                builder.extend(points)
+            if len(builder) >= batch_size:
+                batch = builder.flush()
+                yield to_record_batch(batch) if arrow else batch
+        if len(builder):
+            batch = builder.flush()
+            yield to_record_batch(batch) if arrow else batch
+    finally:
+        for stage in stages:
+            stage.close()
+
+def read_points(export_path, key, password=None, arrow=False, **kwargs):
+    """Decrypt a whole export into one pyarrow.Table, or one dict of NumPy arrays"""
+    batches = list(iter_batches(export_path, key, password, arrow=arrow, **kwargs))
+    if arrow:
+        import pyarrow as pa
+        if batches:
+            return pa.Table.from_batches(batches)
+        return pa.Table.from_batches([], schema=to_record_batch(ColumnBuilder(POINT_FIELDNAMES).flush()).schema)
+    if not batches:
+        return ColumnBuilder(POINT_FIELDNAMES).flush()
+    return {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+
+def write_columns(batches, output_path):
+    """Write batches (dicts of NumPy arrays) to .parquet, .arrow/.feather or .npz; returns the point count"""
+    suffix = Path(output_path).suffix.lower()
+    if suffix == '.npz':
+        batches = list(batches)
+        if not batches:
+            batches = [ColumnBuilder(POINT_FIELDNAMES).flush()]
+        columns = {name: np.concatenate([batch[name] for batch in batches]) for name in batches[0]}
+        # Text columns as fixed-width unicode, so the file loads without pickle
+        np.savez(output_path, **{
+            name: values.astype(str) if values.dtype == object else values for name, values in columns.items()
+        })
+        return len(columns['timestamp'])
+
+    import pyarrow as pa
+    writer = None
+    count = 0
+    try:
+        for batch in batches:
+            record_batch = to_record_batch(batch)
+            if writer is None:
+                if suffix == '.parquet':
+                    import pyarrow.parquet as pq
+                    writer = pq.ParquetWriter(output_path, record_batch.schema)
+                else:
+                    writer = pa.ipc.new_file(output_path, record_batch.schema)
+            if suffix == '.parquet':
+                writer.write_table(pa.Table.from_batches([record_batch]))
+            else:
+                writer.write_batch(record_batch)
+            count += record_batch.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Decrypt a Qualtrics export into a columnar file")
+    parser.add_argument('--key', help="RSA private key file (.pem)")
+    parser.add_argument('--site-key', action='append', type=parse_site_key, default=[], metavar='SITE=PATH',
+                        help="Private key of one research site; repeat for mixed-site exports")
+    parser.add_argument('--csv', required=True, help="Qualtrics CSV export with encrypted location data")
+    parser.add_argument('-o', '--output', required=True,
+                        help="Output file: .parquet, .arrow/.feather (need pyarrow) or .npz")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Keep points that were resent in overlapping uploads")
+    parser.add_argument('--batch-size', type=int, default=100000, help="Points per batch (default: 100000)")
+    args = parser.parse_args()
+    if not (args.key or args.site_key):
+        parser.error("--key or --site-key is required")
+    if Path(args.output).suffix.lower() not in ('.parquet', '.arrow', '.feather', '.npz'):
+        parser.error("--output must end in .parquet, .arrow, .feather or .npz")
+
+    keys, passwords = {}, {}
+    if args.key:
+        keys[KeyRegistry.DEFAULT_SITE] = args.key
+        passwords[KeyRegistry.DEFAULT_SITE] = key_password(args.key)
+    for site, path in args.site_key:
+        keys[site] = path
+        passwords[site] = key_password(path, site)
+
+    print(f"📊 Decrypting {args.csv}...")
+    try:
+        count = write_columns(
+            iter_batches(args.csv, keys, passwords, batch_size=args.batch_size, dedupe=not args.keep_duplicates),
+            args.output
+        )
+    except ImportError:
+        print("❌ Error: Required 'pyarrow' library not found.")
+        print("Please install it by running: pip install pyarrow")
+        sys.exit(1)
+    except (OSError, ValueError) as e:
+        print(f"❌ Error: {e}")
+        sys.exit(1)
+    print(f"✅ Wrote {count} points to: {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Persistent Participant Index Across Waves and Sites
+
+Gives every participant a small integer ID and remembers which participant
+each survey response (ResponseId) belongs to, across every export decrypted
+with the same index file:
+
+- participants are matched by participantUUID, or by participantCode for
+  responses without a UUID. A code is linked to a UUID the first time both
+  appear together; a code already linked to a different UUID is not reused
+  (codes can repeat between sites)
+- every ResponseId seen is mapped to its participant, so later joins (survey
+  answers, look-back windows) need one lookup instead of string matching
+
+With `--participant-index index.sqlite`, decrypt_location_data.py adds a
+participant_id column to every point; with `--compact-participants` as well,
+the participant_code and participant_uuid columns are left out, which makes
+the output much smaller. The other analysis tools group points by
+participant_id when those columns are missing; `expand` puts them back.
+
+The index is a small SQLite file, loaded into memory when it is opened.
+Several tools can share one index at the same time (e.g. watch_exports.py
+and a backfill run of decrypt_location_data.py): anything not in memory is
+looked up in the file again before it is added, and new entries are
+committed at least once a second, so no writer holds the file for long.
+
+Usage:
+    python decrypt_location_data.py --key key.pem --csv wave3.csv --participant-index index.sqlite --compact-participants
+    python participant_index.py participants index.sqlite -o participants.csv
+    python participant_index.py responses index.sqlite -o responses.csv
+    python participant_index.py expand index.sqlite compact_points.csv -o points.csv
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS participants (
+    participant_id INTEGER PRIMARY KEY,
+    participant_uuid TEXT UNIQUE,
+    participant_code TEXT,
+    first_seen TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS codes (
+    participant_code TEXT PRIMARY KEY,
+    participant_id INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS responses (
+    response_id TEXT PRIMARY KEY,
+    participant_id INTEGER NOT NULL,
+    survey_date TEXT
+) WITHOUT ROWID;
+"""
+
+# Seconds to wait for another process writing to the index before giving up
+BUSY_TIMEOUT = 60
+# Seconds new entries may stay uncommitted (holding the index's write lock)
+COMMIT_INTERVAL = 1.0
+
+PARTICIPANT_FIELDNAMES = ['participant_id', 'participant_uuid', 'participant_code', 'first_seen', 'responses']
+RESPONSE_FIELDNAMES = ['response_id', 'participant_id', 'participant_uuid', 'participant_code', 'survey_date']
+
+def _clean(value):
+    value = (value or '').strip()
+    return value if value and value != 'Unknown' else None
+
+class ParticipantIndex:
+    """Interns participant UUIDs and codes to integer IDs and maps ResponseIds to them
+
+    Lookups are served from dictionaries, falling back to the SQLite file for
+    entries added by other processes since it was opened. New entries are
+    written under the file's write lock, and committed by resolve() once
+    COMMIT_INTERVAL has passed, or by commit() or close().
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(str(path), timeout=BUSY_TIMEOUT)
+        self.connection.executescript(SCHEMA)
+        # participant_id -> [uuid, code]
+        self.participants = {}
+        self.uuids = {}
+        self.codes = {}
+        self.responses = {}
+        for participant_id, uuid, code in self.connection.execute(
+                'SELECT participant_id, participant_uuid, participant_code FROM participants'):
+            self.participants[participant_id] = [uuid, code]
+            if uuid:
+                self.uuids[uuid] = participant_id
+        self.codes.update(self.connection.execute('SELECT participant_code, participant_id FROM codes'))
+        self.responses.update(self.connection.execute('SELECT response_id, participant_id FROM responses'))
+        self.new_participants = 0
+        self.new_responses = 0
+        self._write_started = None
+
+    def _begin(self):
+        """Take the write lock, so what is read from the file next stays current until commit()"""
+        if self.connection.in_transaction:
+            return
+        try:
+            self.connection.execute('BEGIN IMMEDIATE')
+        except sqlite3.OperationalError as e:
+            raise sqlite3.OperationalError(
+                f"Participant index {self.path} is busy: another process has held it for over "
+                f"{BUSY_TIMEOUT}s ({e})") from e
+        self._write_started = time.monotonic()
+
+    def _load_participant(self, participant_id):
+        row = self.connection.execute(
+            'SELECT participant_uuid, participant_code FROM participants WHERE participant_id = ?', (participant_id,)
+        ).fetchone()
+        if row is None:
+            return
+        self.participants[participant_id] = list(row)
+        if row[0]:
+            self.uuids[row[0]] = participant_id
+
+    def _reload(self, uuid, code, participant_id=None):
+        """Re-read a UUID, a code and a participant from the file (other processes may have added them)"""
+        if participant_id is not None:
+            self._load_participant(participant_id)
+        if uuid is not None and uuid not in self.uuids:
+            row = self.connection.execute('SELECT participant_id FROM participants WHERE participant_uuid = ?',
+                                          (uuid,)).fetchone()
+            if row:
+                self._load_participant(row[0])
+        if code is not None and code not in self.codes:
+            row = self.connection.execute('SELECT participant_id FROM codes WHERE participant_code = ?',
+                                          (code,)).fetchone()
+            if row:
+                self.codes[code] = row[0]
+                self._load_participant(row[0])
+
+    def _match(self, uuid, code):
+        participant_id = self.uuids.get(uuid) if uuid else None
+        if participant_id is None and code is not None:
+            linked = self.codes.get(code)
+            # A code seen without a UUID so far belongs to this participant
+            if linked is not None and (uuid is None or self.participants[linked][0] is None):
+                participant_id = linked
+        return participant_id
+
+    def participant_id(self, participant_uuid=None, participant_code=None):
+        """The ID of a participant, added if new; None when neither a UUID nor a code is known"""
+        uuid, code = _clean(participant_uuid), _clean(participant_code)
+        if uuid is None and code is None:
+            return None
+        participant_id = self._match(uuid, code)
+        if participant_id is None or (uuid is not None and self.participants[participant_id][0] is None) \
+                or (code is not None and code not in self.codes):
+            # Something will be written: lock the file and look again, as
+            # another process may have added this participant since
+            self._begin()
+            self._reload(uuid, code, participant_id)
+            participant_id = self._match(uuid, code)
+        if participant_id is None:
+            participant_id = self.connection.execute(
+                'INSERT INTO participants (participant_uuid, participant_code, first_seen) VALUES (?, ?, ?)',
+                (uuid, code, datetime.now().isoformat(timespec='seconds'))
+            ).lastrowid
+            self.participants[participant_id] = [uuid, code]
+            self.new_participants += 1
+
+        known = self.participants[participant_id]
+        if uuid is not None and known[0] is None:
+            known[0] = uuid
+            self.connection.execute('UPDATE participants SET participant_uuid = ? WHERE participant_id = ?',
+                                    (uuid, participant_id))
+        if uuid is not None:
+            self.uuids[uuid] = participant_id
+        if code is not None and code not in self.codes:
+            self.codes[code] = participant_id
+            self.connection.execute('INSERT INTO codes VALUES (?, ?)', (code, participant_id))
+            if known[1] is None:
+                known[1] = code
+                self.connection.execute('UPDATE participants SET participant_code = ? WHERE participant_id = ?',
+                                        (code, participant_id))
+        return participant_id
+
+    def record_response(self, response_id, participant_id, survey_date=None):
+        """Map a ResponseId to a participant (the first mapping is kept)"""
+        if not response_id or participant_id is None or response_id in self.responses:
+            return
+        self._begin()
+        known = self.connection.execute('SELECT participant_id FROM responses WHERE response_id = ?',
+                                        (response_id,)).fetchone()
+        if known:
+            self.responses[response_id] = known[0]
+            return
+        self.responses[response_id] = participant_id
+        self.connection.execute('INSERT INTO responses VALUES (?, ?, ?)', (response_id, participant_id, survey_date))
+        self.new_responses += 1
+
+    def resolve(self, context):
+        """Participant ID of an export row's context (see LocationDecryptor.iter_envelopes); records its ResponseId"""
+        participant_id = self.participant_id(context.get('participant_uuid'), context.get('participant_code'))
+        self.record_response(context.get('response_id'), participant_id, context.get('survey_date'))
+        if self.connection.in_transaction and time.monotonic() - self._write_started >= COMMIT_INTERVAL:
+            self.commit()
+        return participant_id
+
+    def participant_of(self, response_id):
+        """Participant ID of a ResponseId, or None if it hasn't been seen"""
+        if response_id not in self.responses:
+            row = self.connection.execute('SELECT participant_id FROM responses WHERE response_id = ?',
+                                          (response_id,)).fetchone()
+            if row is None:
+                return None
+            self.responses[response_id] = row[0]
+        return self.responses[response_id]
+
+    def find(self, response_id=None, participant_uuid=None, participant_code=None):
+        """Participant ID of a response, by its ResponseId, else its UUID, else its code; None if unknown
+
+        Unlike participant_id(), nothing is added to the index.
+        """
+        participant_id = self.participant_of(response_id) if response_id else None
+        uuid, code = _clean(participant_uuid), _clean(participant_code)
+        if participant_id is None:
+            self._reload(uuid, code)
+        if participant_id is None and uuid is not None:
+            participant_id = self.uuids.get(uuid)
+        if participant_id is None and code is not None and uuid is None:
+            participant_id = self.codes.get(code)
+        return participant_id
+
+    def lookup(self, participant_id):
+        """(participant_uuid, participant_code) of a participant ID"""
+        participant_id = int(participant_id)
+        if participant_id not in self.participants:
+            self._load_participant(participant_id)
+        uuid, code = self.participants.get(participant_id, (None, None))
+        return uuid, code
+
+    def report(self):
+        # Counted in the file, which other processes may have added to
+        participants, = self.connection.execute('SELECT COUNT(*) FROM participants').fetchone()
+        responses, = self.connection.execute('SELECT COUNT(*) FROM responses').fetchone()
+        print(f"   Participant index: {participants} participants ({self.new_participants} new), "
+              f"{responses} responses ({self.new_responses} new)")
+
+    def commit(self):
+        self.connection.commit()
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
+
+def export_participants(index, output):
+    counts = dict(index.connection.execute('SELECT participant_id, COUNT(*) FROM responses GROUP BY participant_id'))
+    rows = index.connection.execute(
+        'SELECT participant_id, participant_uuid, participant_code, first_seen FROM participants ORDER BY participant_id'
+    )
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(PARTICIPANT_FIELDNAMES)
+        count = 0
+        for row in rows:
+            writer.writerow(list(row) + [counts.get(row[0], 0)])
+            count += 1
+    return count
+
+def export_responses(index, output):
+    rows = index.connection.execute(
+        'SELECT r.response_id, r.participant_id, p.participant_uuid, p.participant_code, r.survey_date '
+        'FROM responses r JOIN participants p USING (participant_id) ORDER BY r.participant_id, r.survey_date'
+    )
+    with open(output, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(RESPONSE_FIELDNAMES)
+        count = 0
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+    return count
+
+def expand_points(index, points_csv, output):
+    """Add participant_code and participant_uuid back to a points CSV written with --compact-participants"""
+    count = 0
+    with open(points_csv, 'r', encoding='utf-8', newline='') as source, \
+            open(output, 'w', encoding='utf-8', newline='') as out:
+        reader = csv.DictReader(source)
+        if 'participant_id' not in (reader.fieldnames or []):
+            raise ValueError(f"{points_csv} has no participant_id column")
+        fieldnames = ['participant_code', 'participant_uuid'] + [
+            name for name in reader.fieldnames if name not in ('participant_code', 'participant_uuid')
+        ]
+        writer = csv.DictWriter(out, fieldnames=fieldnames)
+        writer.writeheader()
+        for row in reader:
+            uuid, code = index.lookup(row['participant_id']) if row['participant_id'] else (None, None)
+            row['participant_uuid'] = uuid or 'Unknown'
+            row['participant_code'] = code or 'Unknown'
+            writer.writerow(row)
+            count += 1
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect a participant index, or expand compact point files")
+    # Not add_subparsers(required=True), which needs Python 3.7
+    subparsers = parser.add_subparsers(dest='command')
+    participants_parser = subparsers.add_parser('participants', help="Write every participant with their ID")
+    participants_parser.add_argument('index', help="Participant index file")
+    participants_parser.add_argument('-o', '--output', required=True, help="Output CSV")
+    responses_parser = subparsers.add_parser('responses', help="Write every ResponseId with its participant")
+    responses_parser.add_argument('index', help="Participant index file")
+    responses_parser.add_argument('-o', '--output', required=True, help="Output CSV")
+    expand_parser = subparsers.add_parser('expand', help="Add the participant code and UUID columns back to points")
+    expand_parser.add_argument('index', help="Participant index file")
+    expand_parser.add_argument('points', help="Points CSV written with --compact-participants")
+    expand_parser.add_argument('-o', '--output', required=True, help="Output CSV")
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("choose a command: participants, responses or expand")
+
+    if not Path(args.index).exists():
+        print(f"❌ File not found: {args.index}")
+        sys.exit(1)
+    index = ParticipantIndex(args.index)
+    try:
+        if args.command == 'participants':
+            count = export_participants(index, args.output)
+            print(f"✅ Wrote {count} participants to: {args.output}")
+        elif args.command == 'responses':
+            count = export_responses(index, args.output)
+            print(f"✅ Wrote {count} responses to: {args.output}")
+        else:
+            try:
+                count = expand_points(index, args.points, args.output)
+            except (OSError, ValueError) as e:
+                print(f"❌ Error: {e}")
+                sys.exit(1)
+            print(f"✅ Wrote {count} points with participant codes and UUIDs to: {args.output}")
+    finally:
+        index.close()
+
+if __name__ == '__main__':
+    main()
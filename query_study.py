@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+SQL Query Layer over Decrypted Study Data
+
+Loads the decrypted location points, the typed survey responses and any other
+study tables (e.g. stays and trips) into one SQLite database, indexed on
+participant and time, so questions about the whole study are a single SQL
+query instead of a new script that re-reads every CSV.
+
+Tables:
+- points      decrypted location points, with `epoch` (seconds, UTC) and `day` (YYYY-MM-DD, UTC)
+- responses   typed survey responses (decode_survey_responses.py), with
+              `participant_uuid` and `recorded_epoch`
+- stays, trips and any --table NAME=CSV, imported with inferred column types
+
+Usage:
+    python query_study.py build study.sqlite --points decrypted_locations.csv \\
+        --responses export.csv --qsf Biweekly_Wellbeing_Survey.qsf
+    python query_study.py query study.sqlite \\
+        "SELECT participant_uuid, day, COUNT(*) AS fixes FROM points GROUP BY 1, 2"
+    python query_study.py query study.sqlite --file wave_summary.sql -o wave_summary.csv
+    python query_study.py tables study.sqlite
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import sqlite3
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+from decode_survey_responses import SurveyResponseDecoder
+from decrypt_location_data import POINT_FIELDNAMES, parse_timestamp
+from join_responses_locations import (
+    PARTICIPANT_UUID_COLUMNS,
+    RECORDED_DATE_COLUMNS,
+    haversine_m,
+)
+
+BATCH_SIZE = 50000
+
+POINT_COLUMN_TYPES = {
+    'participant_code': 'TEXT',
+    'participant_uuid': 'TEXT',
+    'survey_date': 'TEXT',
+    'timestamp': 'TEXT',
+    'latitude': 'REAL',
+    'longitude': 'REAL',
+    'accuracy': 'REAL',
+    'speed': 'REAL',
+    'heading': 'REAL',
+    'altitude': 'REAL',
+}
+
+# Columns that are indexed together with participant_uuid, first match wins
+TIME_COLUMNS = ['epoch', 'recorded_epoch', 'start_epoch', 'timestamp', 'start_time', 'start']
+
+def quote(name):
+    """Quote an SQL identifier"""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def to_number(value):
+    """int or float for numeric text, None for empty cells, otherwise the text itself"""
+    if value is None or value == '':
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        pass
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return value
+
+def infer_column_types(rows, fieldnames):
+    """SQLite type per column from sample rows: INTEGER, REAL or TEXT"""
+    types = {}
+    for name in fieldnames:
+        kinds = {type(to_number(row.get(name))) for row in rows} - {type(None)}
+        if kinds == {int}:
+            types[name] = 'INTEGER'
+        elif kinds and kinds <= {int, float}:
+            types[name] = 'REAL'
+        else:
+            types[name] = 'TEXT'
+    return types
+
+def sql_type_of(values):
+    """SQLite type for a column of decoded Python values"""
+    kinds = {type(value) for value in values} - {type(None)}
+    if kinds and kinds <= {bool, int}:
+        return 'INTEGER'
+    if kinds and kinds <= {bool, int, float}:
+        return 'REAL'
+    return 'TEXT'
+
+def utc_day(epoch):
+    return datetime.fromtimestamp(epoch, tz=timezone.utc).strftime('%Y-%m-%d') if epoch is not None else None
+
+def sql_haversine_m(lat1, lon1, lat2, lon2):
+    """haversine_m for SQL: NULL when any coordinate is NULL, like SQLite's own functions"""
+    if lat1 is None or lon1 is None or lat2 is None or lon2 is None:
+        return None
+    return haversine_m(lat1, lon1, lat2, lon2)
+
+class StudyDatabase:
+    """A SQLite database of study tables"""
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        # Distances in queries, e.g. SELECT haversine_m(lat1, lon1, lat2, lon2)
+        try:
+            # Deterministic functions can be used in indexes (Python 3.8+, SQLite 3.8.3+)
+            self.connection.create_function('haversine_m', 4, sql_haversine_m, deterministic=True)
+        except (TypeError, sqlite3.NotSupportedError):
+            self.connection.create_function('haversine_m', 4, sql_haversine_m)
+
+    def close(self):
+        self.connection.close()
+
+    def _create_table(self, table, column_types):
+        self.connection.execute(f"DROP TABLE IF EXISTS {quote(table)}")
+        columns = ', '.join(f"{quote(name)} {sql_type}" for name, sql_type in column_types.items())
+        self.connection.execute(f"CREATE TABLE {quote(table)} ({columns})")
+
+    def _insert(self, table, columns, rows):
+        placeholders = ', '.join('?' for _ in columns)
+        sql = f"INSERT INTO {quote(table)} ({', '.join(quote(c) for c in columns)}) VALUES ({placeholders})"
+        count = 0
+        while True:
+            batch = list(itertools.islice(rows, BATCH_SIZE))
+            if not batch:
+                return count
+            self.connection.executemany(sql, batch)
+            count += len(batch)
+
+    def _index(self, table, columns):
+        """Index participant_uuid and (participant_uuid, time) where the columns exist"""
+        if 'participant_uuid' not in columns:
+            return
+        self.connection.execute(
+            f"CREATE INDEX {quote(f'idx_{table}_participant')} ON {quote(table)} (participant_uuid)"
+        )
+        time_column = next((c for c in TIME_COLUMNS if c in columns), None)
+        if time_column:
+            self.connection.execute(
+                f"CREATE INDEX {quote(f'idx_{table}_participant_time')} "
+                f"ON {quote(table)} (participant_uuid, {quote(time_column)})"
+            )
+            self.connection.execute(
+                f"CREATE INDEX {quote(f'idx_{table}_time')} ON {quote(table)} ({quote(time_column)})"
+            )
+
+    def _finish_load(self, table, columns):
+        self._index(table, columns)
+        self.connection.commit()
+
+    def load_points(self, points_csv, table='points'):
+        """Load a decrypted location CSV; returns the number of points"""
+        with open(points_csv, 'r', encoding='utf-8', newline='') as file:
+            reader = csv.DictReader(file)
+            extra = [name for name in (reader.fieldnames or []) if name not in POINT_COLUMN_TYPES]
+            column_types = dict(POINT_COLUMN_TYPES)
+            column_types.update({name: 'TEXT' for name in extra})
+            column_types.update({'epoch': 'REAL', 'day': 'TEXT'})
+            self._create_table(table, column_types)
+
+            real_columns = [name for name, sql_type in POINT_COLUMN_TYPES.items() if sql_type == 'REAL']
+            text_columns = [name for name in POINT_FIELDNAMES if name not in real_columns] + extra
+
+            def rows():
+                for row in reader:
+                    epoch = parse_timestamp(row.get('timestamp'))
+                    yield (
+                        [row.get(name) or None for name in text_columns]
+                        + [to_number(row.get(name)) for name in real_columns]
+                        + [epoch, utc_day(epoch)]
+                    )
+
+            columns = text_columns + real_columns + ['epoch', 'day']
+            count = self._insert(table, columns, rows())
+        self.connection.execute(f"CREATE INDEX {quote(f'idx_{table}_day')} ON {quote(table)} (day)")
+        self._finish_load(table, columns)
+        return count
+
+    def load_responses(self, export_csv, qsf_path, table='responses'):
+        """Load a Qualtrics export decoded with the survey QSF; returns the number of responses"""
+        decoder = SurveyResponseDecoder(qsf_path)
+        count = 0
+        columns = None
+        for batch in decoder.iter_batches(export_csv, BATCH_SIZE):
+            if columns is None:
+                column_types = {name: sql_type_of(values) for name, values in batch.items()}
+                # Normalised keys for joining with the points
+                if 'participant_uuid' not in column_types:
+                    column_types['participant_uuid'] = 'TEXT'
+                column_types['recorded_epoch'] = 'REAL'
+                self._create_table(table, column_types)
+                columns = list(column_types)
+            size = len(next(iter(batch.values()), []))
+            uuid_values = batch.get('participant_uuid') or next(
+                (batch[name] for name in PARTICIPANT_UUID_COLUMNS if name in batch), [None] * size
+            )
+            date_values = next((batch[name] for name in RECORDED_DATE_COLUMNS if name in batch), [None] * size)
+            batch['participant_uuid'] = uuid_values
+            batch['recorded_epoch'] = [parse_timestamp(value) for value in date_values]
+            count += self._insert(table, columns, zip(*(batch[name] for name in columns)))
+        if columns is not None:
+            self._finish_load(table, columns)
+        return count
+
+    def load_csv(self, table, csv_path, sample_size=1000):
+        """Load any CSV (e.g. stays or trips) with column types inferred from the first rows"""
+        with open(csv_path, 'r', encoding='utf-8-sig', newline='') as file:
+            reader = csv.DictReader(file)
+            fieldnames = list(reader.fieldnames or [])
+            sample = list(itertools.islice(reader, sample_size))
+            column_types = infer_column_types(sample, fieldnames)
+            self._create_table(table, column_types)
+
+            def rows():
+                for row in itertools.chain(sample, reader):
+                    yield [
+                        to_number(row.get(name)) if column_types[name] != 'TEXT' else (row.get(name) or None)
+                        for name in fieldnames
+                    ]
+
+            count = self._insert(table, fieldnames, rows())
+        self._finish_load(table, fieldnames)
+        return count
+
+    def tables(self):
+        """[(table, row_count)] for every table"""
+        names = [row[0] for row in self.connection.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+        )]
+        return [(name, self.connection.execute(f"SELECT COUNT(*) FROM {quote(name)}").fetchone()[0]) for name in names]
+
+    def query(self, sql, parameters=()):
+        """Run a query; returns (column_names, row_iterator)"""
+        cursor = self.connection.execute(sql, parameters)
+        columns = [description[0] for description in cursor.description or []]
+        return columns, cursor
+
+def print_rows(columns, rows, limit):
+    """Print query results as an aligned text table"""
+    shown = list(itertools.islice(rows, limit + 1))
+    more = len(shown) > limit
+    shown = [['' if value is None else str(value) for value in row] for row in shown[:limit]]
+    widths = [max([len(column)] + [len(row[i]) for row in shown]) for i, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    print('  '.join('-' * width for width in widths))
+    for row in shown:
+        print('  '.join(value.ljust(width) for value, width in zip(row, widths)))
+    if more:
+        print(f"... (first {limit} rows shown; use -o to write all rows to CSV)")
+
+def parse_table(value):
+    """argparse type for --table NAME=CSV"""
+    name, sep, path = value.partition('=')
+    if not sep or not name or not path:
+        raise argparse.ArgumentTypeError(f"expected NAME=CSV, got {value!r}")
+    return name, path
+
+def build(args):
+    sources = [path for path in (args.points, args.responses, args.qsf, args.stays, args.trips) if path]
+    sources += [path for _, path in args.table]
+    for path in sources:
+        if not Path(path).exists():
+            print(f"❌ File not found: {path}")
+            sys.exit(1)
+    if bool(args.responses) != bool(args.qsf):
+        print("❌ --responses and --qsf must be given together")
+        sys.exit(1)
+
+    database = StudyDatabase(args.database)
+    try:
+        database.connection.execute('PRAGMA journal_mode=OFF')
+        database.connection.execute('PRAGMA synchronous=OFF')
+        if args.points:
+            print(f"📍 Loaded {database.load_points(args.points)} points from {args.points}")
+        if args.responses:
+            print(f"📋 Loaded {database.load_responses(args.responses, args.qsf)} responses from {args.responses}")
+        tables = [('stays', args.stays), ('trips', args.trips)] + list(args.table)
+        for name, path in tables:
+            if path:
+                print(f"📄 Loaded {database.load_csv(name, path)} rows into {name} from {path}")
+        database.connection.execute('ANALYZE')
+        database.connection.commit()
+    finally:
+        database.close()
+    print(f"✅ Study database ready: {args.database}")
+
+def query(args):
+    if not Path(args.database).exists():
+        print(f"❌ Database not found: {args.database} (create it with the build command)")
+        sys.exit(1)
+    if args.file:
+        sql = Path(args.file).read_text(encoding='utf-8')
+    elif args.sql:
+        sql = args.sql
+    else:
+        sql = sys.stdin.read()
+
+    database = StudyDatabase(args.database)
+    try:
+        try:
+            columns, rows = database.query(sql)
+        except sqlite3.Error as e:
+            print(f"❌ Query failed: {e}")
+            sys.exit(1)
+        if args.output:
+            with open(args.output, 'w', newline='', encoding='utf-8') as out:
+                writer = csv.writer(out)
+                writer.writerow(columns)
+                writer.writerows(rows)
+            print(f"✅ Results written to: {args.output}")
+        elif columns:
+            print_rows(columns, rows, args.limit)
+    finally:
+        database.close()
+
+def tables(args):
+    database = StudyDatabase(args.database)
+    try:
+        for name, count in database.tables():
+            columns = [row[1] for row in database.connection.execute(f"PRAGMA table_info({quote(name)})")]
+            print(f"{name} ({count} rows): {', '.join(columns)}")
+    finally:
+        database.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Query decrypted study data with SQL")
+    # Not add_subparsers(required=True), which needs Python 3.7
+    commands = parser.add_subparsers(dest='command')
+
+    build_parser = commands.add_parser('build', help="Create or refresh the study database")
+    build_parser.add_argument('database', help="SQLite database file (e.g. study.sqlite)")
+    build_parser.add_argument('--points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    build_parser.add_argument('--responses', help="Qualtrics CSV response export (needs --qsf)")
+    build_parser.add_argument('--qsf', help="QSF file of the survey, used to type the responses")
+    build_parser.add_argument('--stays', help="CSV of stays to load as the stays table")
+    build_parser.add_argument('--trips', help="CSV of trips to load as the trips table")
+    build_parser.add_argument('--table', action='append', type=parse_table, default=[], metavar='NAME=CSV',
+                              help="Load any other CSV as a table; can be repeated")
+    build_parser.set_defaults(func=build)
+
+    query_parser = commands.add_parser('query', help="Run an SQL query")
+    query_parser.add_argument('database', help="SQLite database file")
+    query_parser.add_argument('sql', nargs='?', help="SQL to run (default: read from --file or standard input)")
+    query_parser.add_argument('--file', help="Read the SQL from a file")
+    query_parser.add_argument('-o', '--output', help="Write all result rows to a CSV file")
+    query_parser.add_argument('--limit', type=int, default=50, help="Rows printed to the terminal (default: 50)")
+    query_parser.set_defaults(func=query)
+
+    tables_parser = commands.add_parser('tables', help="List the tables and their columns")
+    tables_parser.add_argument('database', help="SQLite database file")
+    tables_parser.set_defaults(func=tables)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error("choose a command: build, query or tables")
+    args.func(args)
+
+if __name__ == '__main__':
+    main()
@@ -9,19 +9,27 @@ from cryptography.hazmat.primitives import serialization
 from cryptography.hazmat.primitives.asymmetric import padding
 from cryptography.hazmat.backends import default_backend
 
-def decrypt_location_data(encrypted_data_json, private_key_path, password="wellbeing123"):
+def unlock_private_key(pem_bytes, passwords):
     """
-    Decrypt location data using the format from the Flutter app
+    Try each candidate password on the PEM bytes and return the first key that unlocks
     """
-    try:
-        # Load private key
-        with open(private_key_path, 'rb') as key_file:
-            private_key = serialization.load_pem_private_key(
-                key_file.read(),
+    for password in passwords:
+        print(f"\n🔑 Trying password: {'(empty)' if not password else '***'}")
+        try:
+            return serialization.load_pem_private_key(
+                pem_bytes,
                 password=password.encode('utf-8') if password else None,
                 backend=default_backend()
             )
-        
+        except (TypeError, ValueError) as e:
+            print(f"❌ Failed with this password: {e}")
+    return None
+
+def decrypt_location_data(encrypted_data_json, private_key):
+    """
+    Decrypt location data using the format from the Flutter app
+    """
+    try:
         # Parse the encrypted data
         encrypted_data = json.loads(encrypted_data_json)
         
@@ -64,26 +72,17 @@ encrypted_data_string = '''{"encryptedData":"GEYJCQQJHQMEAikPGxFTSCgPVxoWDBAODhg
 if __name__ == "__main__":
     print("🔍 Testing location data decryption...")
     
-    # Try common passwords
+    # Try common passwords; the key file is read once and the unlocked key reused
     passwords = ["wellbeing123", "gauteng2025", "research123", "mapper2025", "", None]
+    with open("private_key.pem", 'rb') as key_file:
+        pem_bytes = key_file.read()
     
-    for password in passwords:
-        print(f"\n🔑 Trying password: {'(empty)' if not password else '***'}")
-        try:
-            result = decrypt_location_data(
-                encrypted_data_string,
-                "private_key.pem",
-                password
-            )
-            
-            if result:
-                print("✅ Decryption successful!")
-                print(json.dumps(result, indent=2))
-                break
-                
-        except Exception as e:
-            print(f"❌ Failed with this password: {e}")
-            continue
-    else:
+    private_key = unlock_private_key(pem_bytes, passwords)
+    if private_key is None:
         print("\n❌ Could not decrypt with any of the tried passwords")
         print("The private key may require a different password")
+    else:
+        result = decrypt_location_data(encrypted_data_string, private_key)
+        if result:
+            print("✅ Decryption successful!")
+            print(json.dumps(result, indent=2))
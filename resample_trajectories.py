@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""
+Fixed-Interval Resampling of Participant Trajectories
+
+Exposure and time-use analyses need each participant's position on a regular
+time grid (e.g. every 5 minutes), while the app records points irregularly
+and in bursts. This tool puts every participant's trace on a grid aligned to
+the UTC clock (:00, :05, :10, ... for 5 minutes), from their first to their
+last fix:
+
+- linear (default): the position between the fixes before and after each
+  grid time, linearly interpolated, when those fixes are at most `max_gap`
+  apart
+- previous: the last fix before each grid time (carried forward) when it is
+  at most `max_gap` old
+
+Grid times that cannot be filled are kept and marked as gaps (gap = 1, empty
+coordinates), so missing data is explicit rather than silently dropped. Each
+row also records fix_age_s, the seconds since the last real fix.
+
+Points are sorted by participant and time out of core (see
+join_responses_locations.external_sort_points) and resampled one participant
+at a time with NumPy, so the full study never has to be in memory. The
+output is columnar: CSV, Parquet (needs pyarrow) or a compact .npz with one
+array per column.
+
+Usage:
+    python resample_trajectories.py decrypted_locations.csv -o resampled.csv
+    python resample_trajectories.py decrypted_locations.csv --interval 60 --max-gap 600 -o resampled.parquet
+    python resample_trajectories.py decrypted_locations.csv --method previous -o resampled.npz
+
+Requirements:
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import itertools
+import sys
+from pathlib import Path
+
+try:
+    import numpy as np
+except ImportError:
+    print("❌ Error: Required 'numpy' library not found.")
+    print("Please install it by running: pip install numpy")
+    sys.exit(1)
+
+from decrypt_location_data import format_timestamp
+from join_responses_locations import external_sort_points
+
+METHODS = ['linear', 'previous']
+COLUMNS = ['participant_uuid', 'epoch', 'latitude', 'longitude', 'gap', 'fix_age_s']
+
+def resample_track(epochs, latitudes, longitudes, interval=300, max_gap=900, method='linear'):
+    """Resample one participant's time-ordered fixes onto a clock-aligned grid
+
+    Returns a dict of arrays: epoch (int64 grid times), latitude and longitude
+    (NaN in gaps), gap (bool) and fix_age_s (seconds since the last fix).
+    """
+    t = np.asarray(epochs, dtype=float)
+    lat = np.asarray(latitudes, dtype=float)
+    lon = np.asarray(longitudes, dtype=float)
+    if not len(t):
+        return _empty_track()
+    first = int(np.ceil(t[0] / interval)) * interval
+    last = int(np.floor(t[-1] / interval)) * interval
+    if last < first:
+        return _empty_track()
+    grid = np.arange(first, last + 1, interval, dtype=np.int64)
+
+    # Fix at or before each grid time, and the one after it
+    before = np.searchsorted(t, grid, side='right') - 1
+    after = np.minimum(before + 1, len(t) - 1)
+    age = grid - t[before]
+    if method == 'linear':
+        span = t[after] - t[before]
+        exact = age == 0
+        filled = exact | ((after > before) & (span <= max_gap))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            weight = np.where(span > 0, age / span, 0.0)
+        out_lat = lat[before] + weight * (lat[after] - lat[before])
+        out_lon = lon[before] + weight * (lon[after] - lon[before])
+        # An exact hit needs no neighbour (it may be the last fix)
+        out_lat[exact], out_lon[exact] = lat[before][exact], lon[before][exact]
+    elif method == 'previous':
+        filled = age <= max_gap
+        out_lat, out_lon = lat[before].copy(), lon[before].copy()
+    else:
+        raise ValueError(f"Unknown resampling method {method!r} (use {' or '.join(METHODS)})")
+    out_lat[~filled] = np.nan
+    out_lon[~filled] = np.nan
+    return {'epoch': grid, 'latitude': out_lat, 'longitude': out_lon, 'gap': ~filled, 'fix_age_s': age}
+
+def _empty_track():
+    return {'epoch': np.empty(0, dtype=np.int64), 'latitude': np.empty(0), 'longitude': np.empty(0),
+            'gap': np.empty(0, dtype=bool), 'fix_age_s': np.empty(0)}
+
+def iter_resampled(points, interval=300, max_gap=900, method='linear'):
+    """Yield (participant_uuid, track) from (participant_uuid, epoch, lat, lon) tuples in participant and time order"""
+    for participant, group in itertools.groupby(points, key=lambda point: point[0]):
+        fixes = np.array([point[1:4] for point in group], dtype=float)
+        yield participant, resample_track(fixes[:, 0], fixes[:, 1], fixes[:, 2], interval, max_gap, method)
+
+class CsvTrackWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w', newline='', encoding='utf-8')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(['participant_uuid', 'epoch', 'time_utc', 'latitude', 'longitude', 'gap', 'fix_age_s'])
+
+    def write(self, participant, track):
+        rows = zip(track['epoch'].tolist(), track['latitude'].tolist(), track['longitude'].tolist(),
+                   track['gap'].tolist(), track['fix_age_s'].tolist())
+        self.writer.writerows(
+            (participant, epoch, format_timestamp(epoch), '' if gap else round(lat, 7), '' if gap else round(lon, 7),
+             int(gap), round(age, 1))
+            for epoch, lat, lon, gap, age in rows
+        )
+
+    def close(self):
+        self.file.close()
+
+class ParquetTrackWriter:
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ('participant_uuid', pa.string()), ('epoch', pa.int64()), ('latitude', pa.float64()),
+            ('longitude', pa.float64()), ('gap', pa.bool_()), ('fix_age_s', pa.float64()),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, participant, track):
+        pa = self.pa
+        arrays = [pa.array([participant] * len(track['epoch']), pa.string())]
+        arrays += [pa.array(track[name], type, from_pandas=True) for name, type in zip(COLUMNS[1:], self.schema.types[1:])]
+        self.writer.write_table(pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self):
+        self.writer.close()
+
+class NpzTrackWriter:
+    """Saves one array per column, participants as integer codes into a names array
+
+    Unlike the CSV and Parquet writers this keeps the grids in memory until
+    close(); use Parquet for very long studies at short intervals.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.participants = []
+        self.tracks = []
+
+    def write(self, participant, track):
+        track = dict(track, participant=np.full(len(track['epoch']), len(self.participants), dtype=np.uint32))
+        self.participants.append(participant)
+        self.tracks.append(track)
+
+    def close(self):
+        tracks = self.tracks or [dict(_empty_track(), participant=np.empty(0, dtype=np.uint32))]
+        columns = {name: np.concatenate([track[name] for track in tracks]) for name in tracks[0]}
+        columns['fix_age_s'] = columns['fix_age_s'].astype(np.float32)
+        np.savez_compressed(self.path, participants=np.array(self.participants, dtype=str), **columns)
+
+def open_track_writer(path):
+    """Writer for .csv, .parquet or .npz output, chosen by the file suffix"""
+    suffix = Path(path).suffix.lower()
+    if suffix == '.parquet':
+        return ParquetTrackWriter(path)
+    if suffix == '.npz':
+        return NpzTrackWriter(path)
+    return CsvTrackWriter(path)
+
+def resample_csv(points_csv, output, interval=300, max_gap=900, method='linear', run_size=500000, tmp_dir=None):
+    """Resample every participant in a decrypted points CSV; returns (participants, grid rows, gap rows)"""
+    writer = open_track_writer(output)
+    participants = rows = gaps = 0
+    try:
+        points = external_sort_points(points_csv, run_size=run_size, tmp_dir=tmp_dir)
+        for participant, track in iter_resampled(points, interval, max_gap, method):
+            writer.write(participant, track)
+            participants += 1
+            rows += len(track['epoch'])
+            gaps += int(np.count_nonzero(track['gap']))
+    finally:
+        writer.close()
+    return participants, rows, gaps
+
+def main():
+    parser = argparse.ArgumentParser(description="Resample decrypted location traces onto a fixed time grid")
+    parser.add_argument('points', help="Decrypted location CSV (from decrypt_location_data.py)")
+    parser.add_argument('--interval', type=int, default=300, help="Grid spacing in seconds (default: 300)")
+    parser.add_argument('--max-gap', type=float, default=900,
+                        help="Longest stretch without fixes that is bridged, in seconds (default: 900)")
+    parser.add_argument('--method', choices=METHODS, default='linear',
+                        help="Interpolate between fixes, or carry the previous fix forward (default: linear)")
+    parser.add_argument('--run-size', type=int, default=500000, help="Points sorted in memory per run (default: 500000)")
+    parser.add_argument('--tmp-dir', metavar='DIR', help="Directory for temporary sort runs (default: system temp)")
+    parser.add_argument('-o', '--output', required=True, help="Output file: .csv, .parquet (needs pyarrow) or .npz")
+    args = parser.parse_args()
+    if args.interval <= 0:
+        parser.error("--interval must be positive")
+
+    if not Path(args.points).exists():
+        print(f"❌ File not found: {args.points}")
+        sys.exit(1)
+    try:
+        participants, rows, gaps = resample_csv(args.points, args.output, args.interval, args.max_gap,
+                                                args.method, args.run_size, args.tmp_dir)
+    except ImportError:
+        print("❌ Error: Required 'pyarrow' library not found.")
+        print("Please install it by running: pip install pyarrow")
+        sys.exit(1)
+    print(f"✅ Resampled {participants} participants to {rows} grid times every {args.interval}s "
+          f"({gaps} marked as gaps), written to: {args.output}")
+
+if __name__ == '__main__':
+    main()
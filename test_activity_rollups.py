@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the Incremental Activity Rollups
+
+Checks that RollupStore (activity_rollups.py) gives the same daily and
+hourly rollups however the points reach it: in one go, as overlapping
+exports applied oldest first or newest first, or re-applied. Late points
+must be merged into the hours they fall in, not dropped, while the store
+keeps only the fixes of its merge window.
+
+Usage:
+    python -m pytest test_activity_rollups.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import random
+import sqlite3
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from activity_rollups import RollupStore  # noqa: E402
+from join_responses_locations import haversine_m  # noqa: E402
+
+START = datetime(2025, 8, 1, tzinfo=timezone.utc)
+
+def make_points(participant, days, seed):
+    """A participant's points every few minutes over `days` days, as decrypted CSV rows"""
+    rng = random.Random(seed)
+    points = []
+    t = START
+    end = t + timedelta(days=days)
+    lat, lon = -26.2 + rng.random() * 0.1, 28.0 + rng.random() * 0.1
+    while t < end:
+        lat += rng.uniform(-0.002, 0.002)
+        lon += rng.uniform(-0.002, 0.002)
+        points.append({
+            'participant_uuid': participant,
+            'timestamp': t.strftime('%Y-%m-%dT%H:%M:%S'),
+            'latitude': f'{lat:.6f}',
+            'longitude': f'{lon:.6f}',
+        })
+        t += timedelta(minutes=rng.choice([2, 3, 7, 45]))
+    return points
+
+def rollups(store):
+    return list(store.rows()), list(store.rows(hourly=True))
+
+def assert_same_rollups(actual, expected):
+    # The radius of gyration uses a projection around the participant's first
+    # rolled-up fix, which depends on the order exports arrive in
+    for actual_rows, expected_rows in zip(actual, expected):
+        assert len(actual_rows) == len(expected_rows)
+        for a, e in zip(actual_rows, expected_rows):
+            assert {k: v for k, v in a.items() if k != 'radius_of_gyration_m'} == \
+                   {k: v for k, v in e.items() if k != 'radius_of_gyration_m'}
+            assert a['radius_of_gyration_m'] == pytest.approx(e['radius_of_gyration_m'], abs=0.2)
+
+@pytest.fixture
+def exports():
+    # Two waves of two participants' traces that overlap by four days
+    older, newer = [], []
+    for seed, participant in enumerate(['p1', 'p2']):
+        trace = make_points(participant, 14, seed)
+        older += [point for point in trace if point['timestamp'] < '2025-08-09']
+        newer += [point for point in trace if point['timestamp'] >= '2025-08-05']
+    return older, newer
+
+def test_exports_in_reverse_order_match_one_pass(tmp_path, exports):
+    older, newer = exports
+    reference = RollupStore(str(tmp_path / 'reference.sqlite'))
+    totals = reference.update(older + newer)
+
+    reversed_store = RollupStore(str(tmp_path / 'reversed.sqlite'))
+    first = reversed_store.update(newer)
+    second = reversed_store.update(older)
+    # The older wave adds its earlier points instead of being skipped
+    assert second['applied'] > 0
+    assert first['applied'] + second['applied'] == totals['applied']
+    assert_same_rollups(rollups(reversed_store), rollups(reference))
+
+    in_order = RollupStore(str(tmp_path / 'in_order.sqlite'))
+    in_order.update(older)
+    in_order.update(newer)
+    assert_same_rollups(rollups(in_order), rollups(reference))
+
+def test_reapplying_an_export_changes_nothing(tmp_path, exports):
+    older, newer = exports
+    store = RollupStore(str(tmp_path / 'rollups.sqlite'))
+    store.update(older)
+    store.update(newer)
+    before = rollups(store)
+    totals = store.update(newer + older)
+    assert totals['applied'] == 0
+    assert totals['skipped'] == len(newer) + len(older)
+    assert rollups(store) == before
+
+def test_late_point_splits_a_step(tmp_path):
+    # A late fix between two stored fixes in different hours: the distance
+    # into the later hour becomes the step from the late fix
+    a, b, c = (-26.20, 28.00), (-26.21, 28.01), (-26.22, 28.00)
+    point = lambda time, lat_lon: {'participant_uuid': 'p', 'timestamp': time,
+                                   'latitude': lat_lon[0], 'longitude': lat_lon[1]}
+    store = RollupStore(str(tmp_path / 'rollups.sqlite'))
+    store.update([point('2025-08-01T10:10:00', a), point('2025-08-01T12:10:00', c)])
+    store.update([point('2025-08-01T11:10:00', b)])
+    hours = {row['hour_start']: row for row in store.rows(hourly=True)}
+    assert [row['fixes'] for row in hours.values()] == [1, 1, 1]
+    assert hours['2025-08-01T11:00']['distance_m'] == round(haversine_m(*a, *b), 1)
+    assert hours['2025-08-01T12:00']['distance_m'] == round(haversine_m(*b, *c), 1)
+    day = list(store.rows())[0]
+    assert day['distance_m'] == round(haversine_m(*a, *b) + haversine_m(*b, *c), 1)
+    assert day['first_fix'].startswith('2025-08-01T10:10') and day['last_fix'].startswith('2025-08-01T12:10')
+
+def test_fixes_are_kept_for_the_merge_window_only(tmp_path):
+    trace = make_points('p', 60, 7)
+    store = RollupStore(str(tmp_path / 'rollups.sqlite'), merge_window_days=10)
+    reference = RollupStore(str(tmp_path / 'reference.sqlite'), merge_window_days=10)
+    reference.update(trace)
+    for day in range(0, 60, 5):
+        start, end = (START + timedelta(days=d) for d in (day, day + 5))
+        store.update([p for p in trace if start.strftime('%Y-%m-%d') <= p['timestamp'] < end.strftime('%Y-%m-%d')])
+    kept = store.connection.execute("SELECT COUNT(*) FROM fixes").fetchone()[0]
+    window = [p for p in trace if p['timestamp'] >= (START + timedelta(days=50)).strftime('%Y-%m-%d')]
+    assert len(window) <= kept <= len(window) + 50
+    assert_same_rollups(rollups(store), rollups(reference))
+
+def test_point_older_than_the_merge_window_is_left_out(tmp_path):
+    point = lambda time, lat: {'participant_uuid': 'p', 'timestamp': time, 'latitude': lat, 'longitude': 28.0}
+    store = RollupStore(str(tmp_path / 'rollups.sqlite'), merge_window_days=10)
+    store.update([point('2025-08-01T10:00:00', -26.20), point('2025-08-20T10:00:00', -26.21)])
+    before = rollups(store)
+    totals = store.update([point('2025-08-05T10:00:00', -26.30), point('2025-08-15T10:00:00', -26.22)])
+    assert totals['late'] == 1 and totals['applied'] == 1
+    assert '2025-08-05' not in {row['day'] for row in store.rows()}
+    assert len(list(store.rows())) == len(before[0]) + 1
+
+def test_store_without_fixes_must_be_rebuilt(tmp_path):
+    path = str(tmp_path / 'old.sqlite')
+    RollupStore(path).update([{'participant_uuid': 'p', 'timestamp': '2025-08-01T10:00:00',
+                               'latitude': -26.2, 'longitude': 28.0}])
+    with sqlite3.connect(path) as connection:
+        connection.execute("DELETE FROM meta WHERE key = 'version'")
+    with pytest.raises(ValueError, match='rebuild'):
+        RollupStore(path)
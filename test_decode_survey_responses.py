@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the Typed Survey Response Decoder
+
+Checks SurveyResponseDecoder (decode_survey_responses.py) on a small QSF
+and export: multiple-answer choices exported as codes or as choice text,
+including labels that contain commas or that are the start of another
+label ("Other" and "Other, specify").
+
+Usage:
+    python -m pytest test_decode_survey_responses.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import csv
+import json
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from decode_survey_responses import MultiChoiceColumn, SurveyResponseDecoder  # noqa: E402
+
+CHOICES = [('1', 'Walking'), ('2', 'Other'), ('3', 'Other, specify'), ('4', 'Bus, taxi or train')]
+
+@pytest.fixture
+def column():
+    return MultiChoiceColumn('transport', CHOICES)
+
+@pytest.mark.parametrize('raw, expected', [
+    ('1,3', [True, False, True, False]),
+    ('Other', [False, True, False, False]),
+    ('Other, specify', [False, False, True, False]),
+    ('Other,Other, specify', [False, True, True, False]),
+    ('Walking,Other, specify,Bus, taxi or train', [True, False, True, True]),
+    ('', [None] * 4),
+])
+def test_choices_exported_as_codes_or_text(column, raw, expected):
+    assert column.decode(raw) == expected
+    assert column.failures == 0
+
+def test_unknown_choice_text_is_counted(column):
+    assert column.decode('Walking,Cycling') == [True, False, False, False]
+    assert column.failures == 1
+
+def test_decode_to_csv(tmp_path):
+    qsf = tmp_path / 'survey.qsf'
+    qsf.write_text(json.dumps({'SurveyElements': [{'Element': 'SQ', 'Payload': {
+        'QuestionType': 'MC', 'Selector': 'MAVR', 'DataExportTag': 'transport',
+        'Choices': {code: {'Display': label} for code, label in CHOICES},
+    }}]}), encoding='utf-8')
+    export = tmp_path / 'export.csv'
+    with open(export, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerows([['ResponseId', 'transport'], ['Response ID', 'How did you travel?'],
+                          ['R_1', 'Other, specify'], ['R_2', 'Other,Walking']])
+
+    decoder = SurveyResponseDecoder(str(qsf))
+    output = tmp_path / 'typed.csv'
+    assert decoder.decode_to_csv(str(export), str(output)) == 2
+    with open(output, encoding='utf-8', newline='') as f:
+        rows = list(csv.DictReader(f))
+    assert [row['transport_2'] for row in rows] == ['False', 'True']
+    assert [row['transport_3'] for row in rows] == ['True', 'False']
+    assert decoder.failure_counts() == {}
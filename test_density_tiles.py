@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the Density Tile Pyramid
+
+Checks DensityPyramid (density_tiles.py): the k-participant threshold,
+suppression across zoom levels (no suppressed count can be worked out by
+subtracting shown cells from a coarser one), and the tile directory when
+everything is suppressed or an earlier run left tiles behind.
+
+Usage:
+    python -m pytest test_density_tiles.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+np = pytest.importorskip('numpy')
+from density_tiles import DensityPyramid, lonlat_to_cells  # noqa: E402
+
+def add_points(pyramid, points):
+    """points: (participant, longitude, latitude) tuples"""
+    participants, longitudes, latitudes = zip(*points)
+    pyramid.add(participants, longitudes, latitudes)
+
+def shown_cells(pyramid):
+    return {zoom: {(int(cx), int(cy)): (int(p), int(n)) for cx, cy, p, n in zip(x, y, points, participants)}
+            for zoom, x, y, points, participants, _ in pyramid.suppressed_levels()}
+
+def test_cells_below_k_are_suppressed():
+    pyramid = DensityPyramid(min_zoom=10, max_zoom=10, k=3)
+    add_points(pyramid, [(f'p{i}', 28.0, -26.2) for i in range(3)] + [('p9', 27.5, -26.6)])
+    cells = shown_cells(pyramid)[10]
+    assert cells == {tuple(int(c[0]) for c in lonlat_to_cells([28.0], [-26.2], 10)): (3, 3)}
+
+def test_children_hidden_when_a_sibling_is_suppressed():
+    # Two cells at zoom 16 that share a zoom 15 parent: one busy, one with a
+    # single participant. Showing the busy one would reveal the other by
+    # subtraction from the parent, so only the parent is shown
+    pyramid = DensityPyramid(min_zoom=15, max_zoom=16, k=5)
+    (x,), (y,) = lonlat_to_cells([28.0], [-26.2], 16)
+    x, y = x & ~1, y & ~1  # The top-left child of its parent
+    n = 2 ** 16
+    lon_of = lambda cx: (cx + 0.5) / n * 360.0 - 180.0
+    lat_of = lambda cy: float(np.degrees(np.arctan(np.sinh(np.pi * (1 - 2 * (cy + 0.5) / n)))))
+    points = [(f'p{i}', lon_of(x), lat_of(y)) for i in range(6)] + [('lone', lon_of(x + 1), lat_of(y))]
+    add_points(pyramid, points)
+    cells = shown_cells(pyramid)
+    assert cells[15] == {(int(x >> 1), int(y >> 1)): (7, 7)}
+    assert cells[16] == {}
+
+def test_shown_counts_never_reveal_suppressed_cells():
+    rng = random.Random(3)
+    pyramid = DensityPyramid(min_zoom=9, max_zoom=13, k=4)
+    add_points(pyramid, [(f'p{rng.randrange(40)}', 28.0 + rng.gauss(0, 0.15), -26.2 + rng.gauss(0, 0.15))
+                         for _ in range(20000)])
+    cells = shown_cells(pyramid)
+    assert all(n >= 4 for level in cells.values() for _, n in level.values())
+    for zoom in range(10, 14):
+        children = {}
+        for (cx, cy), (points, _) in cells[zoom].items():
+            # Every shown cell has a shown parent
+            assert (cx >> 1, cy >> 1) in cells[zoom - 1]
+            children.setdefault((cx >> 1, cy >> 1), []).append(points)
+        for parent, child_points in children.items():
+            # A parent's shown children are all of its points, never a part
+            assert sum(child_points) == cells[zoom - 1][parent][0]
+    assert cells[13]  # Dense areas still show the finest level
+
+def test_everything_suppressed_still_writes_metadata(tmp_path):
+    pyramid = DensityPyramid(k=5)
+    add_points(pyramid, [('p1', 28.0, -26.2)])
+    output = tmp_path / 'new' / 'tiles'
+    summary = pyramid.write(output)
+    metadata = json.loads((output / 'metadata.json').read_text())
+    assert metadata['k'] == 5
+    assert all(kept == 0 for kept, _ in summary.values())
+    assert not list(output.glob('*/*/*.json'))
+
+def test_rewriting_removes_tiles_of_an_earlier_run(tmp_path):
+    output = tmp_path / 'tiles'
+    earlier = DensityPyramid(min_zoom=8, max_zoom=10, k=1)
+    add_points(earlier, [('p1', 28.0, -26.2), ('p1', 18.4, -33.9)])
+    earlier.write(output, detail=2)
+    (output / 'README.txt').write_text('keep me')
+    assert len(list(output.glob('*/*/*.json'))) == 6
+
+    later = DensityPyramid(min_zoom=8, max_zoom=10, k=1)
+    add_points(later, [('p1', 28.0, -26.2)])
+    later.write(output, detail=2)
+    assert len(list(output.glob('*/*/*.json'))) == 3
+    assert (output / 'README.txt').read_text() == 'keep me'
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the Boundary Enrichment Stage
+
+Checks BoundaryTagger (enrich_boundaries.py) on small hand-made GeoJSON
+files: which polygon each point is tagged with, including holes,
+multi-part features, points outside every polygon and overlapping features,
+where the first matching feature in the file must win whatever order the
+STR index visits them in.
+
+Usage:
+    python -m pytest test_enrich_boundaries.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import json
+import random
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+np = pytest.importorskip('numpy')
+from enrich_boundaries import BoundaryTagger  # noqa: E402
+
+def box(x1, y1, x2, y2):
+    return [[x1, y1], [x2, y1], [x2, y2], [x1, y2], [x1, y1]]
+
+def feature(name, *polygons):
+    """A Polygon (one list of rings) or MultiPolygon (several) feature"""
+    if len(polygons) == 1:
+        geometry = {'type': 'Polygon', 'coordinates': polygons[0]}
+    else:
+        geometry = {'type': 'MultiPolygon', 'coordinates': list(polygons)}
+    return {'type': 'Feature', 'properties': {'name': name}, 'geometry': geometry}
+
+def make_tagger(tmp_path, features, fields=None):
+    path = tmp_path / 'boundaries.geojson'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': features}))
+    return BoundaryTagger(str(path), fields)
+
+def tag(tagger, *coordinates):
+    points = [{'longitude': lon, 'latitude': lat} for lon, lat in coordinates]
+    return [point['name'] for point in tagger.process(points)]
+
+def test_overlapping_features_first_in_file_wins(tmp_path):
+    # B's box centre sorts before A's in the index, so B is visited first
+    tagger = make_tagger(tmp_path, [
+        feature('A', [box(0, 5, 10, 15)]),
+        feature('B', [box(0, 0, 10, 10)]),
+    ])
+    assert tag(tagger, (5, 7), (5, 2), (5, 12)) == ['A', 'B', 'A']
+
+def test_overlapping_features_across_index_nodes(tmp_path):
+    # Enough overlapping boxes for several index nodes, with their centres
+    # spread so the index visits them out of file order
+    rng = random.Random(7)
+    boxes = [(-rng.randint(1, 60), -rng.randint(1, 60), rng.randint(1, 60), rng.randint(1, 60)) for _ in range(120)]
+    tagger = make_tagger(tmp_path, [feature(f'F{i}', [box(*b)]) for i, b in enumerate(boxes)])
+    coordinates = [(rng.randint(-70, 70) + 0.25, rng.randint(-70, 70) + 0.25) for _ in range(500)]
+    expected = [next((f'F{i}' for i, (x1, y1, x2, y2) in enumerate(boxes) if x1 < x < x2 and y1 < y < y2), '')
+                for x, y in coordinates]
+    assert tag(tagger, *coordinates) == expected
+
+def test_holes_multipolygons_and_outside_points(tmp_path):
+    tagger = make_tagger(tmp_path, [
+        feature('ring', [box(0, 0, 10, 10), box(4, 4, 6, 6)]),
+        feature('islands', [box(20, 0, 21, 1)], [box(30, 0, 31, 1)]),
+    ])
+    assert tag(tagger, (1, 1), (5, 5), (20.5, 0.5), (30.5, 0.5), (25, 0.5)) == ['ring', '', 'islands', 'islands', '']
+    assert (tagger.tagged, tagger.untagged) == (3, 2)
+
+def test_unparseable_coordinates_are_untagged(tmp_path):
+    tagger = make_tagger(tmp_path, [feature('A', [box(0, 0, 10, 10)])])
+    assert tag(tagger, ('', '5'), (None, None), ('x', 5), (5, 5)) == ['', '', '', 'A']
+
+def test_clashing_property_names_are_prefixed(tmp_path):
+    path = tmp_path / 'boundaries.geojson'
+    path.write_text(json.dumps({'type': 'FeatureCollection', 'features': [{
+        'type': 'Feature',
+        'properties': {'latitude': 'centre', 'WardID': 7},
+        'geometry': {'type': 'Polygon', 'coordinates': [box(0, 0, 10, 10)]},
+    }]}))
+    tagger = BoundaryTagger(str(path))
+    assert tagger.fieldnames == ['boundary_latitude', 'WardID']
+    point = tagger.process([{'longitude': '5', 'latitude': '5'}])[0]
+    assert (point['latitude'], point['boundary_latitude'], point['WardID']) == ('5', 'centre', 7)
@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the GPS Quality Filter's Jump Check
+
+Checks GPSQualityFilter (gps_quality_filter.py) on small hand-made traces
+fed in batches, as the decryptor does with each payload: spikes are
+dropped, a batch whose every fix is a jump is handled, and a real
+relocation that arrives a few fixes at a time is accepted once the next
+batch carries on from it.
+
+Usage:
+    python -m pytest test_gps_quality_filter.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+- numpy (install with: pip install numpy)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import sys
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+pytest.importorskip('numpy')
+from gps_quality_filter import GPSQualityFilter  # noqa: E402
+
+START = datetime(2025, 8, 1, 8, 0)
+
+def fix(minutes, latitude, longitude, participant='p1'):
+    return {'participant_uuid': participant, 'timestamp': (START + timedelta(minutes=minutes)).isoformat(),
+            'latitude': str(latitude), 'longitude': str(longitude), 'accuracy': '10'}
+
+def kept_minutes(quality_filter, batch):
+    return [(datetime.strptime(point['timestamp'], '%Y-%m-%dT%H:%M:%S') - START).seconds // 60
+            for point in quality_filter.process(batch)]
+
+def test_spike_within_a_batch_is_dropped():
+    quality_filter = GPSQualityFilter()
+    batch = [fix(0, -26.2, 28.0), fix(1, -26.2, 28.001), fix(2, -25.0, 28.0), fix(3, -26.2, 28.002)]
+    assert kept_minutes(quality_filter, batch) == [0, 1, 3]
+
+def test_batch_of_only_jumps():
+    # Every candidate of the second batch is dropped in the first pass
+    quality_filter = GPSQualityFilter()
+    assert kept_minutes(quality_filter, [fix(0, -26.2, 28.0), fix(1, -26.2, 28.0)]) == [0, 1]
+    assert kept_minutes(quality_filter, [fix(5, -25.0, 28.0)]) == []
+    assert quality_filter.rejections['p1']['speed'] == 1
+
+def test_lone_spike_at_the_end_of_a_batch_is_not_followed():
+    quality_filter = GPSQualityFilter()
+    quality_filter.process([fix(0, -26.2, 28.0)])
+    assert kept_minutes(quality_filter, [fix(5, -25.0, 28.0)]) == []
+    # The next batch is back home, so the spike was not a relocation
+    assert kept_minutes(quality_filter, [fix(10, -26.2, 28.001), fix(11, -26.2, 28.002)]) == [10, 11]
+    assert quality_filter.last_fix['p1'][1] == pytest.approx(-26.2)
+
+def test_relocation_arriving_in_small_batches_is_accepted():
+    # Johannesburg, then the first fixes after landing in Cape Town, one
+    # small upload at a time
+    quality_filter = GPSQualityFilter()
+    assert kept_minutes(quality_filter, [fix(0, -26.13, 28.24), fix(1, -26.13, 28.24)]) == [0, 1]
+    assert kept_minutes(quality_filter, [fix(90, -33.97, 18.60)]) == []
+    assert kept_minutes(quality_filter, [fix(95, -33.97, 18.61)]) == [95]
+    assert kept_minutes(quality_filter, [fix(100, -33.96, 18.62), fix(105, -33.95, 18.63)]) == [100, 105]
+    assert quality_filter.rejections['p1']['speed'] == 1
+
+def test_participants_are_checked_separately():
+    quality_filter = GPSQualityFilter()
+    batch = [fix(0, -26.2, 28.0, 'a'), fix(0, -25.0, 28.0, 'b'), fix(1, -26.2, 28.001, 'a'), fix(1, -25.0, 28.001, 'b')]
+    assert len(quality_filter.process(batch)) == 4
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for a Participant Index Shared Between Processes
+
+Checks that two ParticipantIndex instances open on the same file (as when
+watch_exports.py runs next to a backfill of decrypt_location_data.py) give
+every participant and response one ID, whichever adds it first, and that a
+writer waiting for the other gets a clear error instead of a stale cache.
+
+Usage:
+    python -m pytest test_participant_index.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+import participant_index  # noqa: E402
+from participant_index import ParticipantIndex  # noqa: E402
+
+def context(response_id, uuid='', code=''):
+    return {'response_id': response_id, 'participant_uuid': uuid, 'participant_code': code,
+            'survey_date': '2025-08-11'}
+
+@pytest.fixture
+def pair(tmp_path):
+    # Both opened before either adds anything, so each starts with an empty cache
+    path = tmp_path / 'index.sqlite'
+    first, second = ParticipantIndex(path), ParticipantIndex(path)
+    yield first, second
+    first.close()
+    second.close()
+
+def test_participants_added_by_another_process_are_reused(pair):
+    first, second = pair
+    p1 = first.resolve(context('R1', uuid='uuid-1', code='P001'))
+    p2 = first.resolve(context('R2', code='P002'))
+    first.commit()
+
+    assert second.resolve(context('R3', uuid='uuid-1')) == p1
+    assert second.resolve(context('R4', code='P002')) == p2
+    # A response the other process has recorded keeps its first mapping
+    assert second.resolve(context('R1', uuid='uuid-1')) == p1
+    second.commit()
+    assert second.new_participants == 0
+    assert second.new_responses == 2
+
+    # The first process finds what the second added, without reopening
+    assert first.participant_of('R3') == p1
+    assert first.find('R4') == p2
+
+def test_code_linked_to_a_uuid_by_another_process(pair):
+    first, second = pair
+    code_only = first.resolve(context('R1', code='P001'))
+    first.commit()
+    # The second process links the code to a UUID; the first must follow it
+    assert second.resolve(context('R2', uuid='uuid-1', code='P001')) == code_only
+    second.commit()
+    assert first.resolve(context('R3', uuid='uuid-1', code='P001')) == code_only
+    assert first.lookup(code_only) == ('uuid-1', 'P001')
+    assert first.resolve(context('R4', uuid='uuid-2', code='P001')) != code_only
+
+def test_writer_waiting_too_long_gets_a_clear_error(pair, monkeypatch):
+    first, _ = pair
+    first.resolve(context('R1', uuid='uuid-1'))  # Holds the write lock until committed
+    monkeypatch.setattr(participant_index, 'BUSY_TIMEOUT', 0.1)
+    waiting = ParticipantIndex(first.path)
+    try:
+        with pytest.raises(sqlite3.OperationalError, match='is busy'):
+            waiting.resolve(context('R2', uuid='uuid-2'))
+        first.commit()
+        assert waiting.resolve(context('R2', uuid='uuid-2')) not in (None, first.participant_of('R1'))
+    finally:
+        waiting.close()
+
+def test_new_entries_are_committed_within_the_interval(pair, monkeypatch):
+    first, second = pair
+    monkeypatch.setattr(participant_index, 'COMMIT_INTERVAL', 0)
+    participant_id = first.resolve(context('R1', uuid='uuid-1'))
+    assert not first.connection.in_transaction
+    assert second.participant_of('R1') == participant_id
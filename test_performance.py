@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Performance and Memory Regression Tests for the Research Tooling
+
+Runs LocationDecryptor and XLSFormToQSFConverter on synthetic exports and
+forms of fixed sizes, and fails when a change makes them slower or more
+memory-hungry than the baselines stored in performance_baselines.json:
+
+- wall time, taken as the best of a few runs and divided by the time of a
+  fixed calibration workload measured in the same session, so baselines
+  recorded on one computer carry over to another (CI, a laptop)
+- peak Python memory, from tracemalloc
+- peak resident set size (RSS) of a full command line decryption run in a
+  fresh process (Linux and macOS only)
+
+A check fails when throughput drops by more than the time tolerance (30% by
+default) or peak memory rises by more than the memory tolerance (15%).
+
+The measurements depend on the interpreter and on the builds of
+cryptography, OpenSSL and numpy as much as on our code, so the checks only
+run when asked for (WELLBEING_PERF=1), and baselines are kept per platform
+and Python version. Checks without a baseline for the current one are
+skipped.
+
+Usage:
+    WELLBEING_PERF=1 python -m pytest test_performance.py
+    WELLBEING_PERF_UPDATE=1 python -m pytest test_performance.py      # record new baselines
+
+Set WELLBEING_PERF_TIME_TOLERANCE or WELLBEING_PERF_MEMORY_TOLERANCE (e.g.
+0.5) to loosen the checks on a noisy machine. Record new baselines only for
+changes that are meant to change performance, and commit them with it.
+
+Requirements:
+- pytest (install with: pip install pytest)
+- cryptography library (install with: pip install cryptography)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import base64
+import contextlib
+import csv
+import hashlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives import hashes, padding as symmetric_padding, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+ROOT_DIR = Path(__file__).parent
+SURVEY_DIR = ROOT_DIR / 'xlsform_surveys'
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(SURVEY_DIR))
+
+from create_qsf_surveys import QualtricsJSONEncoder, XLSFormToQSFConverter  # noqa: E402
+from decrypt_location_data import KeyRegistry, LocationDecryptor, PointDeduplicator  # noqa: E402
+
+BASELINES_FILE = ROOT_DIR / 'performance_baselines.json'
+UPDATE_BASELINES = os.environ.get('WELLBEING_PERF_UPDATE', '') not in ('', '0')
+RUN_CHECKS = UPDATE_BASELINES or os.environ.get('WELLBEING_PERF', '') not in ('', '0')
+# Baselines in performance_baselines.json are kept under this key
+ENVIRONMENT = f"{sys.platform}-{platform.machine()}-python{sys.version_info[0]}.{sys.version_info[1]}"
+TIME_TOLERANCE = float(os.environ.get('WELLBEING_PERF_TIME_TOLERANCE', 0.3))
+MEMORY_TOLERANCE = float(os.environ.get('WELLBEING_PERF_MEMORY_TOLERANCE', 0.15))
+# Peaks of a few MB move by a few hundred KB between Python versions
+MEMORY_SLACK_MB = 0.5
+REPEAT = 3
+# Extra measurement rounds before a slow result counts (timings on shared CI runners are noisy)
+RETRIES = 2
+
+# Fixed workload sizes; changing them needs new baselines
+EXPORT_ROWS = 40
+POINTS_PER_ROW = 400
+XOR_EXPORT_ROWS = 20
+PARTICIPANTS = 10
+FORM_QUESTIONS = 1000
+CHOICES_PER_LIST = 10
+
+pytestmark = pytest.mark.skipif(not RUN_CHECKS, reason="performance checks run with WELLBEING_PERF=1")
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+
+# --- Synthetic inputs -------------------------------------------------------
+
+def synthetic_points(participant, row, rng):
+    """Two weeks of points at 40-minute intervals, overlapping the participant's previous upload by half"""
+    start = 1754006400 + row * POINTS_PER_ROW // 2 * 2400
+    return [{
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(start + i * 2400)),
+        'latitude': round(-26.2 + rng.uniform(-0.1, 0.1), 6),
+        'longitude': round(28.0 + rng.uniform(-0.1, 0.1), 6),
+        'accuracy': round(rng.uniform(3, 30), 1),
+        'speed': round(rng.uniform(0, 15), 2),
+        'heading': round(rng.uniform(0, 360), 1),
+        'altitude': round(rng.uniform(1500, 1800), 1),
+    } for i in range(POINTS_PER_ROW)]
+
+def aes_envelope(public_key, points):
+    aes_key, iv = os.urandom(32), os.urandom(16)
+    padder = symmetric_padding.PKCS7(128).padder()
+    padded = padder.update(json.dumps(points).encode('utf-8')) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(aes_key), modes.CBC(iv)).encryptor()
+    return {
+        'encryptedKey': base64.b64encode(public_key.encrypt(aes_key, OAEP)).decode(),
+        'encryptedData': base64.b64encode(iv + encryptor.update(padded) + encryptor.finalize()).decode(),
+        'algorithm': 'AES-256-CBC + RSA-OAEP',
+        'researchSite': 'gauteng',
+    }
+
+def xor_envelope(public_key, points):
+    key = os.urandom(32)
+    data = json.dumps({'locationData': points}).encode('utf-8')
+    keystream = (key * (len(data) // len(key) + 1))[:len(data)]
+    return {
+        'encryptedKey': base64.b64encode(public_key.encrypt(key, padding.PKCS1v15())).decode(),
+        'encryptedData': base64.b64encode(bytes(a ^ b for a, b in zip(data, keystream))).decode(),
+        'algorithm': 'AES-256-GCM + RSA-PKCS1',
+        'researchSite': 'gauteng',
+    }
+
+def write_export(path, public_key, rows, make_envelope, seed=1):
+    rng = random.Random(seed)
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['RecordedDate', 'ResponseId', 'participantCode', 'participantUUID', 'QID_LOCATION'])
+        writer.writerow(['Recorded Date', 'Response ID', 'Participant Code', 'Participant UUID', 'Location Data'])
+        for row in range(rows):
+            participant = row % PARTICIPANTS
+            points = synthetic_points(participant, row // PARTICIPANTS, rng)
+            writer.writerow(['2025-08-14 10:00:00', f'R_{row}', f'P{participant:03d}', f'uuid-{participant}',
+                             json.dumps(make_envelope(public_key, points))])
+
+def write_form(directory):
+    """XLSForm CSVs with FORM_QUESTIONS questions, a third of them multiple choice"""
+    survey, choices = directory / 'survey.csv', directory / 'choices.csv'
+    types = ['integer', 'text', 'select_one', 'select_multiple', 'decimal', 'date']
+    with open(survey, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['type', 'name', 'label', 'hint', 'required', 'appearance', 'relevant', 'constraint'])
+        for i in range(FORM_QUESTIONS):
+            kind = types[i % len(types)]
+            if kind.startswith('select'):
+                kind = f'{kind} list_{i}'
+            constraint = '. >= 0 and . <= 100' if kind == 'integer' else ''
+            writer.writerow([kind, f'q_{i}', f'Question {i}: how have you been feeling about item {i}?',
+                             f'Hint for question {i}', 'yes' if i % 2 else 'no', '', '', constraint])
+    with open(choices, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['list_name', 'name', 'label'])
+        for i in range(FORM_QUESTIONS):
+            for j in range(CHOICES_PER_LIST):
+                writer.writerow([f'list_{i}', f'option_{j}', f'Option {j} of question {i}'])
+    settings = directory / 'settings.csv'
+    settings.write_text('form_title,form_id,version\nPerformance Form,performance_form,1.0\n', encoding='utf-8')
+    return survey, choices, settings
+
+# --- Measurement ------------------------------------------------------------
+
+def calibration_workload():
+    """A fixed mix of hashing, JSON and sorting that stands for 'this machine's speed'"""
+    hashlib.sha256(bytes(1 << 21)).hexdigest()
+    records = [{'i': i, 'x': i * 0.5, 's': str(i)} for i in range(10000)]
+    json.loads(json.dumps(records))
+    sorted(random.Random(0).random() for _ in range(40000))
+
+def best_time(func, repeat=REPEAT):
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        durations.append(time.perf_counter() - start)
+    return min(durations)
+
+def peak_python_mb(func):
+    tracemalloc.start()
+    try:
+        func()
+        return tracemalloc.get_traced_memory()[1] / 1e6
+    finally:
+        tracemalloc.stop()
+
+@pytest.fixture(scope='session')
+def baselines():
+    stored = json.loads(BASELINES_FILE.read_text(encoding='utf-8')) if BASELINES_FILE.exists() else {}
+    yield stored.setdefault(ENVIRONMENT, {})
+    if UPDATE_BASELINES:
+        BASELINES_FILE.write_text(json.dumps(stored, indent=2, sort_keys=True) + '\n', encoding='utf-8')
+
+def relative_time(baselines, name, func):
+    """Best time of `func` divided by that of the calibration workload, measured again while over budget
+
+    The calibration is timed next to every measurement, so a machine that
+    slows down (or speeds up) during the session doesn't skew the ratio.
+    """
+    budget = baselines.get(name, {}).get('relative_time')
+    best = float('inf')
+    for _ in range(RETRIES + 1):
+        best = min(best, best_time(func) / best_time(calibration_workload))
+        if not UPDATE_BASELINES and (budget is None or budget / best >= 1 - TIME_TOLERANCE):
+            break
+    return best
+
+def check_budget(baselines, name, measured):
+    """Compare measurements ({'relative_time': ..., 'peak_*_mb': ...}) with the stored baseline"""
+    measured = {key: round(value, 4) for key, value in measured.items()}
+    if UPDATE_BASELINES:
+        baselines[name] = measured
+        return
+    baseline = baselines.get(name)
+    if baseline is None:
+        pytest.skip(f"No baseline for {name} on {ENVIRONMENT}; record one with WELLBEING_PERF_UPDATE=1")
+
+    failures = []
+    for key, value in measured.items():
+        if key not in baseline:
+            continue
+        if key == 'relative_time':
+            drop = 1 - baseline[key] / value
+            if drop > TIME_TOLERANCE:
+                failures.append(f"{name}: throughput {drop:.0%} below baseline "
+                                f"(relative time {value:.3f} vs {baseline[key]:.3f}, tolerance {TIME_TOLERANCE:.0%})")
+        elif value > baseline[key] * (1 + MEMORY_TOLERANCE) + MEMORY_SLACK_MB:
+            failures.append(f"{name}: {key} {value:.1f} MB vs baseline {baseline[key]:.1f} MB "
+                            f"(tolerance {MEMORY_TOLERANCE:.0%})")
+    assert not failures, '\n'.join(failures)
+
+# --- Fixtures ---------------------------------------------------------------
+
+@pytest.fixture(scope='session')
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+@pytest.fixture(scope='session')
+def key_file(private_key, tmp_path_factory):
+    path = tmp_path_factory.mktemp('keys') / 'private_key.pem'
+    path.write_bytes(private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ))
+    return path
+
+@pytest.fixture(scope='session')
+def aes_export(private_key, tmp_path_factory):
+    path = tmp_path_factory.mktemp('exports') / 'aes_export.csv'
+    write_export(path, private_key.public_key(), EXPORT_ROWS, aes_envelope)
+    return path
+
+@pytest.fixture(scope='session')
+def xor_export(private_key, tmp_path_factory):
+    path = tmp_path_factory.mktemp('exports') / 'xor_export.csv'
+    write_export(path, private_key.public_key(), XOR_EXPORT_ROWS, xor_envelope)
+    return path
+
+def decrypt_export(private_key, export):
+    decryptor = LocationDecryptor(stages=[PointDeduplicator()])
+    decryptor.keys.add(KeyRegistry.DEFAULT_SITE, private_key)
+    decryptor.private_key = private_key
+    with contextlib.redirect_stdout(io.StringIO()):
+        assert decryptor.process_qualtrics_csv(export)
+    return decryptor
+
+# --- Tests ------------------------------------------------------------------
+
+@pytest.mark.parametrize('envelope_format', ['aes', 'xor'])
+def test_decrypt_export(envelope_format, private_key, aes_export, xor_export, baselines):
+    export = aes_export if envelope_format == 'aes' else xor_export
+    decryptor = decrypt_export(private_key, export)
+    rows = EXPORT_ROWS if envelope_format == 'aes' else XOR_EXPORT_ROWS
+    assert decryptor.metrics.counters.get('processed_rows') == rows
+    assert len(decryptor.decrypted_locations) > 0
+
+    name = f'decrypt_{envelope_format}_export'
+    check_budget(baselines, name, {
+        'relative_time': relative_time(baselines, name, lambda: decrypt_export(private_key, export)),
+        'peak_python_mb': peak_python_mb(lambda: decrypt_export(private_key, export)),
+    })
+
+def test_save_decrypted_data(private_key, aes_export, tmp_path, baselines):
+    decryptor = decrypt_export(private_key, aes_export)
+    output = tmp_path / 'points.csv'
+
+    def save():
+        with contextlib.redirect_stdout(io.StringIO()):
+            assert decryptor.save_decrypted_data(output)
+
+    check_budget(baselines, 'save_decrypted_data', {
+        'relative_time': relative_time(baselines, 'save_decrypted_data', save),
+        'peak_python_mb': peak_python_mb(save),
+    })
+
+@pytest.mark.skipif(sys.platform not in ('linux', 'darwin'), reason="peak RSS is only reported on Linux and macOS")
+def test_decrypt_command_peak_rss(key_file, aes_export, tmp_path, baselines):
+    metrics = tmp_path / 'metrics.json'
+    subprocess.run(
+        [sys.executable, str(ROOT_DIR / 'decrypt_location_data.py'), '--key', str(key_file), '--csv', str(aes_export),
+         '-o', str(tmp_path / 'points.csv'), '--metrics', str(metrics)],
+        cwd=tmp_path, check=True, capture_output=True
+    )
+    peak_rss = json.loads(metrics.read_text(encoding='utf-8'))['peak_rss_bytes']
+    check_budget(baselines, 'decrypt_command', {'peak_rss_mb': peak_rss / 1e6})
+
+def test_qsf_conversion(tmp_path, baselines):
+    survey, choices, settings = write_form(tmp_path)
+
+    def convert():
+        qsf = XLSFormToQSFConverter().convert_survey_to_qsf(survey, choices, settings, 'performance')
+        json.dump(qsf, io.StringIO(), indent=2, ensure_ascii=False, cls=QualtricsJSONEncoder)
+        return qsf
+
+    qsf = convert()
+    questions = [element for element in qsf['SurveyElements'] if element['Type'] == 'Question']
+    assert len(questions) == FORM_QUESTIONS
+
+    check_budget(baselines, 'qsf_conversion', {
+        'relative_time': relative_time(baselines, 'qsf_conversion', convert),
+        'peak_python_mb': peak_python_mb(convert),
+    })
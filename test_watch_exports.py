@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+"""
+Behaviour Tests for the Export Watcher
+
+Checks ExportWatcher (watch_exports.py) on small synthetic Qualtrics
+exports: an export that fails partway (a truncated download) leaves no
+trace, so every point is written once the complete export is read, and
+it is read again on the next poll even if it hasn't changed.
+
+Usage:
+    python -m pytest test_watch_exports.py
+
+Requirements:
+- pytest (install with: pip install pytest)
+- cryptography library (install with: pip install cryptography)
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import base64
+import csv
+import gzip
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+import pytest
+from cryptography.hazmat.primitives import hashes, padding as symmetric_padding, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR))
+
+from decrypt_location_data import LocationDecryptor, PointDeduplicator  # noqa: E402
+from watch_exports import ExportWatcher, file_fingerprint  # noqa: E402
+
+OAEP = padding.OAEP(mgf=padding.MGF1(algorithm=hashes.SHA256()), algorithm=hashes.SHA256(), label=None)
+ROWS = 12
+POINTS_PER_ROW = 100
+
+@pytest.fixture(scope='module')
+def private_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+def envelope(public_key, points):
+    aes_key, iv = os.urandom(32), os.urandom(16)
+    padder = symmetric_padding.PKCS7(128).padder()
+    padded = padder.update(json.dumps(points).encode('utf-8')) + padder.finalize()
+    encryptor = Cipher(algorithms.AES(aes_key), modes.CBC(iv)).encryptor()
+    return json.dumps({
+        'encryptedKey': base64.b64encode(public_key.encrypt(aes_key, OAEP)).decode(),
+        'encryptedData': base64.b64encode(iv + encryptor.update(padded) + encryptor.finalize()).decode(),
+        'algorithm': 'AES-256-CBC + RSA-OAEP',
+    })
+
+def write_export(path, public_key, rows):
+    """A gzipped export; consecutive uploads of a participant overlap by half, as the app resends them"""
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['RecordedDate', 'ResponseId', 'participantCode', 'participantUUID', 'QID_LOCATION'])
+        writer.writerow(['Recorded Date', 'Response ID', 'Participant Code', 'Participant UUID', 'Location Data'])
+        for row in range(rows):
+            participant, upload = row % 3, row // 3
+            start = 1754006400 + upload * POINTS_PER_ROW // 2 * 600
+            # A resent point is the same fix: its position follows from its time
+            points = [{'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t)),
+                       'latitude': round(-26.2 + participant / 100 + t % 997 / 1e5, 6),
+                       'longitude': round(28.0 + t % 991 / 1e5, 6)}
+                      for t in range(start, start + POINTS_PER_ROW * 600, 600)]
+            writer.writerow(['2025-08-14 10:00:00', f'R_{row}', f'P{participant}', f'uuid-{participant}',
+                             envelope(public_key, points)])
+
+def make_watcher(tmp_path, private_key):
+    key_path = tmp_path / 'key.pem'
+    key_path.write_bytes(private_key.private_bytes(serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8,
+                                                   serialization.NoEncryption()))
+    decryptor = LocationDecryptor(stages=[PointDeduplicator()], log_rows=False)
+    assert decryptor.load_private_key(str(key_path))
+    drop = tmp_path / 'drop'
+    drop.mkdir()
+    return ExportWatcher(drop, decryptor, tmp_path / 'study.csv', tmp_path / 'state.sqlite'), drop
+
+def read_points(path):
+    with open(path, encoding='utf-8', newline='') as f:
+        return [(row['participant_uuid'], row['timestamp']) for row in csv.DictReader(f)]
+
+def process(watcher, path):
+    return watcher.process_file(path, file_fingerprint(path), path.stat().st_size)
+
+def test_truncated_export_then_complete_export(tmp_path, private_key):
+    complete = tmp_path / 'complete.csv.gz'
+    write_export(complete, private_key.public_key(), ROWS)
+    (tmp_path / 'reference').mkdir()
+    reference, _ = make_watcher(tmp_path / 'reference', private_key)
+    assert process(reference, complete)
+    expected = read_points(reference.output)
+    reference.close()
+
+    watcher, drop = make_watcher(tmp_path, private_key)
+    try:
+        truncated = drop / 'export.csv.gz'
+        truncated.write_bytes(complete.read_bytes()[:len(complete.read_bytes()) * 2 // 3])
+        assert not process(watcher, truncated)
+        assert not watcher.output.exists()
+
+        full = drop / 'export_complete.csv.gz'
+        full.write_bytes(complete.read_bytes())
+        assert process(watcher, full)
+        assert sorted(read_points(watcher.output)) == sorted(expected)
+        assert len(expected) == len(set(expected)) == 3 * (ROWS // 3 + 1) * POINTS_PER_ROW // 2
+    finally:
+        watcher.close()
+
+def test_failed_file_is_read_again_on_the_next_poll(tmp_path, private_key, monkeypatch):
+    watcher, drop = make_watcher(tmp_path, private_key)
+    try:
+        export = drop / 'export.csv.gz'
+        write_export(export, private_key.public_key(), 3)
+        calls = []
+        process_file = watcher.process_file
+
+        def fail_once(*args):
+            calls.append(args)
+            return len(calls) > 1 and process_file(*args)
+        monkeypatch.setattr(watcher, 'process_file', fail_once)
+        watcher.poll()  # Records the size
+        assert watcher.poll() == 0  # First attempt fails
+        assert watcher.poll() == 1  # Unchanged, but tried again
+        assert len(read_points(watcher.output)) == 3 * POINTS_PER_ROW
+    finally:
+        watcher.close()
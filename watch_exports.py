@@ -0,0 +1,338 @@
+#!/usr/bin/env python3
+"""
+Watch a Drop Folder and Decrypt New Qualtrics Exports as They Arrive
+
+Runs as a long-lived process next to the shared folder the data manager
+drops exports into during a survey wave. The private key is loaded and
+unlocked once at start-up, and every new export is decrypted within a
+polling interval of landing, straight into the study dataset:
+
+- The folder is polled (plain stat calls, so it also works on network
+  shares). A file is picked up once its size and modification time have
+  stopped changing between two polls, i.e. once it has been fully written.
+- Each file is fingerprinted (SHA-256 of its content), so the same export
+  dropped twice, or renamed, is skipped.
+- Qualtrics exports are cumulative. Every ResponseId decrypted so far is
+  remembered, so each new export only adds its unseen responses. Responses
+  that failed are retried when their envelope has changed, and when the
+  watcher is restarted with different keys or --envelope-format, the
+  exports holding them are read again.
+- New points are appended to the study CSV (and optionally to a rollup
+  store, see activity_rollups.py). Deduplication stays warm for the whole
+  run, so overlap the app resends between uploads is dropped too.
+
+State (fingerprints and seen responses) is kept in a small SQLite file, so
+the watcher can be stopped and restarted without reprocessing anything.
+Rows that fail to decrypt are quarantined as in decrypt_location_data.py.
+If they failed because of a wrong or missing key, restart the watcher with
+the right --key/--site-key (or --envelope-format) to decrypt them.
+
+Usage:
+    python watch_exports.py /shared/exports --key gauteng_private_key.pem -o study_locations.csv
+    python watch_exports.py /shared/exports --key gauteng_private_key.pem -o study_locations.csv \\
+        --rollups rollups.sqlite --interval 60
+    python watch_exports.py /shared/exports --key gauteng_private_key.pem -o study_locations.csv --once
+
+For password-protected keys, set WELLBEING_KEY_PASSWORD_DEFAULT (or
+WELLBEING_KEY_PASSWORD_<SITE> with --site-key) so the watcher can start
+unattended.
+
+Author: Wellbeing Mapper Development Team
+"""
+
+import argparse
+import csv
+import hashlib
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+
+from decrypt_location_data import (
+    ENVELOPE_FORMATS,
+    LocationDecryptor,
+    PointDeduplicator,
+    QuarantineSink,
+    key_password,
+    parse_site_key,
+)
+
+EXPORT_PATTERNS = ['*.csv', '*.csv.gz', '*.zip']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    fingerprint TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    processed_at TEXT NOT NULL,
+    new_responses INTEGER NOT NULL,
+    points INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS responses (
+    response_id TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    failed_envelope TEXT
+) WITHOUT ROWID;
+"""
+
+def file_fingerprint(path, chunk_size=1 << 20):
+    """SHA-256 of a file's content, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def envelope_hash(envelope):
+    return hashlib.sha1(envelope.encode('utf-8')).hexdigest()
+
+def key_set_fingerprint(keys):
+    """Hash of the sites and public keys in a KeyRegistry, to tell when a different set is loaded"""
+    digest = hashlib.sha1()
+    for site in sorted(keys.keys):
+        modulus = keys.keys[site].public_key().public_numbers().n
+        digest.update(f"{site}:{modulus:x}\n".encode('ascii'))
+    return digest.hexdigest()
+
+def response_key(context, envelope):
+    """The row's ResponseId, or a hash of its envelope for exports without one"""
+    return context.get('response_id') or 'sha1:' + envelope_hash(envelope)
+
+class ExportWatcher:
+    """Decrypts new exports from a folder into an append-only study CSV
+
+    `decryptor` is a LocationDecryptor with its keys already loaded; it (and
+    its stages) are reused for every file. Call `poll()` repeatedly, or
+    `run()` to poll until interrupted.
+    """
+
+    def __init__(self, watch_dir, decryptor, output, state_path, rollups=None, envelope_format='auto'):
+        self.watch_dir = Path(watch_dir)
+        self.decryptor = decryptor
+        self.output = Path(output)
+        self.rollups = rollups
+        self.envelope_format = envelope_format
+        # Failed responses are remembered together with the keys and format
+        # they were tried with, so a restart with other ones retries them
+        self._attempt = envelope_hash(f"{key_set_fingerprint(decryptor.keys)}:{envelope_format}")[:16] + ':'
+        self.fieldnames = decryptor.point_fieldnames()
+        self.state = sqlite3.connect(str(state_path))
+        self.state.executescript(SCHEMA)
+        # path -> (size, mtime_ns) at the last poll, to tell when a file has settled
+        self._last_seen = {}
+        # path -> (size, mtime_ns) of the version already handled
+        self._handled = {}
+
+    def _failure_hash(self, envelope):
+        """Hashes of the keys and format a response failed with and of its envelope"""
+        return self._attempt + envelope_hash(envelope)
+
+    def _has_untried_failures(self, fingerprint):
+        """Whether an export holds failed responses not yet tried with the current keys and format"""
+        return self.state.execute(
+            'SELECT 1 FROM responses WHERE fingerprint = ? AND failed_envelope IS NOT NULL '
+            'AND substr(failed_envelope, 1, ?) != ? LIMIT 1',
+            (fingerprint, len(self._attempt), self._attempt)
+        ).fetchone() is not None
+
+    def _candidates(self):
+        paths = set()
+        for pattern in EXPORT_PATTERNS:
+            paths.update(self.watch_dir.glob(pattern))
+        return sorted(paths)
+
+    def poll(self):
+        """Process every export that is new or changed and has settled; returns the number of files processed"""
+        processed = 0
+        current = {}
+        for path in self._candidates():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue  # Removed while we were looking
+            signature = (stat.st_size, stat.st_mtime_ns)
+            current[path] = signature
+            # Wait until a file stops growing before reading it
+            if self._handled.get(path) == signature or self._last_seen.get(path) != signature:
+                continue
+            self._handled[path] = signature
+            fingerprint = file_fingerprint(path)
+            known = self.state.execute('SELECT path FROM files WHERE fingerprint = ?', (fingerprint,)).fetchone()
+            if known:
+                if not self._has_untried_failures(fingerprint):
+                    if known[0] != str(path):
+                        print(f"⏭️  {path.name}: same content as {Path(known[0]).name}, skipped")
+                    continue
+                print(f"🔁 {path.name}: retrying failed responses with the current keys")
+            if self.process_file(path, fingerprint, stat.st_size):
+                processed += 1
+            else:
+                # Read it again on a later poll, even if it doesn't change
+                del self._handled[path]
+        self._last_seen = current
+        return processed
+
+    def process_file(self, path, fingerprint, size):
+        """Decrypt the unseen responses of one export and append their points"""
+        decryptor = self.decryptor
+        start = time.perf_counter()
+        new_responses = seen = failed = 0
+        batches = []
+        response_rows = []
+        lookup = self.state.execute
+        try:
+            for context, envelope in decryptor.iter_envelopes(path):
+                key = response_key(context, envelope)
+                known = lookup('SELECT failed_envelope FROM responses WHERE response_id = ?', (key,)).fetchone()
+                # A response that failed is only retried if its envelope changed
+                # (e.g. it was cut short in a file still being written) or the
+                # keys or envelope format are not the ones it failed with
+                if known and (known[0] is None or known[0] == self._failure_hash(envelope)):
+                    seen += 1
+                    continue
+                # The stages (deduplication above all) only see the points once
+                # the whole file has been read, so a file that fails halfway
+                # leaves no trace and its points are not lost when re-read
+                points = decryptor.decrypt_points(envelope, context, self.envelope_format, run_stages=False)
+                if points is None:
+                    failed += 1
+                else:
+                    new_responses += 1
+                    batches.append(points)
+                response_rows.append((key, fingerprint, self._failure_hash(envelope) if points is None else None))
+        except Exception as e:
+            # Leave the file unrecorded so a corrected copy is picked up
+            print(f"❌ Error reading {path.name}: {e}")
+            return False
+
+        new_points = []
+        for points in batches:
+            new_points.extend(decryptor.finish_points(points))
+        # Points first, then the state, so a crash never loses responses
+        self.append_points(new_points)
+        if self.rollups is not None and new_points:
+            self.rollups.update(new_points)
+        # A file read again to retry failures adds to its earlier counts
+        earlier = self.state.execute('SELECT new_responses, points FROM files WHERE fingerprint = ?',
+                                     (fingerprint,)).fetchone() or (0, 0)
+        with self.state:
+            self.state.executemany('INSERT OR REPLACE INTO responses VALUES (?, ?, ?)', response_rows)
+            self.state.execute('INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?)', (
+                fingerprint, str(path), size, datetime.now().isoformat(timespec='seconds'),
+                earlier[0] + new_responses, earlier[1] + len(new_points)
+            ))
+        if decryptor.participant_index is not None:
+            decryptor.participant_index.commit()
+        print(f"📥 {path.name}: {new_responses} new responses ({len(new_points)} points), "
+              f"{seen} already seen, {failed} failed ({time.perf_counter() - start:.1f}s)")
+        return True
+
+    def append_points(self, points):
+        if not points:
+            return
+        write_header = not self.output.exists() or self.output.stat().st_size == 0
+        with open(self.output, 'a', newline='', encoding='utf-8') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fieldnames)
+            if write_header:
+                writer.writeheader()
+            writer.writerows(points)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def run(self, interval=30.0):
+        """Poll every `interval` seconds until interrupted (Ctrl+C)"""
+        print(f"👀 Watching {self.watch_dir} every {interval:g}s (Ctrl+C to stop)...")
+        try:
+            while True:
+                self.poll()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            print("\n🛑 Stopped watching.")
+
+    def summary(self):
+        files, responses, points = self.state.execute(
+            'SELECT COUNT(*), COALESCE(SUM(new_responses), 0), COALESCE(SUM(points), 0) FROM files'
+        ).fetchone()
+        print(f"   Exports processed: {files} ({responses} responses, {points} points)")
+
+    def close(self):
+        self.state.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Decrypt new Qualtrics exports as they land in a folder")
+    parser.add_argument('watch_dir', help="Folder that exports (.csv, .csv.gz, .zip) are dropped into")
+    parser.add_argument('--key', help="RSA private key file (.pem)")
+    parser.add_argument('--site-key', action='append', type=parse_site_key, default=[], metavar='SITE=PATH',
+                        help="Private key of one research site; repeat for mixed-site exports")
+    parser.add_argument('-o', '--output', required=True, help="Study CSV that new points are appended to")
+    parser.add_argument('--state', help="Watcher state file (default: <output>.watch.sqlite)")
+    parser.add_argument('--rollups', metavar='STORE', help="Also add new points to this daily/hourly rollup store")
+    parser.add_argument('--interval', type=float, default=30, help="Seconds between polls (default: 30)")
+    parser.add_argument('--once', action='store_true',
+                        help="Process what is in the folder now and exit (files still being written are skipped)")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="Keep points that were resent in overlapping uploads")
+    parser.add_argument('--quarantine', metavar='JSONL',
+                        help="Where to record rows that fail to decrypt (default: quarantine_<timestamp>.jsonl)")
+    parser.add_argument('--envelope-format', choices=['auto'] + ENVELOPE_FORMATS, default='auto',
+                        help="How envelopes were encrypted (default: auto, from each envelope's algorithm field)")
+    parser.add_argument('--participant-index', metavar='STORE',
+                        help="Participant index file that gives each participant a small integer ID "
+                             "(see participant_index.py); adds a participant_id column")
+    parser.add_argument('--compact-participants', action='store_true',
+                        help="With --participant-index, leave the participant_code and participant_uuid columns out")
+    args = parser.parse_args()
+    if not (args.key or args.site_key):
+        parser.error("--key or --site-key is required")
+    if args.compact_participants and not args.participant_index:
+        parser.error("--compact-participants requires --participant-index")
+    if not Path(args.watch_dir).is_dir():
+        print(f"❌ Folder not found: {args.watch_dir}")
+        sys.exit(1)
+
+    stages = [] if args.keep_duplicates else [PointDeduplicator()]
+    quarantine = QuarantineSink(args.quarantine or f"quarantine_{datetime.now().strftime('%Y%m%d_%H%M%S')}.jsonl")
+    participant_index = None
+    if args.participant_index:
+        from participant_index import ParticipantIndex
+        participant_index = ParticipantIndex(args.participant_index)
+    decryptor = LocationDecryptor(stages=stages, quarantine=quarantine, participant_index=participant_index,
+                                  compact_participants=args.compact_participants)
+    # Keys are unlocked once; the watcher then runs unattended
+    if args.key and not decryptor.load_private_key(args.key, key_password(args.key)):
+        sys.exit(1)
+    for site, site_key_path in args.site_key:
+        if not decryptor.load_private_key(site_key_path, key_password(site_key_path, site), site=site):
+            sys.exit(1)
+
+    rollups = None
+    if args.rollups:
+        from activity_rollups import RollupStore
+        rollups = RollupStore(args.rollups)
+    watcher = ExportWatcher(args.watch_dir, decryptor, args.output, args.state or f"{args.output}.watch.sqlite",
+                            rollups=rollups, envelope_format=args.envelope_format)
+    try:
+        if args.once:
+            # Two polls: the first records sizes, the second picks up files that have settled
+            watcher.poll()
+            time.sleep(min(args.interval, 2.0))
+            watcher.poll()
+        else:
+            watcher.run(args.interval)
+        watcher.summary()
+        if quarantine.count:
+            print(f"   Quarantined rows written to: {quarantine.path}")
+    finally:
+        watcher.close()
+        if rollups is not None:
+            rollups.close()
+        for stage in stages:
+            stage.close()
+        quarantine.close()
+        if participant_index is not None:
+            participant_index.close()
+
+if __name__ == '__main__':
+    main()
@@ -4,27 +4,117 @@ Convert XLSForm CSV files to QSF (Qualtrics Survey Format) JSON files
 QSF is the format used by Qualtrics for importing/exporting surveys
 """
 
-import pandas as pd
+import csv
 import json
 from pathlib import Path
 import sys
 from datetime import datetime
 import uuid
 
+def read_csv_rows(csv_file):
+    """Read an XLSForm CSV sheet into a list of dicts.
+
+    Uses the csv module rather than pandas so the survey tooling starts quickly.
+    Empty cells become None, matching how pandas would report them as missing.
+    """
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        return [
+            {k: (v if v != '' else None) for k, v in row.items() if k is not None}
+            for row in csv.DictReader(f)
+        ]
+
 class QualtricsJSONEncoder(json.JSONEncoder):
-    """Custom JSON encoder for Qualtrics compatibility"""
+    """Custom JSON encoder for Qualtrics compatibility
+
+    None values are skipped while encoding (dict entries and list items), in a
+    single pass over the object tree instead of building a cleaned copy first.
+    """
     def encode(self, obj):
-        def remove_none_values(d):
-            if isinstance(d, dict):
-                return {k: remove_none_values(v) for k, v in d.items() if v is not None}
-            elif isinstance(d, list):
-                return [remove_none_values(v) for v in d if v is not None]
+        return ''.join(self.iterencode(obj))
+
+    def iterencode(self, obj, _one_shot=False):
+        encode_str = json.encoder.encode_basestring_ascii if self.ensure_ascii else json.encoder.encode_basestring
+        if self.indent is None or isinstance(self.indent, str):
+            indent = self.indent
+        else:
+            indent = ' ' * self.indent
+        item_separator, key_separator = self.item_separator, self.key_separator
+        markers = {} if self.check_circular else None
+
+        def encode_scalar(o):
+            if isinstance(o, str):
+                return encode_str(o)
+            if o is True:
+                return 'true'
+            if o is False:
+                return 'false'
+            if isinstance(o, int):
+                return int.__repr__(o)
+            if isinstance(o, float):
+                if o != o or o in (float('inf'), float('-inf')):
+                    if not self.allow_nan:
+                        raise ValueError(f"Out of range float values are not JSON compliant: {o!r}")
+                    return 'NaN' if o != o else ('Infinity' if o > 0 else '-Infinity')
+                return float.__repr__(o)
+            return None
+
+        def walk(o, level):
+            scalar = encode_scalar(o)
+            if scalar is not None:
+                yield scalar
+                return
+            if isinstance(o, dict):
+                items = [(k, v) for k, v in o.items() if v is not None]
+                if self.sort_keys:
+                    items.sort(key=lambda kv: kv[0])
+                open_char, close_char = '{', '}'
+            elif isinstance(o, (list, tuple)):
+                items = [v for v in o if v is not None]
+                open_char, close_char = '[', ']'
             else:
-                return d
-        
-        # Remove None values before encoding
-        cleaned_obj = remove_none_values(obj)
-        return super().encode(cleaned_obj)
+                yield from walk(self.default(o), level)
+                return
+
+            if not items:
+                yield open_char + close_char
+                return
+            if markers is not None:
+                if id(o) in markers:
+                    raise ValueError("Circular reference detected")
+                markers[id(o)] = o
+
+            if indent is not None:
+                level += 1
+                newline_indent = '\n' + indent * level
+                separator = item_separator + newline_indent
+                yield open_char + newline_indent
+            else:
+                separator = item_separator
+                yield open_char
+
+            for i, item in enumerate(items):
+                if i:
+                    yield separator
+                if open_char == '{':
+                    key, value = item
+                    if not isinstance(key, str):
+                        # Same coercion as the stdlib encoder: 1 -> "1", True -> "true"
+                        key = 'null' if key is None else encode_scalar(key)
+                        if key is None:
+                            raise TypeError(f"keys must be str, int, float, bool or None, not {type(item[0]).__name__}")
+                    yield encode_str(key) + key_separator
+                    yield from walk(value, level)
+                else:
+                    yield from walk(item, level)
+
+            if indent is not None:
+                level -= 1
+                yield '\n' + indent * level
+            yield close_char
+            if markers is not None:
+                del markers[id(o)]
+
+        return walk(obj, 0)
 
 class XLSFormToQSFConverter:
     def __init__(self):
@@ -84,7 +174,14 @@ class XLSFormToQSFConverter:
         else:
             return 'SL'  # Default to single line
     
-    def create_choice_options(self, xlsform_type, choices_df):
+    def index_choices(self, choices_rows):
+        """Group choice rows by list_name so each lookup is a single dict access"""
+        choices_by_list = {}
+        for choice in choices_rows:
+            choices_by_list.setdefault(choice.get('list_name'), []).append(choice)
+        return choices_by_list
+    
+    def create_choice_options(self, xlsform_type, choices_by_list):
         """Create choice options for select questions"""
         choices = {}
         choice_order = []
@@ -97,10 +194,10 @@ class XLSFormToQSFConverter:
         else:
             return choices, choice_order
         
-        # Filter choices for this question
-        question_choices = choices_df[choices_df['list_name'] == list_name]
+        # Choices for this question
+        question_choices = choices_by_list.get(list_name, [])
         
-        for idx, choice in question_choices.iterrows():
+        for choice in question_choices:
             choice_id = str(len(choices) + 1)
             choices[choice_id] = {
                 "Display": choice['label']
@@ -155,13 +252,14 @@ class XLSFormToQSFConverter:
         """Convert XLSForm CSV files to QSF format"""
         
         # Read CSV files
-        survey_df = pd.read_csv(survey_csv)
-        choices_df = pd.read_csv(choices_csv)
-        settings_df = pd.read_csv(settings_csv)
+        survey_rows = read_csv_rows(survey_csv)
+        choices_by_list = self.index_choices(read_csv_rows(choices_csv))
+        settings_rows = read_csv_rows(settings_csv)
+        settings = settings_rows[0] if settings_rows else {}
         
         # Get survey metadata
-        survey_id = settings_df.iloc[0]['form_id'] if 'form_id' in settings_df.columns else survey_name.replace(' ', '_')
-        survey_title = settings_df.iloc[0]['form_title'] if 'form_title' in settings_df.columns else survey_name
+        survey_id = settings['form_id'] if 'form_id' in settings else survey_name.replace(' ', '_')
+        survey_title = settings['form_title'] if 'form_title' in settings else survey_name
         
         # Generate proper Qualtrics IDs
         survey_uid = f"SV_{uuid.uuid4().hex[:16]}"
@@ -201,7 +299,7 @@ class XLSFormToQSFConverter:
         questions = {}
         question_order = []
         
-        for idx, question in survey_df.iterrows():
+        for question in survey_rows:
             # Skip start/end metadata questions
             if question['type'] in ['start', 'end']:
                 continue
@@ -233,12 +331,12 @@ class XLSFormToQSFConverter:
             }
             
             # Add hint as sub-text if present
-            if pd.notna(question.get('hint', '')):
+            if question.get('hint') is not None:
                 question_data["QuestionText"] += f"<br><em>{question['hint']}</em>"
             
             # Handle choice questions
             if question['type'].startswith('select_'):
-                choices, choice_order = self.create_choice_options(question['type'], choices_df)
+                choices, choice_order = self.create_choice_options(question['type'], choices_by_list)
                 
                 if choices:  # Only add if choices exist
                     question_data["Choices"] = choices
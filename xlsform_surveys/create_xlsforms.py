@@ -2,55 +2,119 @@
 """
 Convert CSV files to XLSForm Excel workbooks
 Creates proper Excel files with survey, choices, and settings worksheets
+
+By default rows are streamed from each CSV straight into write-only worksheets,
+so memory use stays flat no matter how long the choice lists get, and the
+workbooks are generated in parallel. Use --in-memory for the original pandas
+DataFrame path.
 """
 
-import pandas as pd
+import argparse
+import csv
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import sys
 
-def create_xlsform_workbook(survey_csv, choices_csv, settings_csv, output_xlsx):
+SHEET_NAMES = ['survey', 'choices', 'settings']
+
+def create_xlsform_workbook(survey_csv, choices_csv, settings_csv, output_xlsx, streaming=False):
     """Create an XLSForm Excel workbook from CSV files"""
+    if streaming:
+        return create_xlsform_workbook_streaming(survey_csv, choices_csv, settings_csv, output_xlsx)
+
     try:
+        # pandas/openpyxl are only needed for Excel output, so import them here
+        # rather than at module load
+        import pandas as pd
+
         # Read CSV files
         survey_df = pd.read_csv(survey_csv)
         choices_df = pd.read_csv(choices_csv)
         settings_df = pd.read_csv(settings_csv)
-        
+
         # Create Excel writer
         with pd.ExcelWriter(output_xlsx, engine='openpyxl') as writer:
             # Write each worksheet
             survey_df.to_excel(writer, sheet_name='survey', index=False)
             choices_df.to_excel(writer, sheet_name='choices', index=False)
             settings_df.to_excel(writer, sheet_name='settings', index=False)
-            
+
         print(f"Successfully created {output_xlsx}")
         return True
-        
+
     except Exception as e:
         print(f"Error creating {output_xlsx}: {e}")
         return False
 
+def create_xlsform_workbook_streaming(survey_csv, choices_csv, settings_csv, output_xlsx):
+    """Create an XLSForm Excel workbook by streaming CSV rows into write-only worksheets
+
+    Cells are written as text exactly as they appear in the CSV (XLSForm tools
+    read every cell as text anyway); empty cells are left blank.
+    """
+    try:
+        from openpyxl import Workbook
+
+        workbook = Workbook(write_only=True)
+        for sheet_name, csv_file in zip(SHEET_NAMES, [survey_csv, choices_csv, settings_csv]):
+            worksheet = workbook.create_sheet(title=sheet_name)
+            with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+                for row in csv.reader(f):
+                    worksheet.append([cell if cell != '' else None for cell in row])
+        workbook.save(output_xlsx)
+
+        print(f"Successfully created {output_xlsx}")
+        return True
+
+    except Exception as e:
+        print(f"Error creating {output_xlsx}: {e}")
+        return False
+
+def create_xlsform_workbooks(jobs, streaming=True, max_workers=None):
+    """Create several XLSForm workbooks concurrently
+
+    `jobs` is a list of (survey_csv, choices_csv, settings_csv, output_xlsx)
+    tuples. Each workbook is built in its own process; returns one success flag
+    per job, in order.
+    """
+    if max_workers == 1 or len(jobs) <= 1:
+        return [create_xlsform_workbook(*job, streaming=streaming) for job in jobs]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(create_xlsform_workbook, *job, streaming=streaming) for job in jobs]
+        return [future.result() for future in futures]
+
 def main():
+    parser = argparse.ArgumentParser(description="Create XLSForm Excel workbooks from CSV files")
+    parser.add_argument('--in-memory', action='store_true',
+                        help="Build each workbook in memory with pandas instead of streaming rows")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="Number of workbooks to generate in parallel (default: one per CPU)")
+    args = parser.parse_args()
+
     # Get the current directory
     current_dir = Path(__file__).parent
-    
-    # Create biweekly survey workbook
-    biweekly_success = create_xlsform_workbook(
-        current_dir / 'biweekly_survey_data.csv',
-        current_dir / 'biweekly_choices_data.csv', 
-        current_dir / 'biweekly_settings_data.csv',
-        current_dir / 'Biweekly_Wellbeing_Survey_XLSForm.xlsx'
-    )
-    
-    # Create initial survey workbook  
-    initial_success = create_xlsform_workbook(
-        current_dir / 'initial_survey_data.csv',
-        current_dir / 'initial_choices_data.csv',
-        current_dir / 'initial_settings_data.csv', 
-        current_dir / 'Initial_Survey_XLSForm.xlsx'
-    )
-    
-    if biweekly_success and initial_success:
+
+    jobs = [
+        # Biweekly survey workbook
+        (
+            current_dir / 'biweekly_survey_data.csv',
+            current_dir / 'biweekly_choices_data.csv',
+            current_dir / 'biweekly_settings_data.csv',
+            current_dir / 'Biweekly_Wellbeing_Survey_XLSForm.xlsx'
+        ),
+        # Initial survey workbook
+        (
+            current_dir / 'initial_survey_data.csv',
+            current_dir / 'initial_choices_data.csv',
+            current_dir / 'initial_settings_data.csv',
+            current_dir / 'Initial_Survey_XLSForm.xlsx'
+        ),
+    ]
+
+    results = create_xlsform_workbooks(jobs, streaming=not args.in_memory, max_workers=args.workers)
+
+    if all(results):
         print("\n✅ Both XLSForm workbooks created successfully!")
         print("Files created:")
         print("- Biweekly_Wellbeing_Survey_XLSForm.xlsx")